@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# Author: Pablo Iranzo Gomez (Pablo.Iranzo@gmail.com)
+#
+# Description: Daemon keeping a snapshot of hosts and storage domains status for nagios checks
+#
+# Requires rhevm-sdk to work
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import optparse
+
+import rhev_status
+from rhev_functions import *
+
+description = """
+RHEV-nagios-daemon keeps one session to RHEV-M and refreshes periodically the status, CPU, memory and VM
+count of hosts and usage of storage domains, answering on a unix socket to nagios checks called with --socket
+
+"""
+
+# Option parsing
+p = optparse.OptionParser("rhev-nagios-daemon.py [arguments]", description=description)
+p.add_option("-u", "--user", dest="username", help="Username to connect to RHEVM API", metavar="admin@internal",
+             default="admin@internal")
+p.add_option("-w", "--password", dest="password", help="Password to use with username", metavar="admin",
+             default="admin")
+p.add_option("-W", action="store_true", dest="askpassword", help="Ask for password", metavar="admin", default=False)
+p.add_option("-k", action="store_true", dest="keyring", help="use python keyring for user/password", metavar="keyring",
+             default=False)
+p.add_option("-s", "--server", dest="server", help="RHEV-M server address/hostname to contact", metavar="127.0.0.1",
+             default="127.0.0.1")
+p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
+p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
+             type='int')
+add_common_options(p)
+p.add_option("--socket", dest="socket", help="Unix socket to answer checks on", metavar="socket",
+             default=rhev_status.STATUS_SOCKET)
+p.add_option("--group", dest="group", help="Group allowed to run checks using the socket", metavar="nagios",
+             default=None)
+p.add_option("--interval", dest="interval", help="Seconds between refreshes of status", metavar="60", default=60,
+             type='int')
+p.add_option("--concurrency", dest="concurrency", help="Simultaneous requests when reading host statistics",
+             metavar="8", default=8, type='int')
+
+(options, args) = p.parse_args()
+
+options.username, options.password = getuserpass(options)
+
+baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
+
+api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+# Hosts and storage domains are read as compact records, per host statistics several at once
+reader = RestReader(api, baseurl, options.username, options.password, concurrency=options.concurrency)
+
+
+# FUNCTIONS
+def gather():
+    """Returns dictionary of kind -> {name: values} with current status of hosts and storage domains"""
+    tagindex = TagIndex(api)
+    hosts = list(paginate(reader.collection("hosts"), workers=4))
+    statistics = reader.statistics("hosts", [host.id for host in hosts])
+
+    values = {"hosts": {}, "storagedomains": {}}
+    for host in hosts:
+        stats = statistics.get(host.id, {})
+        cpu = None
+        if "cpu.current.idle" in stats:
+            cpu = 100 - stats["cpu.current.idle"]
+        values["hosts"][host.name] = {
+            "state": host.status.state,
+            "elas_maint": tagindex.has("hosts", host, "elas_maint"),
+            "cpu": cpu,
+            "memory.used": stats.get("memory.used"),
+            "memory.total": stats.get("memory.total"),
+            "vms": host.summary.total if host.summary else 0,
+        }
+
+    for sd in reader.records("storagedomains"):
+        values["storagedomains"][sd.name] = {"used": sd.used, "available": sd.available}
+
+    return values
+
+
+# MAIN PROGRAM
+if __name__ == "__main__":
+    snapshot = rhev_status.Snapshot()
+    rhev_status.serve(options.socket, snapshot, options.group)
+
+    while True:
+        start = time.time()
+        try:
+            snapshot.update(gather())
+            if options.verbosity >= 1:
+                print("Status refreshed in %.1fs" % (time.time() - start))
+        except:
+            # Keep serving last snapshot until it's too old for checks
+            if options.verbosity >= 1:
+                print("Problem refreshing status")
+        time.sleep(max(0, options.interval - (time.time() - start)))
@@ -17,8 +17,10 @@
 # GNU General Public License for more details.
 
 import optparse
+import sys
 
-from rhev_functions import *
+import rhev_options
+import rhev_status
 
 description = """
 RHEV-nagios-host-cpu output  is a script for querying RHEVM via API to get host status
@@ -41,23 +43,38 @@ p.add_option("-s", "--server", dest="server", help="RHEV-M server address/hostna
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+rhev_options.add_common_options(p)
 p.add_option("--host", dest="host", help="Show messages while running", metavar='host')
+p.add_option("--socket", dest="socket", help="Read values from rhev-nagios-daemon.py listening on socket",
+             metavar="socket", default=None)
+p.add_option("--daemon", action="store_true", dest="daemon", help="Read values from rhev-nagios-daemon.py listening "
+             "on its default socket", default=False)
 
 (options, args) = p.parse_args()
 
-options.username, options.password = getuserpass(options)
+if options.daemon and not options.socket:
+    options.socket = rhev_status.STATUS_SOCKET
 
-baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
+# MAIN PROGRAM
+if options.socket:
+    # Values kept by rhev-nagios-daemon.py, without loading rhevm-sdk nor logging in
+    host = rhev_status.lookup(options.socket, "hosts", options.host)
+else:
+    from rhev_functions import *
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+    options.username, options.password = getuserpass(options)
 
-# MAIN PROGRAM
-# if not options.host:
+    baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-try:
-    host = api.hosts.get(name=options.host)
-except:
-    print("Host %s not found" % options.host)
+    api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+    host = None
+    try:
+        host = api.hosts.get(name=options.host)
+    except:
+        print("Host %s not found" % options.host)
+    if host:
+        host = {"cpu": 100 - host.statistics.get(name="cpu.current.idle").values.value[0].datum}
 
 if not host:
     print("Host %s not found" % options.host)
@@ -70,7 +87,11 @@ if not host:
 # 3 -> unknown
 
 # By default, return unknown
-usage = (100 - host.statistics.get(name="cpu.current.idle").values.value[0].datum)
+usage = host["cpu"]
+if usage is None:
+    # rhev-nagios-daemon.py couldn't read statistics of host
+    print("No CPU usage for host %s" % options.host)
+    sys.exit(3)
 
 retorno = 3
 if usage >= 90:
@@ -17,8 +17,10 @@
 # GNU General Public License for more details.
 
 import optparse
+import sys
 
-from rhev_functions import *
+import rhev_options
+import rhev_status
 
 description = """
 RHEV-nagios-host-mem output  is a script for querying RHEVM via API to get host status
@@ -41,22 +43,40 @@ p.add_option("-s", "--server", dest="server", help="RHEV-M server address/hostna
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+rhev_options.add_common_options(p)
 p.add_option("--host", dest="host", help="Show messages while running", metavar='host')
+p.add_option("--socket", dest="socket", help="Read values from rhev-nagios-daemon.py listening on socket",
+             metavar="socket", default=None)
+p.add_option("--daemon", action="store_true", dest="daemon", help="Read values from rhev-nagios-daemon.py listening "
+             "on its default socket", default=False)
 
 (options, args) = p.parse_args()
 
-options.username, options.password = getuserpass(options)
+if options.daemon and not options.socket:
+    options.socket = rhev_status.STATUS_SOCKET
 
-baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
+# MAIN PROGRAM
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+if options.socket:
+    # Values kept by rhev-nagios-daemon.py, without loading rhevm-sdk nor logging in
+    host = rhev_status.lookup(options.socket, "hosts", options.host)
+else:
+    from rhev_functions import *
 
-# MAIN PROGRAM
+    options.username, options.password = getuserpass(options)
 
-try:
-    host = api.hosts.get(name=options.host)
-except:
-    print("Host %s not found" % options.host)
+    baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
+
+    api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+    host = None
+    try:
+        host = api.hosts.get(name=options.host)
+    except:
+        print("Host %s not found" % options.host)
+    if host:
+        host = {"memory.used": host.statistics.get(name="memory.used").values.value[0].datum,
+                "memory.total": host.statistics.get(name="memory.total").values.value[0].datum}
 
 if not host:
     print("Host %s not found" % options.host)
@@ -68,8 +88,12 @@ if not host:
 # 2 -> critical
 # 3 -> unknown
 
-memory = host.statistics.get(name="memory.used").values.value[0].datum
-memtotal = host.statistics.get(name="memory.total").values.value[0].datum
+memory = host["memory.used"]
+memtotal = host["memory.total"]
+if memory is None or not memtotal:
+    # rhev-nagios-daemon.py couldn't read statistics of host
+    print("No memory usage for host %s" % options.host)
+    sys.exit(3)
 
 percentage = int(100 * memory / memtotal)
 
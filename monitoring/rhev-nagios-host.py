@@ -17,8 +17,10 @@
 # GNU General Public License for more details.
 
 import optparse
+import sys
 
-from rhev_functions import *
+import rhev_options
+import rhev_status
 
 description = """
 RHEV-nagios-host output  is a script for querying RHEVM via API to get host status
@@ -41,25 +43,40 @@ p.add_option("-s", "--server", dest="server", help="RHEV-M server address/hostna
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+rhev_options.add_common_options(p)
 p.add_option("--host", dest="host", help="Show messages while running", metavar='host')
+p.add_option("--socket", dest="socket", help="Read values from rhev-nagios-daemon.py listening on socket",
+             metavar="socket", default=None)
+p.add_option("--daemon", action="store_true", dest="daemon", help="Read values from rhev-nagios-daemon.py listening "
+             "on its default socket", default=False)
 
 (options, args) = p.parse_args()
 
-options.username, options.password = getuserpass(options)
+if options.daemon and not options.socket:
+    options.socket = rhev_status.STATUS_SOCKET
 
-baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+# MAIN PROGRAM
 
+if options.socket:
+    # Values kept by rhev-nagios-daemon.py, without loading rhevm-sdk nor logging in
+    host = rhev_status.lookup(options.socket, "hosts", options.host)
+else:
+    from rhev_functions import *
 
-# MAIN PROGRAM
+    options.username, options.password = getuserpass(options)
 
-# if not options.host:
+    baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-try:
-    host = api.hosts.get(name=options.host)
-except:
-    print("Host %s not found" % options.host)
+    api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+    host = None
+    try:
+        host = api.hosts.get(name=options.host)
+    except:
+        print("Host %s not found" % options.host)
+    if host:
+        host = {"state": host.status.state, "elas_maint": bool(host.tags.get("elas_maint"))}
 
 if not host:
     print("Host %s not found" % options.host)
@@ -73,15 +90,15 @@ if not host:
 
 # By default, return unknown
 retorno = 3
-if host.status.state == "up":
+if host["state"] == "up":
     retorno = 0
 
-if host.status.state != "up":
+if host["state"] != "up":
     retorno = 2
-    if host.tags.get("elas_maint"):
+    if host["elas_maint"]:
         retorno = 1
-    if host.status.state == "maintenance":
+    if host["state"] == "maintenance":
         retorno = 1
 
-print(host.status.state)
+print(host["state"])
 sys.exit(retorno)
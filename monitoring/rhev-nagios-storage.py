@@ -17,8 +17,10 @@
 # GNU General Public License for more details.
 
 import optparse
+import sys
 
-from rhev_functions import *
+import rhev_options
+import rhev_status
 
 description = """
 RHEV-nagios-storage output  is a script for querying RHEVM via API to get host status
@@ -41,25 +43,40 @@ p.add_option("-W", action="store_true", dest="askpassword", help="Ask for passwo
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+rhev_options.add_common_options(p)
 p.add_option("--storage", dest="storage", help="Show messages while running", metavar='storage')
+p.add_option("--socket", dest="socket", help="Read values from rhev-nagios-daemon.py listening on socket",
+             metavar="socket", default=None)
+p.add_option("--daemon", action="store_true", dest="daemon", help="Read values from rhev-nagios-daemon.py listening "
+             "on its default socket", default=False)
 
 (options, args) = p.parse_args()
 
-options.username, options.password = getuserpass(options)
+if options.daemon and not options.socket:
+    options.socket = rhev_status.STATUS_SOCKET
 
-baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+# MAIN PROGRAM
 
+if options.socket:
+    # Values kept by rhev-nagios-daemon.py, without loading rhevm-sdk nor logging in
+    sd = rhev_status.lookup(options.socket, "storagedomains", options.storage)
+else:
+    from rhev_functions import *
 
-# MAIN PROGRAM
+    options.username, options.password = getuserpass(options)
 
-# if not options.host:
+    baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-try:
-    sd = api.storagedomains.get(name=options.storage)
-except:
-    print("Storage Domain %s not found" % options.storage)
+    api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+    sd = None
+    try:
+        sd = api.storagedomains.get(name=options.storage)
+    except:
+        print("Storage Domain %s not found" % options.storage)
+    if sd:
+        sd = {"used": sd.used, "available": sd.available}
 
 if not sd:
     print("Storage Domain %s not found" % options.storage)
@@ -71,8 +88,12 @@ if not sd:
 # 2 -> critical
 # 3 -> unknown
 
-memory = sd.used
-memtotal = sd.available
+memory = sd["used"]
+memtotal = sd["available"]
+if memory is None or not memtotal:
+    # rhev-nagios-daemon.py couldn't read usage of storage domain
+    print("No usage for storage domain %s" % options.storage)
+    sys.exit(3)
 
 percentage = int(100 * memory / memtotal)
 
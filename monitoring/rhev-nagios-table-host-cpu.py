@@ -65,7 +65,12 @@ except:
 for line in f:
     if line.split(";")[0] == "host":
         if line.split(";")[1] == options.host:
-            usage = int(line.split(";")[3])
+            try:
+                usage = int(line.split(";")[3])
+            except ValueError:
+                # Left blank by rhev-nagios-table.py when host statistics couldn't be read
+                print("No value for host %s" % options.host)
+                sys.exit(3)
             retorno = 3
             if usage >= 90:
                 retorno = 1
@@ -66,7 +66,12 @@ except:
 for line in f:
     if line.split(";")[0] == "host":
         if line.split(";")[1] == options.host:
-            usage = float(line.split(";")[4])
+            try:
+                usage = float(line.split(";")[4])
+            except ValueError:
+                # Left blank by rhev-nagios-table.py when host statistics couldn't be read
+                print("No value for host %s" % options.host)
+                sys.exit(3)
             retorno = 3
             if usage >= 90:
                 retorno = 1
@@ -43,7 +43,10 @@ p.add_option("-s", "--server", dest="server", help="RHEV-M server address/hostna
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+add_common_options(p)
 p.add_option("-t", "--table", dest="table", help="Output file in CSV format", metavar='table')
+p.add_option("--concurrency", dest="concurrency", help="Max requests running at once for per object data",
+             metavar='[1-n]', default=8, type='int')
 
 (options, args) = p.parse_args()
 
@@ -51,7 +54,13 @@ options.username, options.password = getuserpass(options)
 
 baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+# Tag membership of hosts for this run
+tagindex = sharedstate(api, engine=baseurl)[2]
+
+# Hosts and storage domains are read as compact records, per host statistics several at once
+reader = RestReader(api, baseurl, options.username, options.password, concurrency=options.concurrency)
 
 
 # MAIN PROGRAM
@@ -64,17 +73,25 @@ except:
 f.write("TYPE;HOST;STATE;CPU;MEM;VMS;MEMUSED;\n")
 
 # FUNCTIONS
-for host in paginate(api.hosts):
-    memory = host.statistics.get(name="memory.used").values.value[0].datum
-    memtotal = host.statistics.get(name="memory.total").values.value[0].datum
-    usage = (100 - host.statistics.get(name="cpu.current.idle").values.value[0].datum)
-    percentage = int(100 * memory / memtotal)
-    vms = host.summary.total
+hosts = list(paginate(reader.collection("hosts"), workers=4))
+statistics = reader.statistics("hosts", [host.id for host in hosts])
+for host in hosts:
+    # Values of hosts whose statistics couldn't be read are left blank, checks report them as unknown
+    stats = statistics.get(host.id, {})
+    memory = stats.get("memory.used", "")
+    memtotal = stats.get("memory.total")
+    usage = ""
+    if "cpu.current.idle" in stats:
+        usage = (100 - stats["cpu.current.idle"])
+    percentage = ""
+    if memory != "" and memtotal:
+        percentage = int(100 * memory / memtotal)
+    vms = host.summary.total if host.summary else ""
 
     # Patch exit status based on elas_maint
     if host.status.state != "up":
         status = "unknown"
-        if host.tags.get("elas_maint"):
+        if tagindex.has("hosts", host, "elas_maint"):
             status = "up"
         if host.status.state == "maintenance":
             status = "maintenance"
@@ -85,7 +102,7 @@ for host in paginate(api.hosts):
     f.write(fullstatus)
 
 f.write("TYPE;SD;PCTG\n")
-for sd in api.storagedomains.list():
+for sd in reader.records("storagedomains"):
     try:
         memory = sd.used
     except:
@@ -43,7 +43,10 @@ p.add_option("-s", "--server", dest="server", help="RHEV-M server address/hostna
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+add_common_options(p)
 p.add_option('-c', "--cluster", dest="cluster", help="Select cluster name to process", metavar='cluster', default=None)
+p.add_option("--cache", dest="cache", help="Inventory cache file to share listings between runs", metavar="file",
+             default=None)
 
 (options, args) = p.parse_args()
 
@@ -51,7 +54,10 @@ options.username, options.password = getuserpass(options)
 
 baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+# Listings shared with other runs and tag membership of vms for this run
+inventory, idmap, tagindex = sharedstate(api, options.cache, baseurl)
 
 
 def process_cluster(clusid):
@@ -59,17 +65,19 @@ def process_cluster(clusid):
     @param clusid: Cluster ID to process
     """
     query = "cluster = %s" % api.clusters.get(id=clusid).name
-    for vm in paginate(api.vms, query):
+    for vm in inventory.list("vms", query):
         if vm.cluster.id == clusid:
-            if vm.tags.get("elas_manage"):
-                for tag in vm.tags.list():
-                    if tag.name[0:8] == "cluster_":
-                        if vm.placement_policy.affinity != "migratable":
-                            if options.verbosity > 1:
-                                print("VM %s pinning removed" % vm.name)
-                        vm.placement_policy.affinity = "migratable"
-                        vm.placement_policy.host = params.Host()
-                        vm.update()
+            if tagindex.has("vms", vm, "elas_manage"):
+                if tagindex.tagsof("vms", vm, "cluster_"):
+                    # Listing may come from cache, get current values before changing them
+                    vm = inventory.fresh("vms", id=vm.id)
+                    if vm.placement_policy.affinity != "migratable":
+                        if options.verbosity > 1:
+                            print("VM %s pinning removed" % vm.name)
+                    vm.placement_policy.affinity = "migratable"
+                    vm.placement_policy.host = params.Host()
+                    vm.update()
+                    inventory.invalidate("vms")
     return
 
 
@@ -77,7 +85,10 @@ def process_cluster(clusid):
 if __name__ == "__main__":
     if not options.cluster:
         # Processing each cluster of our RHEVM
-        for cluster in api.clusters.list():
-            process_cluster(cluster.id)
+        for cluster in inventory.list("clusters"):
+            with clusterlock(cluster.id, baseurl):
+                process_cluster(cluster.id)
     else:
-        process_cluster(api.clusters.get(name=options.cluster).id)
+        cluster = api.clusters.get(name=options.cluster)
+        with clusterlock(cluster.id, baseurl):
+            process_cluster(cluster.id)
@@ -51,6 +51,7 @@ p.add_option("-s", "--server", dest="server", help="RHEV-M server address/hostna
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+add_common_options(p)
 p.add_option("-n", "--name", dest="name", help="VM name", metavar="name", default="name")
 p.add_option("-c", "--cluster", dest="cluster", help="VM cluster", metavar="cluster", default="cluster")
 p.add_option("-t", "--template", dest="template", help="VM template", metavar="template", default="template")
@@ -61,7 +62,7 @@ options.username, options.password = getuserpass(options)
 
 baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
 
 # MAIN PROGRAM
 # Check if we have defined needed tags and create them if missing
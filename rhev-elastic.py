@@ -19,7 +19,7 @@
 
 # Goals:
 # - Do not manage any host without tag elas_manage
-# - Operate on one host per execution, exiting after each change
+# - Operate on one host per execution, exiting after each change (or on all hosts needed by demand with --demand)
 # - Have at least one host up without vm's to hold new VM's
 # - Shutdown/suspend hosts without vm's until there's only one left
 # - If a host has been put on maintenance and has no tag, it will not be activated by the script
@@ -30,10 +30,11 @@
 # elas_manage: manage this host by using the elastic management script (EMS)
 # elas_maint : this host has been put on maintenance by the EMS
 
+import math
 import optparse
-import os
-from random import choice
+from multiprocessing.pool import ThreadPool
 
+import rhev_power
 from rhev_functions import *
 
 description = """
@@ -43,6 +44,10 @@ It's goal is to keep the higher amount of hosts turned off or suspended in
 order to save energy, automatically activating or deactivating hosts when
 needed in order to satisfy your environment needs.
 
+With --demand, instead of changing one host per run, it keeps up as many hosts
+as needed by memory of running VM's and CPU usage plus --headroom percentage,
+activating or deactivating all hosts required at once.
+
 """
 
 # Option parsing
@@ -60,9 +65,32 @@ p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="4
 p.add_option("-a", "--action", dest="action", help="Power action to execute", metavar="action", default="pm-suspend")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+add_common_options(p)
 p.add_option('-t', "--tagall", dest="tagall", help="Tag all hosts with elas_manage", metavar='0/1', default=0,
              type='int')
 p.add_option('-c', "--cluster", dest="cluster", help="Select cluster name to process", metavar='cluster', default=None)
+p.add_option("--cache", dest="cache", help="Inventory cache file to share listings between runs", metavar="file",
+             default=None)
+p.add_option("--demand", action="store_true", dest="demand", help="Keep up hosts needed by VM's memory and CPU "
+             "demand, changing several at once", default=False)
+p.add_option("--headroom", dest="headroom", help="Percentage of capacity to keep over demand with --demand",
+             metavar="20", default=20, type='int')
+p.add_option("--consolidate", dest="consolidate", help="Max hosts to empty per run migrating their VM's to other "
+             "hosts, so they can be put on maintenance", metavar="0", default=0, type='int')
+p.add_option("--power-weight", dest="powerweight", help="Preference for keeping up hosts using less power (1) over "
+             "hosts with more memory (0) when choosing hosts", metavar="0.5", default=POWER_WEIGHT, type='float')
+p.add_option("--boot-timeout", dest="boottimeout", help="Seconds to wait at the end of the run for hosts powered on "
+             "to be up, recording how long they take for ranking, 0 to not wait", metavar="0", default=0, type='int')
+p.add_option("--wol", dest="wol", help="Interfaces to send Wake-on-LAN packets from, all up by default",
+             metavar="eth0,eth1", default=None)
+p.add_option("--concurrency", dest="concurrency", help="Simultaneous requests when reading host statistics and "
+             "hosts running the power action", metavar="8", default=8, type='int')
+p.add_option("--power-timeout", dest="powertimeout", help="Seconds for each attempt of the power action on a host",
+             metavar="60", default=rhev_power.POWER_TIMEOUT, type='int')
+p.add_option("--power-attempts", dest="powerattempts", help="Times to try the power action on a host until it "
+             "succeeds", metavar="3", default=rhev_power.POWER_ATTEMPTS, type='int')
+p.add_option("--power-command", dest="powercommand", help="Local command run with host address and action as "
+             "arguments instead of ssh", metavar="command", default=None)
 
 (options, args) = p.parse_args()
 
@@ -70,13 +98,43 @@ options.username, options.password = getuserpass(options)
 
 baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+# Listings shared with other runs and cache of hosts/vms/clusters read during this run, kept for next
+# scripts when run from rhevm-utils.py
+inventory, idmap, tagindex = sharedstate(api, options.cache, baseurl)
+
+# Power actions run over ssh, or the command given, on several hosts at once
+if options.powercommand:
+    transport = rhev_power.CommandTransport(options.powercommand)
+else:
+    transport = rhev_power.SshTransport()
+executor = rhev_power.PowerExecutor(transport, concurrency=options.concurrency, timeout=options.powertimeout,
+                                    attempts=options.powerattempts)
+
+# Running vms are read as compact records and host statistics several at once for --demand
+reader = RestReader(api, baseurl, options.username, options.password, concurrency=options.concurrency)
+vmstats = VmStats(api, reader, idmap)
+
+# Hosts powered on during this run, to wait for them once all clusters are processed
+poweredon = []
 
 
 # FUNCTIONS
+def hostname(target):
+    """Returns name of host for messages, its ID if the engine can't tell
+    @param target: Host ID
+    """
+    try:
+        return idmap.hosts.get(id=target).name
+    except:
+        return target
+
+
 def deactivate_host(target):
     """Deactivates hosts putting it on maintenance and associating required tags
     @param target: Host ID to activate
+    @return: (name, address, action) to power off the host, None if it didn't reach maintenance
     """
     host = api.hosts.get(id=target)
     # Shutting down one host at a time...
@@ -85,12 +143,19 @@ def deactivate_host(target):
 
     # Add elas_maint TAG to host
     host.tags.add(params.Tag(name="elas_maint"))
+    tagindex.add("hosts", target, "elas_maint")
+
+    # Save MACs and address now, so powering it on doesn't need to ask the engine for them
+    try:
+        savehost(api, target, baseurl)
+    except:
+        print("Error saving MAC addresses of host %s" % host.name)
 
     # Set host on maintenance
     try:
         host.deactivate()
     except:
-        print("Error deactivating host %s" % api.hosts.get(id=target).name)
+        print("Error deactivating host %s" % hostname(target))
 
     # Get host IP
     ip = host.address
@@ -109,18 +174,40 @@ def deactivate_host(target):
             time.sleep(2)
         i += 1
 
+    # Host status changed, drop listings other runs could reuse
+    inventory.invalidate("hosts")
+
     if api.hosts.get(id=target).status.state == "maintenance":
-        # Execute power action
-        # /etc/pki/rhevm/keys/rhevm_id_rsa
-        if options.verbosity >= 1:
-            print("Sending %s the power action %s" % (host, options.action))
+        hostevent(target, "down", baseurl)
+        return (host.name, ip, options.action)
+    return None
 
-        comando = '/usr/bin/ssh -o StrictHostKeyChecking=no -o ServerAliveInterval=10 -i ' \
-                  '/etc/pki/ovirt-engine/keys/engine_id_rsa root@%s %s ' % (ip, options.action)
 
-        os.system(comando)
-        os.system(comando)
-        os.system(comando)
+def deactivate_hosts(targets):
+    """Puts hosts on maintenance and runs the power action on all of them at once
+    @param targets: Host IDs to deactivate
+    """
+    def deactivate(target):
+        # Engine failing for one host doesn't stop the others
+        try:
+            return deactivate_host(target)
+        except Exception as e:
+            print("Error putting host %s into maintenance: %s" % (hostname(target), errortext(e)))
+            return None
+
+    pool = ThreadPool(len(targets))
+    try:
+        actions = [action for action in pool.map(deactivate, targets) if action]
+    finally:
+        pool.close()
+
+    # Execute power action, one unreachable host doesn't delay the others
+    if options.verbosity >= 1:
+        for name, ip, action in actions:
+            print("Sending %s the power action %s" % (name, action))
+    for result in executor.execute(actions):
+        if result["result"] not in ("ok", "sent") or options.verbosity >= 2:
+            print(rhev_power.report([result])[0])
     return
 
 
@@ -133,35 +220,204 @@ def activate_host(target):
         print("Activating target %s" % target)
 
     # Remove elas_maint TAG to host
-    if not api.hosts.get(id=target).tags.get(name="elas_maint"):
+    if tagindex.has("hosts", target, "elas_maint"):
         try:
             api.hosts.get(id=target).tags.get(name="elas_maint").delete()
+            tagindex.remove("hosts", target, "elas_maint")
         except:
-            print("Error deleting tag elas_maint from host %s" % api.host.get(id=target).name)
+            print("Error deleting tag elas_maint from host %s" % hostname(target))
 
     if api.hosts.get(id=target).status.state == "maintenance":
         api.hosts.get(id=target).activate()
 
-    # Get Host MAC
-    for nic in api.hosts.get(id=target).nics.list():
-        mac = nic.mac.get_address()
-        # By default, send wol using every single nic at RHEVM host
-        if mac != "":
-            comando = "for tarjeta in $(for card in $(ls -d /sys/class/net/*/);do echo $(basename $card);done);do " \
-                      "ether-wake -i $tarjeta %s ;done" % mac
-            if options.verbosity >= 1:
-                print("Sending %s the power on action via %s" % (target, mac))
-            os.system(comando)
+    # Host status changed, drop listings other runs could reuse
+    inventory.invalidate("hosts")
+    return
+
+
+def activate_hosts(targets):
+    """Powers hosts on all at once and then reactivates them
+    @param targets: Host IDs to activate
+    """
+    def macs(target):
+        try:
+            return hostmacs(api, target, baseurl)
+        except Exception as e:
+            print("Error reading MAC addresses of host %s: %s" % (hostname(target), errortext(e)))
+            return []
+
+    def activate(target):
+        # Engine failing for one host doesn't stop the others
+        try:
+            activate_host(target)
+        except Exception as e:
+            print("Error activating host %s: %s" % (hostname(target), errortext(e)))
 
+    pool = ThreadPool(len(targets))
+    try:
+        # MACs saved when hosts were put on maintenance, so they're woken up even if the engine can't activate
+        # them. By default, send wol using every single nic at RHEVM host
+        wakeup(options, sum(pool.map(macs, targets), []))
+        for target in targets:
+            hostevent(target, "up", baseurl)
+        pool.map(activate, targets)
+    finally:
+        pool.close()
+    poweredon.extend(targets)
     return
 
 
+def rank(targets, hosts, activating):
+    """Returns host IDs sorted from best to worst to power on or off by their history, boot time, memory and cores
+    @param targets: candidate host IDs
+    @param hosts: hosts of the cluster
+    @param activating: True to rank for power on, False for power off
+    """
+    memory = dict([(host.id, host.memory) for host in hosts])
+    cpus = dict([(host.id, hostcpus(host)) for host in hosts])
+    return rankhosts(targets, memory, baseurl, activating, options.powerweight, cpus=cpus)
+
+
+def hosts_needed(clusid, hosts):
+    """Returns number of hosts that must be up in cluster for memory and CPU demand plus headroom
+    @param clusid: Identifies Cluster ID to process
+    @param hosts: hosts of the cluster
+    """
+    up = [host for host in hosts if host.status.state == "up"]
+    factor = 1 + options.headroom / 100.0
+
+    # Memory assigned to every vm not down, in hosts of average size
+    query = "cluster = %s and status != down" % idmap.clusters.get(id=clusid).name
+    demand = sum([vm.memory or 0 for vm in paginate(reader.collection("vms"), query, workers=4)])
+    sizes = [host.memory for host in hosts if host.memory]
+    formemory = 0
+    if sizes:
+        formemory = int(math.ceil(demand * factor / (float(sum(sizes)) / len(sizes))))
+
+    # CPU in use by hosts up, as number of fully busy hosts
+    statistics = reader.statistics("hosts", [host.id for host in up])
+    busy = sum([(100 - statistics.get(host.id, {}).get("cpu.current.idle", 100)) / 100.0 for host in up])
+    forcpu = int(math.ceil(busy * factor))
+
+    if options.verbosity >= 1:
+        print("Demand: %s GiB of memory (%s hosts), %.1f hosts of CPU (%s hosts) with %s%% headroom" % (
+            demand / 1024 ** 3, formemory, busy, forcpu, options.headroom))
+    return max(1, formemory, forcpu)
+
+
+def consolidate(clusid, hosts, limit, keep=1):
+    """Empties hosts whose VM's fit on the other hosts up of the cluster and returns the ones emptied
+    @param clusid: Identifies Cluster ID to process
+    @param hosts: hosts of the cluster
+    @param limit: max hosts to empty
+    @param keep: min hosts that must remain up
+    """
+    up = [host for host in hosts if host.status.state == "up"]
+
+    # Hosts with vms starting, stopping or migrating, or pinned to them, are left alone
+    vms = {}
+    busy = set()
+    guaranteed = {}
+    query = "cluster = %s and status != down" % idmap.clusters.get(id=clusid).name
+    for vm in paginate(reader.collection("vms"), query, workers=4):
+        if vm.host and vm.host.id:
+            vms.setdefault(vm.host.id, []).append(vm.id)
+            guaranteed[vm.id] = vm.memory_policy.guaranteed if vm.memory_policy else 0
+            if vm.status.state != "up":
+                busy.add(vm.host.id)
+            # Engine refuses to migrate them, emptying the rest of their host would save nothing
+            if vm.placement_policy and vm.placement_policy.affinity == "pinned":
+                busy.add(vm.host.id)
+
+    # Hosts without vms are kept empty to hold new VM's
+    free = dict([(host.id, host.max_scheduling_memory or 0) for host in up if host.id in vms])
+
+    # Only managed hosts, never the SPM
+    candidates = []
+    for host in up:
+        if host.id in vms and host.id not in busy and tagindex.has("hosts", host, "elas_manage"):
+            if idmap.hosts.get(id=host.id).storage_manager.valueOf_ != "true":
+                candidates.append(host.id)
+    if not candidates:
+        return []
+
+    # The engine won't place a vm where its guaranteed memory doesn't fit, even if it uses less
+    vmstats.load(sum([vms[host] for host in candidates], []))
+    usage = dict([(host, [(vmid, max(vmstats.used(vmid) or 0, guaranteed[vmid] or 0)) for vmid in vms[host]])
+                  for host in candidates])
+    emptied, moves = consolidation_plan(free, usage, candidates, limit, keep)
+    if not emptied:
+        if options.verbosity >= 2:
+            print("\nNo host can be emptied moving its vm's to other hosts\n")
+        return []
+
+    if options.verbosity >= 1:
+        print("\nEmptying hosts %s with %s migrations\n" % (emptied, len(moves)))
+    source = dict([(vmid, host) for host in emptied for vmid, used in usage[host]])
+    results = migra_batch(api, options, [(idmap.vms.get(id=vmid), target) for vmid, target in moves])
+
+    # Hosts with any vm left behind stay up
+    failed = set()
+    for (vmid, target), result in zip(moves, results):
+        if result.status != "success":
+            if options.verbosity >= 1:
+                print("Migration of vm %s ended with %s, keeping host %s up" % (
+                    result.vm, result.status, source[vmid]))
+            failed.add(source[vmid])
+    inventory.invalidate("hosts")
+    inventory.invalidate("vms")
+    return [host for host in emptied if host not in failed]
+
+
+def scale_to_demand(clusid, hosts, maintable, maintable_prio, enablable):
+    """Activates or deactivates at once as many hosts as needed to match demand of cluster
+    @param clusid: Identifies Cluster ID to process
+    @param hosts: hosts of the cluster
+    @param maintable: managed hosts up without vms
+    @param maintable_prio: managed hosts up without vms that aren't SPM
+    @param enablable: managed hosts put on maintenance by this script
+    """
+    needed = hosts_needed(clusid, hosts)
+    up = len([host for host in hosts if host.status.state == "up"])
+    if options.verbosity >= 1:
+        print("Hosts needed: %s, hosts up: %s" % (needed, up))
+
+    if needed > up:
+        targets = rank(enablable, hosts, True)[:needed - up]
+        action = activate_hosts
+    elif needed < up:
+        # Hosts not being SPM are the first ones to go
+        candidates = rank(maintable_prio, hosts, False)
+        candidates += rank([host for host in maintable if host not in maintable_prio], hosts, False)
+        targets = candidates[:up - needed]
+        if len(targets) < up - needed and options.consolidate > 0:
+            # Not enough hosts without vms, empty others packing their vms on the hosts staying up
+            remaining = [host for host in hosts if host.id not in targets]
+            targets += consolidate(clusid, remaining, min(options.consolidate, up - needed - len(targets)),
+                                   keep=needed)
+        action = deactivate_hosts
+    else:
+        if options.verbosity >= 2:
+            print("\nNothing to do as hosts up match demand")
+        return
+
+    if not targets:
+        if options.verbosity >= 1:
+            print("\nNo host to %s\n" % ("enable" if action == activate_hosts else "put into maintenance"))
+        return 1
+
+    if options.verbosity >= 2:
+        print("\n%s hosts %s\n" % ("Activating" if action == activate_hosts else "Putting into maintenance", targets))
+    action(targets)
+    return 0
+
+
 def process_cluster(clusid):
     """Processes cluster
     @param clusid: Identifies Cluster ID to process
     """
     if options.verbosity > 1:
-        print("\nProcessing cluster with id %s and name %s" % (clusid, api.clusters.get(id=clusid).name))
+        print("\nProcessing cluster with id %s and name %s" % (clusid, idmap.clusters.get(id=clusid).name))
         print("#############################################################################")
 
     # Emptying maintanable and activable hosts list
@@ -176,10 +432,12 @@ def process_cluster(clusid):
     hosts_without_vms = 0
     hosts_with_vms = 0
 
-    query = "cluster = %s" % api.clusters.get(id=clusid).name
-    for host in paginate(api.hosts, query):
-        if host.tags.get(name="elas_manage"):
-            vms = api.hosts.get(id=host.id).summary.total
+    query = "cluster = %s" % idmap.clusters.get(id=clusid).name
+    hosts = list(inventory.list("hosts", query))
+
+    for host in hosts:
+        if tagindex.has("hosts", host, "elas_manage"):
+            vms = idmap.hosts.get(id=host.id).summary.total
             status = "discarded"
             inc = 1
 
@@ -193,10 +451,10 @@ def process_cluster(clusid):
                     if host.status.state == "up":
                         maintable.append(host.id)
                         status = "accepted"
-                        if api.hosts.get(id=host.id).storage_manager.valueOf_ != "true":
+                        if idmap.hosts.get(id=host.id).storage_manager.valueOf_ != "true":
                             maintable_prio.append(host.id)
                     if host.status.state == "maintenance":
-                        if host.tags.get(name="elas_maint"):
+                        if tagindex.has("hosts", host, "elas_maint"):
                             enablable.append(host.id)
                             status = "accepted"
                         else:
@@ -204,8 +462,8 @@ def process_cluster(clusid):
                             inc = 0
                 if options.verbosity >= 2:
                     print("Host (%s) %s with %s vms detected with status %s and spm status %s (%s for operation)" % (
-                        host.name, host.id, vms, api.hosts.get(id=host.id).status.state,
-                        api.hosts.get(id=host.id).storage_manager.valueOf_, status))
+                        host.name, host.id, vms, idmap.hosts.get(id=host.id).status.state,
+                        idmap.hosts.get(id=host.id).storage_manager.valueOf_, status))
 
                 # Counters
                 hosts_total += inc
@@ -238,15 +496,21 @@ def process_cluster(clusid):
     # Useful vars:     hosts_total,hosts_up,hosts_maintenance,hosts_other,hosts_with_vms,hosts_without_vms
     # Useful arrays: enablable / maintable
 
+    if options.demand:
+        if hosts_total == 0:
+            return
+        return scale_to_demand(clusid, [host for host in hosts if host.cluster.id == clusid], maintable,
+                               maintable_prio, enablable)
+
     # ENABLE SECTION
 
     # At least one host but no one is up -> enable one host
     if hosts_total > 0 and hosts_up == 0:
         try:
-            target = choice(enablable)
+            target = rank(enablable, hosts, True)[0]
             if options.verbosity >= 2:
                 print("\nActivating host %s because no one is up\n" % target)
-            activate_host(target)
+            activate_hosts([target])
             return 0
         except:
             if options.verbosity >= 1:
@@ -258,11 +522,11 @@ def process_cluster(clusid):
         # At least one host up without vm's:
         if hosts_without_vms == 0:
             try:
-                target = choice(enablable)
+                target = rank(enablable, hosts, True)[0]
                 if options.verbosity >= 2:
                     print("\nActivating host %s because there are no hosts without vm's\n" % target)
 
-                activate_host(target)
+                activate_hosts([target])
                 return 0
             except:
                 if options.verbosity >= 1:
@@ -270,16 +534,23 @@ def process_cluster(clusid):
                 return 1
 
     # DISABLE SECTION
+    if hosts_without_vms <= 1 and options.consolidate > 0:
+        # Empty hosts whose vms fit on the others and put them on maintenance
+        targets = consolidate(clusid, [host for host in hosts if host.cluster.id == clusid], options.consolidate)
+        if targets:
+            deactivate_hosts(targets)
+            return 0
+
     if hosts_without_vms > 1:
         # More than one host without VM's so we can shutdown one
         if len(maintable) != 0:
             if len(maintable_prio) != 0:
-                target = choice(maintable_prio)
+                target = rank(maintable_prio, hosts, False)[0]
             else:
-                target = choice(maintable)
+                target = rank(maintable, hosts, False)[0]
             if options.verbosity >= 2:
                 print("\nPutting host %s into maintenance because there are more than 1 host without vm's\n" % target)
-            deactivate_host(target)
+            deactivate_hosts([target])
             return 0
         else:
             print("\nNo host to put into maintenance\n")
@@ -308,22 +579,37 @@ if __name__ == "__main__":
         for host in paginate(api.hosts):
             try:
                 host.tags.add(params.Tag(name="elas_manage"))
+                tagindex.add("hosts", host, "elas_manage")
             except:
                 print("Error adding elas_manage tag to host %s" % host.name)
 
     # Sanity checks
     # Check hosts with elas_maint tag and status active
     query = "status = up"
-    for host in paginate(api.hosts, query):
+    for host in inventory.list("hosts", query):
         if host.status.state == "up":
-            if api.hosts.get(id=host.id).tags.get(name="elas_maint"):
+            if tagindex.has("hosts", host, "elas_maint"):
                 if options.verbosity >= 1:
                     print("Host %s is tagged as elas_maint and it's active, removing tag..." % host.id)
                 api.hosts.get(id=host.id).tags.get(name="elas_maint").delete()
+                tagindex.remove("hosts", host, "elas_maint")
 
     if not options.cluster:
         # Processing each cluster of our RHEVM
-        for cluster in api.clusters.list():
-            process_cluster(cluster.id)
+        for cluster in inventory.list("clusters"):
+            with clusterlock(cluster.id, baseurl):
+                # Engine failing while processing one cluster doesn't skip the others
+                try:
+                    process_cluster(cluster.id)
+                except Exception as e:
+                    print("Error processing cluster %s: %s" % (cluster.name, errortext(e)))
     else:
-        process_cluster(api.clusters.get(name=options.cluster).id)
+        cluster = api.clusters.get(name=options.cluster)
+        with clusterlock(cluster.id, baseurl):
+            process_cluster(cluster.id)
+
+    # Time to be back up, without holding cluster locks, as later runs may be too far apart to tell
+    if options.boottimeout > 0 and poweredon:
+        up = waithosts(api, poweredon, options.boottimeout, baseurl)
+        if options.verbosity >= 1:
+            print("Hosts up after power on: %s of %s" % (len(up), len(poweredon)))
@@ -42,8 +42,11 @@ p.add_option("-s", "--server", dest="server", help="RHEV-M server address/hostna
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+add_common_options(p)
 p.add_option("--policy", dest="policy", help="Set destination policy", metavar='policy', default="power_saving")
 p.add_option('-c', "--cluster", dest="cluster", help="Select cluster name to process", metavar='cluster', default=None)
+p.add_option("--cache", dest="cache", help="Inventory cache file to share listings between runs", metavar="file",
+             default=None)
 
 (options, args) = p.parse_args()
 
@@ -51,7 +54,10 @@ options.username, options.password = getuserpass(options)
 
 baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+# Listings shared with other runs
+inventory = sharedstate(api, options.cache, baseurl)[0]
 
 
 # FUNCTIONS
@@ -74,13 +80,19 @@ def process_cluster(clusid):
             # evenly_distributed
             # power_saving
 
+    # Policy changed, drop listings other runs could reuse
+    inventory.invalidate("clusters")
+
 
 # MAIN PROGRAM
 if __name__ == "__main__":
 
     if not options.cluster:
         # Processing each cluster of our RHEVM
-        for cluster in api.clusters.list():
-            process_cluster(cluster.id)
+        for cluster in inventory.list("clusters"):
+            with clusterlock(cluster.id, baseurl):
+                process_cluster(cluster.id)
     else:
-        process_cluster(api.clusters.get(name=options.cluster).id)
+        cluster = api.clusters.get(name=options.cluster)
+        with clusterlock(cluster.id, baseurl):
+            process_cluster(cluster.id)
@@ -31,8 +31,6 @@
 #     elas_maint : this host has been put on maintenance by the EMS
 
 import optparse
-import os
-from random import choice
 
 from rhev_functions import *
 
@@ -58,8 +56,15 @@ p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="4
 p.add_option("-a", "--action", dest="action", help="Power action to execute", metavar="action", default="pm-suspend")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+add_common_options(p)
 p.add_option('-b', "--batch", dest="batch", help="Batch number of hosts to return from maintenance", metavar='[0-n]',
              default=5, type='int')
+p.add_option("--power-weight", dest="powerweight", help="Preference for hosts using less power (1) over hosts with "
+             "more memory (0) when choosing hosts", metavar="0.5", default=POWER_WEIGHT, type='float')
+p.add_option("--boot-timeout", dest="boottimeout", help="Seconds to wait at the end of the run for hosts powered on "
+             "to be up, recording how long they take for ranking, 0 to not wait", metavar="0", default=0, type='int')
+p.add_option("--wol", dest="wol", help="Interfaces to send Wake-on-LAN packets from, all up by default",
+             metavar="eth0,eth1", default=None)
 p.add_option('-c', "--cluster", dest="cluster", help="Select cluster name to process", metavar='cluster', default=None)
 
 (options, args) = p.parse_args()
@@ -68,7 +73,13 @@ options.username, options.password = getuserpass(options)
 
 baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+# Tag membership of hosts for this run
+tagindex = sharedstate(api, engine=baseurl)[2]
+
+# Hosts powered on during this run, to wait for them once all clusters are processed
+poweredon = []
 
 
 # FUNCTIONS
@@ -81,26 +92,16 @@ def activate_host(target):
         print("Activating target %s" % target)
 
     # Remove elas_maint TAG to host
-    if not api.hosts.get(id=target).tags.get(name="elas_maint"):
+    if tagindex.has("hosts", target, "elas_maint"):
         try:
             api.hosts.get(id=target).tags.get(name="elas_maint").delete()
+            tagindex.remove("hosts", target, "elas_maint")
         except:
-            print("Error deleting tag elas_maint from host %s" % api.host.get(id=target).name)
+            print("Error deleting tag elas_maint from host %s" % target)
 
     if api.hosts.get(id=target).status.state == "maintenance":
         api.hosts.get(id=target).activate()
 
-    # Get Host MAC
-    for nic in api.hosts.get(id=target).nics.list():
-        mac = nic.mac.get_address()
-        # By default, send wol using every single nic at RHEVM host
-        if mac != "":
-            comando = "for tarjeta in $(for card in $(ls -d /sys/class/net/*/);do echo $(basename $card);done);do " \
-                      "ether-wake -i $tarjeta %s ;done" % mac
-            if options.verbosity >= 1:
-                print("Sending %s the power on action via %s" % (target, mac))
-            os.system(comando)
-
     return
 
 
@@ -109,29 +110,49 @@ def process_cluster(clusid):
     @param clusid: Cluster ID to process
     """
     enablable = []
-    query = "status = maintenance and tag = elas_manage and tag = elas_main and cluster = %s" % api.clusters.get(
-        id=clusid).name
+    memory = {}
+    cpus = {}
+    query = "status = maintenance and cluster = %s" % api.clusters.get(id=clusid).name
     for host in paginate(api.hosts, query):
+        memory[host.id] = host.memory
+        cpus[host.id] = hostcpus(host)
         if host.status.state == "maintenance":
-            if api.hosts.get(id=host.id).tags.get(name="elas_manage"):
-                if api.hosts.get(id=host.id).tags.get(name="elas_maint"):
+            if tagindex.has("hosts", host, "elas_manage"):
+                if tagindex.has("hosts", host, "elas_maint"):
                     if options.verbosity >= 1:
                         print("Host %s is tagged as elas_maint and it's down, adding to activation list..." % host.id)
                     enablable.append(host.id)
 
-    number = 0
+    # Hosts quicker to come back and with more memory first
+    targets = rankhosts(enablable, memory, baseurl, True, options.powerweight, cpus=cpus)[:options.batch]
+    if not targets:
+        if options.verbosity > 4:
+            print("No more hosts to enable")
+        return
 
-    while number < options.batch:
-        number += 1
+    # MACs saved when hosts were put on maintenance, so they're woken up even if the engine can't activate them
+    macs = []
+    for target in targets:
         try:
-            victima = choice(enablable)
-            enablable.remove(victima)
-            if options.verbosity > 3:
-                print("Enabling host %s" % victima)
-            activate_host(victima)
-        except:
-            if options.verbosity > 4:
-                print("No more hosts to enable")
+            macs.extend(hostmacs(api, target, baseurl))
+        except Exception as e:
+            print("Error reading MAC addresses of host %s: %s" % (target, errortext(e)))
+
+    # By default, send wol using every single nic at RHEVM host, whole batch at once
+    wakeup(options, macs)
+
+    for target in targets:
+        hostevent(target, "up", baseurl)
+        if options.verbosity > 3:
+            print("Enabling host %s" % target)
+        try:
+            activate_host(target)
+        except Exception as e:
+            print("Error activating host %s: %s" % (target, errortext(e)))
+
+    # Waited for once all clusters are processed
+    poweredon.extend(targets)
+
 
 # MAIN PROGRAM
 # Sanity checks
@@ -139,6 +160,15 @@ if __name__ == "__main__":
     if not options.cluster:
         # Processing each cluster of our RHEVM
         for cluster in api.clusters.list():
-            process_cluster(cluster.id)
+            with clusterlock(cluster.id, baseurl):
+                process_cluster(cluster.id)
     else:
-        process_cluster(api.clusters.get(name=options.cluster).id)
+        cluster = api.clusters.get(name=options.cluster)
+        with clusterlock(cluster.id, baseurl):
+            process_cluster(cluster.id)
+
+    # Time to be back up, used to rank hosts, without holding cluster locks
+    if options.boottimeout > 0 and poweredon:
+        up = waithosts(api, poweredon, options.boottimeout, baseurl)
+        if options.verbosity >= 1:
+            print("Hosts up after power on: %s of %s" % (len(up), len(poweredon)))
@@ -42,6 +42,7 @@ p.add_option("--dbpass", dest="dbpass", help="RHEV-M database password", metavar
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+add_common_options(p)
 p.add_option("-n", "--name", dest="name", help="VM name", metavar="name")
 
 (options, args) = p.parse_args()
@@ -50,7 +51,7 @@ options.username, options.password = getuserpass(options)
 
 baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
 con = psycopg2.connect(database='engine', user=options.dbuser, password=options.dbpass)
 
 try:
@@ -44,6 +44,7 @@ p.add_option("-s", "--server", dest="server", help="RHEV-M server address/hostna
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=1,
              type='int')
+add_common_options(p)
 
 # Denis Immoos at dimmoos@scope.ch
 p.add_option('-q', "--quiet", dest="verbosity", help="quiet while running", action="store_false")
@@ -57,7 +58,7 @@ options.username, options.password = getuserpass(options)
 
 baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
 
 sleep_time = 10
 date_string = time.strftime('%Y%m%d%H%M', time.localtime())
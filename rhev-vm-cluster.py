@@ -27,6 +27,7 @@
 #
 
 
+import collections
 import optparse
 
 from rhev_functions import *
@@ -53,9 +54,16 @@ p.add_option("-s", "--server", dest="server", help="RHEV-M server address/hostna
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+add_common_options(p)
 p.add_option('-t', "--tagall", dest="tagall", help="Tag all hosts with elas_manage", metavar='0/1', default=0,
              type='int')
 p.add_option('-c', "--cluster", dest="cluster", help="Select cluster name to process", metavar='cluster', default=None)
+p.add_option("--host-migrations", dest="hostmigrations", help="Max simultaneous migrations from/to a host",
+             metavar='[1-n]', default=MIGRATION_MAX_OUT, type='int')
+p.add_option("--cluster-migrations", dest="clustermigrations", help="Max simultaneous migrations in a cluster",
+             metavar='[1-n]', default=MIGRATION_MAX_CLUSTER, type='int')
+p.add_option("--cache", dest="cache", help="Inventory cache file to share listings between runs", metavar="file",
+             default=None)
 
 (options, args) = p.parse_args()
 
@@ -63,7 +71,11 @@ options.username, options.password = getuserpass(options)
 
 baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+# Listings shared with other runs and cache of hosts/vms/clusters read during this run, kept for next
+# scripts when run from rhevm-utils.py
+inventory, idmap, tagindex = sharedstate(api, options.cache, baseurl)
 
 
 # FUNCTIONS
@@ -79,8 +91,8 @@ def process_cluster(cluster):
     tags_with_more_than_one = []
 
     # Get host list from this cluster
-    query = "cluster = %s and status = up" % api.clusters.get(id=cluster.id).name
-    for host in paginate(api.hosts, query):
+    query = "cluster = %s and status = up" % cluster.name
+    for host in inventory.list("hosts", query):
         if host.cluster.id == cluster.id:
             if host.status.state == "up":
                 hosts_in_cluster.append(host.id)
@@ -90,34 +102,33 @@ def process_cluster(cluster):
         print("##############################################")
 
     # Create the empty set of vars that we'll populate later
-    for tag in api.tags.list():
-        tags_vm[tag.name] = []
+    for tag in tagindex.names():
+        tags_vm[tag] = []
 
     # Populate the list of tags and VM's
-    query = "cluster = %s and status = up and tag = elas_manage" % api.clusters.get(id=cluster.id).name
-    for vm in paginate(api.vms, query):
+    query = "cluster = %s and status = up and tag = elas_manage" % cluster.name
+    for vm in inventory.list("vms", query):
         if vm.cluster.id == cluster.id:
             if vm.status.state == "up":
-                if not vm.tags.get("elas_manage"):
+                if not tagindex.has("vms", vm, "elas_manage"):
                     if options.verbosity > 3:
                         print("VM %s is discarded because it has no tag elas_manage" % vm.name)
                 else:
                     # Add the VM Id to the list of VMS to manage in this cluster
                     vms_in_cluster.append(vm.id)
-                    for tag in vm.tags.list():
-                        if tag.name[0:8] == "cluster_":
-                            if options.verbosity > 3:
-                                print("VM %s in cluster %s has tag %s" % (vm.name, cluster.name, tag.name))
-                                # Put the TAG in the list of used for this cluster and put the VM to the ones with
-                                # this tag
-                            tags_in_cluster.append(tag.id)
-                            tags_vm[tag.name].append(vm.name)
+                    for tag in tagindex.tagsof("vms", vm, "cluster_"):
+                        if options.verbosity > 3:
+                            print("VM %s in cluster %s has tag %s" % (vm.name, cluster.name, tag))
+                            # Put the TAG in the list of used for this cluster and put the VM to the ones with
+                            # this tag
+                        tags_in_cluster.append(tag)
+                        tags_vm.setdefault(tag, []).append(vm.name)
 
     # Construct a list of tags with more than one vm in state == up to process
-    for tag in api.tags.list():
-        if len(tags_vm[tag.name]) > 1:
-            if tag.name[0:8] == "cluster_":
-                tags_with_more_than_one.append(tag.name)
+    for tag in tagindex.names():
+        if len(tags_vm[tag]) > 1:
+            if tag[0:8] == "cluster_":
+                tags_with_more_than_one.append(tag)
 
     if options.verbosity > 3:
         print('\nTAGS/VM organization: %s' % tags_vm)
@@ -149,19 +160,28 @@ def process_cluster(cluster):
         print("Tags in cluster")
         print(tags_in_cluster)
 
+    # Migrations and pinning to do once all tags have been processed, by vm name
+    moves = collections.OrderedDict()
+    pins = collections.OrderedDict()
+
+    # Host each vm will be running on once planned moves are done, vms with several tags are planned from there
+    planned = {}
+
     for etiqueta in tags_to_manage:
         tags_vm_used = set([])
         if options.verbosity > 3:
             print("Managing tag %s" % etiqueta)
         for vm in tags_vm[etiqueta]:
+            maquina = idmap.vms.get(name=vm)
+            current = planned.get(vm, maquina.host.id)
             if options.verbosity > 4:
                 print('Processing vm %s for tag %s at host %s' % (
-                    vm, etiqueta, api.hosts.get(id=api.vms.get(name=vm).host.id).name))
+                    vm, etiqueta, idmap.hosts.get(id=current).name))
 
-            # Set target as actual running host
-            target = api.vms.get(name=vm).host.id
+            # Set target as host it will be running on
+            target = current
 
-            if api.vms.get(name=vm).host.id not in tags_vm_used:
+            if current not in tags_vm_used:
                 # Host not yet used, accept it directly
                 tags_vm_used.add(target)
             else:
@@ -176,35 +196,54 @@ def process_cluster(cluster):
                             # Setting new host
                         target = host
 
-            nombre = api.hosts.get(id=target).name
+            nombre = idmap.hosts.get(id=target).name
 
             # Only migrate if VM if there's host change
-            maquina = api.vms.get(name=vm)
-
-            if maquina.host.id != target:
+            if current != target:
                 if options.verbosity > 3:
                     print('Processing vm %s for tag %s at host %s needs migration to host %s' % (
-                        vm, etiqueta, api.hosts.get(id=api.vms.get(name=vm).host.id).name, nombre))
-                    # Allow migration
-                maquina.placement_policy.host = params.Host()
-                maquina.placement_policy.affinity = "migratable"
-                maquina.update()
-
-                # Migrate VM to target HOST to satisfy rules
-                migra(api, options, api.vms.get(name=vm), params.Action(host=api.hosts.get(id=target)))
+                        vm, etiqueta, idmap.hosts.get(id=current).name, nombre))
                 tags_vm_used.add(target)
             else:
                 if options.verbosity > 4:
                     print("Skipping migration target=host")
 
-            # Discard further migration of any machine
-            maquina.placement_policy.affinity = "pinned"
-            maquina.placement_policy.host = api.hosts.get(id=target)
-            try:
-                maquina.update()
-            except:
-                if options.verbosity > 4:
-                    print("Problem updating VM parameters for pinning")
+            planned[vm] = target
+            if target != maquina.host.id:
+                moves[vm] = (maquina, target)
+            else:
+                moves.pop(vm, None)
+            pins[vm] = (maquina, target)
+
+    # Allow migration of VM's to move
+    for maquina, target in moves.values():
+        maquina.placement_policy.host = params.Host()
+        maquina.placement_policy.affinity = "migratable"
+        maquina.update()
+
+    # Migrate VM's to target HOST to satisfy rules, several at once
+    results = migra_batch(api, options, [(idmap.vms.get(name=vm), target) for vm, (maquina, target) in moves.items()],
+                          max_out=options.hostmigrations, max_in=options.hostmigrations,
+                          max_cluster=options.clustermigrations)
+    for vm, result in zip(list(moves.keys()), results):
+        if result.status != "success":
+            if options.verbosity > 3:
+                print("Migration of vm %s ended with %s, pinning it where it runs" % (vm, result.status))
+            maquina, target = pins[vm]
+            pins[vm] = (maquina, result.host)
+
+    for maquina, target in pins.values():
+        if not target:
+            continue
+        # Discard further migration of any machine
+        maquina.placement_policy.affinity = "pinned"
+        maquina.placement_policy.host = idmap.hosts.get(id=target)
+        try:
+            maquina.update()
+        except:
+            if options.verbosity > 4:
+                print("Problem updating VM parameters for pinning")
+
 
 # MAIN PROGRAM
 if __name__ == "__main__":
@@ -219,6 +258,7 @@ if __name__ == "__main__":
         for vm in paginate(api.vms):
             try:
                 vm.tags.add(params.Tag(name="elas_manage"))
+                tagindex.add("vms", vm, "elas_manage")
             except:
                 print("Error adding elas_manage tag to vm %s" % vm.name)
 
@@ -227,25 +267,29 @@ if __name__ == "__main__":
     query = "status = down"
     for vm in paginate(api.vms, query):
         if vm.status.state == "down":
-            if vm.tags.get("elas_manage"):
-                for tag in vm.tags.list():
-                    if tag.name[0:8] == "cluster_":
-                        if options.verbosity >= 5:
-                            print("Cleaning VM %s pinning to allow to start on any host" % vm.name)
-                            # If powered down, allow machine to be migratable so it can start on any host
-                        maquina = vm
-                        maquina.placement_policy.host = params.Host()
-                        maquina.placement_policy.affinity = "migratable"
-                        maquina.update()
-            if vm.tags.get("elas_start"):
+            if tagindex.has("vms", vm, "elas_manage"):
+                if tagindex.tagsof("vms", vm, "cluster_"):
+                    if options.verbosity >= 5:
+                        print("Cleaning VM %s pinning to allow to start on any host" % vm.name)
+                        # If powered down, allow machine to be migratable so it can start on any host
+                    maquina = vm
+                    maquina.placement_policy.host = params.Host()
+                    maquina.placement_policy.affinity = "migratable"
+                    maquina.update()
+                    inventory.invalidate("vms")
+            if tagindex.has("vms", vm, "elas_start"):
                 if options.verbosity >= 5:
                     print("VM %s should be running, starting..." % vm.name)
                     # Start machine, as if it had host pinning it couldn't be autostarted using HA
                 vm.start()
+                inventory.invalidate("vms")
 
     if not options.cluster:
         # Processing each cluster of our RHEVM
-        for cluster in api.clusters.list():
-            process_cluster(cluster)
+        for cluster in inventory.list("clusters"):
+            with clusterlock(cluster.id, baseurl):
+                process_cluster(cluster)
     else:
-        process_cluster(api.clusters.get(name=options.cluster))
+        cluster = api.clusters.get(name=options.cluster)
+        with clusterlock(cluster.id, baseurl):
+            process_cluster(cluster)
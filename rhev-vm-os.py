@@ -50,9 +50,14 @@ p.add_option("-s", "--server", dest="server", help="RHEV-M server address/hostna
 p.add_option("-p", "--port", dest="port", help="API port to contact", metavar="443", default="443")
 p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]', default=0,
              type='int')
+add_common_options(p)
 p.add_option('-t', "--tagall", dest="tagall", help="Tag all hosts with elas_manage", metavar='0/1', default=0,
              type='int')
 p.add_option('-c', "--cluster", dest="cluster", help="Select cluster name to process", metavar='cluster', default=None)
+p.add_option("--cache", dest="cache", help="Inventory cache file to share listings between runs", metavar="file",
+             default=None)
+p.add_option("--concurrency", dest="concurrency", help="Simultaneous requests when reading VM statistics",
+             metavar="8", default=8, type='int')
 
 (options, args) = p.parse_args()
 
@@ -60,7 +65,15 @@ options.username, options.password = getuserpass(options)
 
 baseurl = "https://%s:%s/ovirt-engine/api" % (options.server, options.port)
 
-api = apilogin(url=baseurl, username=options.username, password=options.password)
+api = apilogin(url=baseurl, username=options.username, password=options.password, **apioptions(options))
+
+# Listings shared with other runs and cache of hosts/vms/clusters read during this run, kept for next
+# scripts when run from rhevm-utils.py
+inventory, idmap, tagindex = sharedstate(api, options.cache, baseurl)
+
+# Memory usage of VM's, read for the whole cluster at once
+reader = RestReader(api, baseurl, options.username, options.password, concurrency=options.concurrency)
+vmstats = VmStats(api, reader, idmap)
 
 
 # FUNCTIONS
@@ -74,8 +87,8 @@ def process_cluster(cluster):
     tags_os = {}
 
     # Get host list from this cluster
-    query = "cluster = %s and status = up" % api.clusters.get(id=cluster.id).name
-    for host in paginate(api.hosts, query):
+    query = "cluster = %s and status = up" % cluster.name
+    for host in inventory.list("hosts", query):
         if host.cluster.id == cluster.id:
             if host.status.state == "up":
                 hosts_in_cluster.append(host.id)
@@ -85,18 +98,18 @@ def process_cluster(cluster):
         print("##############################################")
 
     # Create the empty set of vars that we'll populate later
-    query = "cluster = %s and status = up" % api.clusters.get(id=cluster.id).name
-    for vm in paginate(api.vms, query):
+    query = "cluster = %s and status = up" % cluster.name
+    for vm in inventory.list("vms", query):
         if vm.status.state == "up":
             if vm.cluster.id == cluster.id:
                 tags_os[vm.os.type_] = []
 
     # Populate the list of tags and VM's
-    query = "cluster = %s and status = up and tag = elas_manage" % api.clusters.get(id=cluster.id).name
-    for vm in paginate(api.vms, query):
+    query = "cluster = %s and status = up and tag = elas_manage" % cluster.name
+    for vm in inventory.list("vms", query):
         if vm.cluster.id == cluster.id:
             if vm.status.state == "up":
-                if not vm.tags.get("elas_manage"):
+                if not tagindex.has("vms", vm, "elas_manage"):
                     if options.verbosity > 3:
                         print("VM %s is discarded because it has no tag elas_manage" % vm.name)
                 else:
@@ -121,17 +134,20 @@ def process_cluster(cluster):
     vms_to_process = []
 
     for vm in vms_in_cluster:
-        if api.vms.get(id=vm).cluster.id == cluster.id:
-            vms_to_process.append(api.vms.get(id=vm).name)
+        if idmap.vms.get(id=vm).cluster.id == cluster.id:
+            vms_to_process.append(idmap.vms.get(id=vm).name)
 
     if options.verbosity > 3:
         print("VM's to process")
         print(vms_to_process)
 
+    # Read memory usage of all running VM's in cluster, candidates to be moved away included
+    vmstats.load_query("cluster = %s and status = up" % cluster.name)
+
     sorted_tag = []
 
     for vm in vms_to_process:
-        sorted_tag.append(api.vms.get(name=vm).os.type_)
+        sorted_tag.append(idmap.vms.get(name=vm).os.type_)
 
     # Order the tags based on VM ordering (using the other function    "list(set(sorted_tag))" made it fail as
     # ordering changed)
@@ -156,12 +172,12 @@ def process_cluster(cluster):
         # start with bigger set of tag
         for host in hosts_in_cluster:
             if options.verbosity > 5:
-                print("Processing host %s" % api.hosts.get(id=host).name)
+                print("Processing host %s" % idmap.hosts.get(id=host).name)
             for vm in vms_to_process:
-                if api.vms.get(name=vm).os.type_ == etiqueta:
+                if idmap.vms.get(name=vm).os.type_ == etiqueta:
                     if options.verbosity > 6:
                         print("Processing vm %s" % vm)
-                    maquina = api.vms.get(name=vm)
+                    maquina = idmap.vms.get(name=vm)
                     if maquina.status.state == "up":
                         if maquina.host.id == host:
                             if options.verbosity > 6:
@@ -174,13 +190,13 @@ def process_cluster(cluster):
                                 if options.verbosity > 5:
                                     print("VM can be processed (not already in processed hosts)")
 
-                                host_free = api.hosts.get(id=host).max_scheduling_memory
-                                if host_free > vmused(api, maquina):
+                                host_free = idmap.hosts.get(id=host).max_scheduling_memory
+                                if host_free > vmstats.used(maquina):
                                     # We've free space, move in there...
                                     if options.verbosity > 2:
                                         print("Enough memory on %s to migrate %s" % (
-                                            api.hosts.get(id=host).name, maquina.name))
-                                    migra(api, options, maquina, params.Action(host=api.hosts.get(id=host)))
+                                            idmap.hosts.get(id=host).name, maquina.name))
+                                    migra(api, options, maquina, params.Action(host=idmap.hosts.get(id=host)))
 
                                 else:
                                     if options.verbosity > 5:
@@ -198,29 +214,31 @@ def process_cluster(cluster):
 
                                     # Fill list with vms that can be moved away
                                     vms_to_excomulgate = []
-                                    query = "status = up and host = %s" % host
+                                    query = "status = up and host = %s" % idmap.hosts.get(id=host).name
                                     for virtual in paginate(api.vms, query):
+                                        idmap.vms.prime(virtual)
                                         if virtual.status.state == "up":
                                             if virtual.host.id == host:
                                                 if virtual.os.type_ not in os_not_to_excomulgate:
                                                     vms_to_excomulgate.append(virtual.name)
+                                    vmstats.load([idmap.vms.get(name=virtual) for virtual in vms_to_excomulgate])
 
                                     if options.verbosity > 5:
                                         print("OS. already processed: %s" % os_not_to_excomulgate)
                                         print("VM's to excomulgate: %s\n" % vms_to_excomulgate)
 
                                     fits_in_ram = False
-                                    host_free = api.hosts.get(id=host).max_scheduling_memory
+                                    host_free = idmap.hosts.get(id=host).max_scheduling_memory
                                     mem_to_free = host_free
                                     for virtual in vms_to_excomulgate:
-                                        mem_to_free = mem_to_free + vmused(api, api.vms.get(name=virtual))
-                                        if mem_to_free >= vmused(api, maquina):
+                                        mem_to_free = mem_to_free + vmstats.used(idmap.vms.get(name=virtual))
+                                        if mem_to_free >= vmstats.used(maquina):
                                             fits_in_ram = True
 
                                     if options.verbosity > 6:
                                         print("Mem that will be freed by excomulgating hosts %s" % mem_to_free)
                                         print("Mem required for VM %s" %
-                                              maquina.statistics.get("memory.installed").values.value[0].datum)
+                                              vmstats.get(maquina, "memory.installed"))
 
                                     if fits_in_ram:
                                         keeplooping = True
@@ -234,8 +252,8 @@ def process_cluster(cluster):
                                             # We've one machine to excomulgate so let's do it
                                             if not victima:
                                                 victima = virtual
-                                            if vmused(api, api.vms.get(name=virtual)) > vmused(api, api.vms.get(
-                                                    name=victima)):
+                                            if vmstats.used(idmap.vms.get(name=virtual)) > vmstats.used(
+                                                    idmap.vms.get(name=victima)):
                                                 victima = virtual
 
                                         # Machine with higher ram usage has been selected, move it away to make room
@@ -244,10 +262,10 @@ def process_cluster(cluster):
                                             if options.verbosity > 5:
                                                 print("Target machine to migration is %s" % victima)
                                             vms_to_excomulgate.remove(victima)
-                                            migra(api, options, api.vms.get(name=victima))
+                                            migra(api, options, idmap.vms.get(name=victima))
 
-                                        host_free = api.hosts.get(id=host).max_scheduling_memory
-                                        if host_free > vmused(api, maquina):
+                                        host_free = idmap.hosts.get(id=host).max_scheduling_memory
+                                        if host_free > vmstats.used(maquina):
                                             # Enough RAM, exit loop to start moving in a new machine, if not,
                                             # keep running to make more room
                                             keeplooping = False
@@ -262,14 +280,14 @@ def process_cluster(cluster):
                                     # Check new ram status
 
                                     # MV moved away, recheck ram to make it fit
-                                    host_free = api.hosts.get(id=host).max_scheduling_memory
+                                    host_free = idmap.hosts.get(id=host).max_scheduling_memory
 
                                     if options.verbosity > 5:
                                         print("Host free RAM %s" % host_free)
-                                        print("VM required RAM %s" % vmused(api, maquina))
+                                        print("VM required RAM %s" % vmstats.used(maquina))
 
-                                    if host_free > vmused(api, maquina):
-                                        migra(api, options, maquina, params.Action(host=api.hosts.get(id=host)))
+                                    if host_free > vmstats.used(maquina):
+                                        migra(api, options, maquina, params.Action(host=idmap.hosts.get(id=host)))
                                     else:
                                         if options.verbosity > 2:
                                             print("Not enough ram, hopping to next host")
@@ -290,12 +308,16 @@ if __name__ == "__main__":
         for vm in paginate(api.vms):
             try:
                 vm.tags.add(params.Tag(name="elas_manage"))
+                tagindex.add("vms", vm, "elas_manage")
             except:
                 print("Error adding elas_manage tag to vm %s" % vm.name)
 
     if not options.cluster:
         # Processing each cluster of our RHEVM
-        for cluster in api.clusters.list():
-            process_cluster(cluster)
+        for cluster in inventory.list("clusters"):
+            with clusterlock(cluster.id, baseurl):
+                process_cluster(cluster)
     else:
-        process_cluster(api.clusters.get(name=options.cluster))
+        cluster = api.clusters.get(name=options.cluster)
+        with clusterlock(cluster.id, baseurl):
+            process_cluster(cluster)
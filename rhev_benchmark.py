@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+#
+# Author: Pablo Iranzo Gomez (Pablo.Iranzo@gmail.com)
+#
+# Description: Runs the scripts against rhev_fakeengine.py at several inventory sizes and checks how their
+# api requests and runtime grow
+#
+# Requires rhevm-sdk to work
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+import json
+import math
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from rhev_fakeengine import FakeEngine
+
+description = """
+rhev_benchmark runs each script of the suite against a fresh synthetic engine (rhev_fakeengine.py) for every
+inventory size, recording wall time, peak memory and number of api requests. It fails if requests or runtime
+grow faster with inventory size than allowed for the script, like going back to one request per VM per host:
+
+python rhev_benchmark.py
+python rhev_benchmark.py --sizes=1,2,4 --output=results.json vm-os elastic
+
+Size 1 is --hosts hosts and --vms vms, larger sizes multiply both and the number of clusters.
+"""
+
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+
+# Max growth exponent between smallest and largest size: 1 is linear, 2 quadratic
+REQUESTS_GROWTH = 1.2
+TIME_GROWTH = 1.5
+
+# Scripts run by default, each entry may set its own growth limits; optional ones only run when named
+SUITE = [
+    {"name": "elastic", "script": "rhev-elastic.py", "args": []},
+    {"name": "vm-cluster", "script": "rhev-vm-cluster.py", "args": []},
+    {"name": "vm-os", "script": "rhev-vm-os.py", "args": []},
+    {"name": "cleanpinning", "script": "rhev-cleanpinning.py", "args": []},
+    {"name": "policy", "script": "rhev-policy.py", "args": []},
+    {"name": "poweron", "script": "rhev-poweron.py", "args": []},
+    {"name": "nagios-table", "script": "monitoring/rhev-nagios-table.py", "args": ["-t", "%(tmp)s/table"]},
+    # Needs the DWH database of the engine
+    {"name": "vm-tax", "script": "rhev-vm-tax.py", "args": [], "optional": True},
+]
+
+# Run in the child instead of the script directly, so migrations are polled as soon as the engine completes them
+# and runtime measures the script instead of its waits. Peak memory is saved at exit, as rusage of the child would
+# include the memory of this process it was forked from
+BOOTSTRAP = """
+import atexit, runpy, sys
+import rhev_functions
+atexit.register(lambda: open("maxrss", "w").write(open("/proc/self/status").read().split("VmHWM:")[1].split()[0]))
+rhev_functions.MIGRATION_POLL_MIN = rhev_functions.MIGRATION_POLL_MAX = %r
+sys.argv = sys.argv[1:]
+runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+# FUNCTIONS
+def runscript(entry, url, tmp, timeout, poll, verbosity=0):
+    """Runs script of suite entry against engine and returns (exit status, seconds, peak memory in MiB)
+    @param entry: suite entry
+    @param url: api url of the engine
+    @param tmp: directory used as HOME of the script, so caches and sessions aren't shared with other runs
+    @param timeout: seconds before killing the script
+    @param poll: seconds between checks of pending migrations
+    @param verbosity: show script output if > 1
+    """
+    server, port = url.split("/")[2].split(":")
+    arguments = [sys.executable, "-c", BOOTSTRAP % poll, os.path.join(BASEDIR, entry["script"]), "-s", server,
+                 "-p", port, "-w", "admin"] + [arg % {"tmp": tmp} for arg in entry["args"]]
+
+    env = dict(os.environ, HOME=tmp, PYTHONPATH=BASEDIR)
+    output = None if verbosity > 1 else open(os.devnull, "w")
+    start = time.time()
+    child = subprocess.Popen(arguments, stdout=output, stderr=output, env=env, cwd=tmp)
+    timer = threading.Timer(timeout, child.kill)
+    timer.start()
+    try:
+        child.wait()
+    finally:
+        timer.cancel()
+        if output:
+            output.close()
+    elapsed = time.time() - start
+
+    memory = None
+    try:
+        # VmHWM is in KiB
+        with open(os.path.join(tmp, "maxrss")) as f:
+            memory = int(f.read()) / 1024.0
+    except (IOError, ValueError):
+        pass
+    return child.returncode, elapsed, memory
+
+
+def growth(results, key):
+    """Returns growth exponent of a measure between first and last size, None if it can't be computed
+    @param results: list of result dictionaries sorted by size
+    @param key: measure to check (requests, time)
+    """
+    first, last = results[0], results[-1]
+    if last["size"] == first["size"] or not first[key] or not last[key]:
+        return None
+    return math.log(float(last[key]) / first[key]) / math.log(float(last["size"]) / first["size"])
+
+
+def benchmark(entry, sizes, options):
+    """Runs entry at every size and returns list of results
+    @param entry: suite entry
+    @param sizes: list of size multipliers
+    @param options: command line options
+    """
+    results = []
+    for size in sizes:
+        engine = FakeEngine(hosts=options.hosts * size, vms=options.vms * size,
+                            hosts_per_cluster=options.hostspercluster, latency=options.latency,
+                            migration_time=0, seed=options.seed)
+        tmp = tempfile.mkdtemp(prefix="rhev-benchmark-")
+        try:
+            url = engine.start_server()
+            status, elapsed, memory = runscript(entry, url, tmp, options.timeout, options.poll, options.verbosity)
+        finally:
+            engine.stop_server()
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        result = {"size": size, "hosts": len(engine.hosts), "vms": len(engine.vms), "status": status,
+                  "time": round(elapsed, 3), "memory": round(memory, 1) if memory else None,
+                  "requests": sum(engine.counts.values()), "counts": dict(engine.counts)}
+        results.append(result)
+        if options.verbosity >= 1:
+            print("%-14s size %-3s %5d hosts %6d vms: %7.2fs %7.1f MiB %7d requests%s" % (
+                entry["name"], size, result["hosts"], result["vms"], elapsed, memory or 0, result["requests"],
+                " (exit status %s)" % status if status else ""))
+            sys.stdout.flush()
+    return results
+
+
+def check(entry, results):
+    """Returns list of problems found in results of entry
+    @param entry: suite entry
+    @param results: list of results of entry sorted by size
+    """
+    problems = []
+    for result in results:
+        if result["status"]:
+            problems.append("%s exited with status %s at size %s" % (entry["name"], result["status"],
+                                                                     result["size"]))
+    for key, limit in (("requests", entry.get("requests", REQUESTS_GROWTH)),
+                       ("time", entry.get("time", TIME_GROWTH))):
+        value = growth(results, key)
+        if value is not None and value > limit:
+            problems.append("%s %s grow with exponent %.2f, max allowed %.2f" % (entry["name"], key, value, limit))
+    return problems
+
+
+# MAIN PROGRAM
+if __name__ == "__main__":
+    p = optparse.OptionParser("rhev_benchmark.py [arguments] [script names]", description=description)
+    p.add_option("--sizes", dest="sizes", help="Inventory size multipliers to run", metavar="1,2,4", default="1,4")
+    p.add_option("--hosts", dest="hosts", help="Number of hosts at size 1", metavar="20", default=20, type='int')
+    p.add_option("--vms", dest="vms", help="Number of vms at size 1", metavar="400", default=400, type='int')
+    p.add_option("--hosts-per-cluster", dest="hostspercluster", help="Hosts in each cluster", metavar="10",
+                 default=10, type='int')
+    p.add_option("--latency", dest="latency", help="Seconds added by engine to each request", metavar="0",
+                 default=0.0, type='float')
+    p.add_option("--poll", dest="poll", help="Seconds between checks of pending migrations", metavar="0.05",
+                 default=0.05, type='float')
+    p.add_option("--seed", dest="seed", help="Random seed for inventory", metavar="1", default=1, type='int')
+    p.add_option("--timeout", dest="timeout", help="Seconds before killing a script run", metavar="600",
+                 default=600, type='int')
+    p.add_option("--output", dest="output", help="Write results as json to file", metavar="file", default=None)
+    p.add_option('-v', "--verbosity", dest="verbosity", help="Show messages while running", metavar='[0-n]',
+                 default=1, type='int')
+
+    (options, args) = p.parse_args()
+
+    sizes = sorted([int(size) for size in options.sizes.split(",")])
+    names = [entry["name"] for entry in SUITE]
+    for name in args:
+        if name not in names:
+            p.error("Unknown script %s, available: %s" % (name, ", ".join(names)))
+    entries = [entry for entry in SUITE if entry["name"] in args or (not args and not entry.get("optional"))]
+
+    report = {}
+    problems = []
+    for entry in entries:
+        results = benchmark(entry, sizes, options)
+        report[entry["name"]] = {"results": results, "requests growth": growth(results, "requests"),
+                                 "time growth": growth(results, "time")}
+        problems.extend(check(entry, results))
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if options.verbosity >= 1:
+        for name in sorted(report):
+            values = ["%.2f" % value if value is not None else "-"
+                      for value in (report[name]["requests growth"], report[name]["time growth"])]
+            print("%-14s requests growth %s, time growth %s" % (name, values[0], values[1]))
+    for problem in problems:
+        print("FAIL: %s" % problem)
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,858 @@
+#!/usr/bin/env python
+#
+# Author: Pablo Iranzo Gomez (Pablo.Iranzo@gmail.com)
+#
+# Description: Stand-in for RHEV-M / oVirt 3.x REST api with a synthetic inventory, for scale testing
+#
+# Only the subset used by these scripts is served: hosts, vms, clusters, tags, statistics,
+# storagedomains, datacenters, templates and networks listings with search and paging, tag
+# assignment, vm/cluster updates and migrate/start/stop/deactivate/activate actions.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+import base64
+import collections
+import fnmatch
+import heapq
+import optparse
+import os
+import random
+import re
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from xml.sax.saxutils import escape, quoteattr
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+try:
+    import BaseHTTPServer as httpserver
+    import SocketServer as socketserver
+    import urlparse
+    from urllib import unquote_plus
+except ImportError:
+    import http.server as httpserver
+    import socketserver
+    import urllib.parse as urlparse
+    from urllib.parse import unquote_plus
+
+description = """
+rhev_fakeengine serves a synthetic inventory through the subset of the RHEV-M 3.x REST api used by
+rhevm-utils scripts, so they can be run unchanged against it for scale and load testing:
+
+python rhev_fakeengine.py --port=8443 --hosts=1000 --vms=30000 --latency=0.05 --errors=0.01
+python rhev-elastic.py -s 127.0.0.1 -p 8443 -w admin -v 1
+
+Any user and password are accepted unless --user/--password are given.
+"""
+
+PREFIX = "/ovirt-engine/api"
+GiB = 1024 ** 3
+
+# Element names of each collection and of its members
+ELEMENTS = {"hosts": ("hosts", "host"), "vms": ("vms", "vm"), "clusters": ("clusters", "cluster"),
+            "tags": ("tags", "tag"), "storagedomains": ("storage_domains", "storage_domain"),
+            "datacenters": ("data_centers", "data_center"), "templates": ("templates", "template"),
+            "networks": ("networks", "network"), "statistics": ("statistics", "statistic"),
+            "disks": ("disks", "disk"), "hostnics": ("host_nics", "host_nic"), "nics": ("nics", "nic")}
+
+# Tags created with the inventory, besides cluster_ ones
+TAGS = ("elas_manage", "elas_maint", "elas_start", "elas_upgrade")
+
+OS_TYPES = ("rhel_6x64", "rhel_7x64", "windows_2012x64", "other_linux")
+
+SEARCH_TERM = re.compile(r"^\s*([\w.]+)\s*(!?=)\s*(.*?)\s*$")
+
+
+def _id(kind, number):
+    """Returns stable uuid for object number of a kind"""
+    return "%08x-0000-4000-8000-%012x" % (kind, number)
+
+
+class FaultError(Exception):
+    """Error answered as a fault document with http status"""
+
+    def __init__(self, status, reason, detail=""):
+        Exception.__init__(self, "%s %s" % (status, reason))
+        self.status = status
+        self.reason = reason
+        self.detail = detail
+
+
+class FakeEngine(object):
+    """Synthetic inventory and the http server exposing it"""
+
+    def __init__(self, hosts=50, vms=1000, hosts_per_cluster=50, storagedomains=4, latency=0.0,
+                 item_latency=0.0, errors=0.0, migration_time=2.0, seed=1, username=None, password=None):
+        """
+        @param hosts: number of hosts
+        @param vms: number of vms
+        @param hosts_per_cluster: hosts in each cluster
+        @param storagedomains: number of data storage domains
+        @param latency: seconds added to every request
+        @param item_latency: seconds added per object returned
+        @param errors: ratio of requests answered with 503
+        @param migration_time: seconds a migration or host deactivation takes
+        @param seed: random seed for inventory and errors
+        @param username: only accept this user if set
+        @param password: only accept this password if set
+        """
+        self.latency = latency
+        self.item_latency = item_latency
+        self.errors = errors
+        self.migration_time = migration_time
+        self.username = username
+        self.password = password
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.pending = []
+        self.sessions = set()
+        self.counts = collections.Counter()
+        self.server = None
+        self.certdir = None
+        self._generate(hosts, vms, hosts_per_cluster, storagedomains)
+
+    # Inventory
+
+    def _generate(self, hosts, vms, hosts_per_cluster, storagedomains):
+        rnd = self.random
+        self.datacenter = {"id": _id(1, 0), "name": "Default"}
+        self.clusters = collections.OrderedDict()
+        self.hosts = collections.OrderedDict()
+        self.vms = collections.OrderedDict()
+        self.tags = collections.OrderedDict()
+        self.storagedomains = collections.OrderedDict()
+        self.networks = collections.OrderedDict()
+        self.templates = collections.OrderedDict()
+
+        blank = {"id": "00000000-0000-0000-0000-000000000000", "name": "Blank"}
+        self.templates[blank["id"]] = blank
+        rhevm = {"id": _id(9, 0), "name": "rhevm", "vlan": None}
+        self.networks[rhevm["id"]] = rhevm
+
+        self.addtag("root")
+        for name in TAGS:
+            self.addtag(name)
+
+        for number in range(storagedomains):
+            sd = {"id": _id(5, number), "name": "data%02d" % number, "used": 200 * GiB,
+                  "available": 2048 * GiB}
+            self.storagedomains[sd["id"]] = sd
+
+        for number in range(max(1, (hosts + hosts_per_cluster - 1) // hosts_per_cluster)):
+            cluster = {"id": _id(2, number), "name": "cluster%03d" % number, "policy": "none"}
+            self.clusters[cluster["id"]] = cluster
+        clusters = list(self.clusters.values())
+        # Hosts of each cluster, for placement of vms
+        self.members = dict((cluster["id"], []) for cluster in clusters)
+
+        manage = self.tagid("elas_manage")
+        maint = self.tagid("elas_maint")
+        for number in range(hosts):
+            host = {"id": _id(3, number), "name": "host%04d" % number, "address": "host%04d.invalid" % number,
+                    "cluster": clusters[min(number // hosts_per_cluster, len(clusters) - 1)]["id"],
+                    "state": "up", "memory": 256 * GiB, "spm": number == 0, "tags": set([manage]),
+                    "vms": set(), "allocated": 0,
+                    "mac": "52:54:00:%02x:%02x:%02x" % (number >> 16 & 255, number >> 8 & 255, number & 255)}
+            # Some hosts already put on maintenance by rhev-elastic
+            if number % 10 == 9:
+                host["state"] = "maintenance"
+                host["tags"].add(maint)
+            self.hosts[host["id"]] = host
+            self.members[host["cluster"]].append(host)
+
+        start = self.tagid("elas_start")
+        group = None
+        for number in range(vms):
+            cluster = clusters[number % len(clusters)]
+            vm = {"id": _id(4, number), "name": "vm%05d" % number, "cluster": cluster["id"], "host": None,
+                  "state": "down", "memory": rnd.choice((1, 2, 4, 8)) * GiB, "os": rnd.choice(OS_TYPES),
+                  "affinity": "migratable", "pinned": None, "ha": False, "tags": set(),
+                  "sd": rnd.choice(list(self.storagedomains)) if self.storagedomains else None,
+                  "disks": rnd.choice((1, 1, 2))}
+            # Guest agent not reporting memory usage on some of them
+            vm["used"] = 0 if rnd.random() < 0.05 else int(vm["memory"] * rnd.uniform(0.3, 0.9))
+            if rnd.random() < 0.8:
+                vm["tags"].add(manage)
+            # Small groups of vms that shouldn't run on the same host
+            if rnd.random() < 0.1:
+                if group is None or rnd.random() < 0.4:
+                    group = self.addtag("cluster_%04d" % len(self.tags))
+                vm["tags"].add(group)
+            self.vms[vm["id"]] = vm
+            if rnd.random() < 0.9:
+                host = self._placement(vm)
+                if host:
+                    self._place(vm, host)
+                    vm["state"] = "up"
+            elif rnd.random() < 0.3:
+                vm["tags"].add(start)
+
+    def addtag(self, name):
+        """Creates tag and returns its id"""
+        tag = {"id": _id(6, len(self.tags)), "name": name}
+        self.tags[tag["id"]] = tag
+        return tag["id"]
+
+    def tagid(self, name):
+        for tag in self.tags.values():
+            if tag["name"] == name:
+                return tag["id"]
+        return None
+
+    def free(self, host):
+        """Memory of host not assigned to vms"""
+        return host["memory"] - host["allocated"]
+
+    def _placement(self, vm, exclude=None):
+        """Returns up host of vm cluster with most free memory able to run it, None if there's none"""
+        if vm["pinned"] and vm["affinity"] == "pinned":
+            host = self.hosts.get(vm["pinned"])
+            if host and host["state"] == "up" and self.free(host) >= vm["memory"]:
+                return host
+            return None
+        best = None
+        for host in self.members[vm["cluster"]]:
+            if host["state"] != "up" or host["id"] == exclude:
+                continue
+            if best is None or len(host["vms"]) < len(best["vms"]):
+                if self.free(host) >= vm["memory"]:
+                    best = host
+        return best
+
+    def _place(self, vm, host):
+        if vm["host"]:
+            self.hosts[vm["host"]]["vms"].discard(vm["id"])
+            self.hosts[vm["host"]]["allocated"] -= vm["memory"]
+        vm["host"] = host["id"] if host else None
+        if host:
+            host["vms"].add(vm["id"])
+            host["allocated"] += vm["memory"]
+
+    def _later(self, function, *args):
+        heapq.heappush(self.pending, (time.time() + self.migration_time, id(args), function, args))
+
+    def settle(self):
+        """Completes migrations and host deactivations already due"""
+        now = time.time()
+        while self.pending and self.pending[0][0] <= now:
+            _, _, function, args = heapq.heappop(self.pending)
+            function(*args)
+
+    def _migrated(self, vm, host):
+        if vm["state"] == "migrating":
+            self._place(vm, host)
+            vm["state"] = "up"
+
+    def _maintenance(self, host):
+        if host["state"] == "preparing_for_maintenance":
+            host["state"] = "maintenance"
+
+    # Actions
+
+    def migrate(self, vm, target=None):
+        if vm["state"] != "up":
+            raise FaultError(409, "Operation Failed", "Cannot migrate VM. VM %s is not running." % vm["name"])
+        if vm["affinity"] == "pinned":
+            raise FaultError(409, "Operation Failed", "Cannot migrate VM. VM %s is pinned to Host." % vm["name"])
+        if target:
+            host = self.hosts.get(target)
+            if not host or host["state"] != "up" or host["cluster"] != vm["cluster"] or host["id"] == vm["host"]:
+                raise FaultError(409, "Operation Failed", "Cannot migrate VM. Destination host is not valid.")
+            if self.free(host) < vm["memory"]:
+                raise FaultError(409, "Operation Failed", "Cannot migrate VM. Not enough memory on destination.")
+        else:
+            host = self._placement(vm, exclude=vm["host"])
+            if not host:
+                raise FaultError(409, "Operation Failed", "Cannot migrate VM. There is no host that satisfies "
+                                                          "current scheduling constraints.")
+        vm["state"] = "migrating"
+        self._later(self._migrated, vm, host)
+
+    def start(self, vm):
+        if vm["state"] != "down":
+            raise FaultError(409, "Operation Failed", "Cannot run VM. VM %s is running." % vm["name"])
+        host = self._placement(vm)
+        if not host:
+            raise FaultError(409, "Operation Failed", "Cannot run VM. There is no host that satisfies current "
+                                                      "scheduling constraints.")
+        self._place(vm, host)
+        vm["state"] = "up"
+
+    def stop(self, vm):
+        if vm["state"] == "down":
+            raise FaultError(409, "Operation Failed", "Cannot stop VM. VM %s is down." % vm["name"])
+        self._place(vm, None)
+        vm["state"] = "down"
+
+    def deactivate(self, host):
+        moves = []
+        for vmid in sorted(host["vms"]):
+            vm = self.vms[vmid]
+            target = self._placement(vm, exclude=host["id"]) if vm["affinity"] != "pinned" else None
+            if not target:
+                raise FaultError(409, "Operation Failed", "Cannot switch Host to Maintenance mode. VM %s can't "
+                                                          "be migrated." % vm["name"])
+            moves.append((vm, target))
+        for vm, target in moves:
+            vm["state"] = "migrating"
+            self._later(self._migrated, vm, target)
+        host["state"] = "preparing_for_maintenance"
+        self._later(self._maintenance, host)
+
+    def activate(self, host):
+        if host["state"] == "up":
+            raise FaultError(409, "Operation Failed", "Cannot activate Host. Host in Up status.")
+        host["state"] = "up"
+
+    # Searches
+
+    def _matches(self, collection, item, field, operator, value):
+        field = field.lower()
+        if field == "name":
+            result = fnmatch.fnmatchcase(item["name"], value)
+        elif field == "status":
+            result = item["state"] == value.lower()
+        elif field == "cluster":
+            result = self.clusters[item["cluster"]]["name"] == value
+        elif field == "host" and collection == "vms":
+            result = item["host"] is not None and fnmatch.fnmatchcase(self.hosts[item["host"]]["name"], value)
+        elif field == "tag":
+            tag = self.tagid(value)
+            result = tag is not None and tag in item.get("tags", ())
+        else:
+            raise FaultError(400, "Operation Failed", "Cannot search by %s" % field)
+        return result if operator == "=" else not result
+
+    def search(self, collection, items, query, maximum):
+        """Returns items matching search query, honoring 'page N' and max"""
+        page = 1
+        groups = []
+        if query:
+            for group in re.split(r"\s+or\s+", query.strip(), flags=re.I):
+                terms = []
+                for term in re.split(r"\s+and\s+", group.strip(), flags=re.I):
+                    paging = re.match(r"^(.*?)\s*page\s+(\d+)\s*$", term, re.I)
+                    if paging:
+                        page = int(paging.group(2))
+                        term = paging.group(1)
+                    if not term.strip():
+                        continue
+                    match = SEARCH_TERM.match(term)
+                    if not match:
+                        raise FaultError(400, "Operation Failed", "Syntax error in search query: %s" % query)
+                    terms.append(match.groups())
+                groups.append(terms)
+
+        result = []
+        for item in items:
+            if not groups or [terms for terms in groups
+                              if all([self._matches(collection, item, *term) for term in terms])]:
+                result.append(item)
+        if maximum is not None:
+            result = result[(page - 1) * maximum:page * maximum]
+        return result
+
+    # Documents
+
+    def _href(self, *parts):
+        return quoteattr("%s/%s" % (PREFIX, "/".join(parts)))
+
+    def _ref(self, element, collection, objid):
+        if not objid:
+            return ""
+        return '<%s href=%s id="%s"/>' % (element, self._href(collection, objid), objid)
+
+    def xml(self, collection, item):
+        """Returns xml document for object of collection"""
+        href = self._href(collection, item["id"])
+        name = "<name>%s</name>" % escape(item["name"])
+        if collection == "hosts":
+            links = "".join(['<link href=%s rel="%s"/>' % (self._href("hosts", item["id"], sub), sub)
+                             for sub in ("nics", "tags", "statistics")])
+            active = len(item["vms"])
+            migrating = len([vm for vm in item["vms"] if self.vms[vm]["state"] == "migrating"])
+            return ('<host href=%s id="%s">%s%s<address>%s</address><status><state>%s</state></status>%s'
+                    '<storage_manager priority="5">%s</storage_manager><memory>%d</memory>'
+                    '<max_scheduling_memory>%d</max_scheduling_memory>'
+                    '<summary><active>%d</active><migrating>%d</migrating><total>%d</total></summary>'
+                    '<os type="RHEV_H"><version full_version="6.5 - 20140603.1.el6ev"/></os>'
+                    '<type>rhev-h</type></host>' % (
+                        href, item["id"], name, links, escape(item["address"]), item["state"],
+                        self._ref("cluster", "clusters", item["cluster"]), "true" if item["spm"] else "false",
+                        item["memory"], max(0, self.free(item)), active, migrating, active))
+        if collection == "vms":
+            links = "".join(['<link href=%s rel="%s"/>' % (self._href("vms", item["id"], sub), sub)
+                             for sub in ("disks", "nics", "tags", "statistics")])
+            pinned = self._ref("host", "hosts", item["pinned"]) if item["affinity"] == "pinned" else ""
+            return ('<vm href=%s id="%s">%s%s<type>server</type><status><state>%s</state></status>'
+                    '<memory>%d</memory><cpu><topology sockets="1" cores="2"/></cpu><os type="%s">'
+                    '<boot dev="hd"/></os><high_availability><enabled>%s</enabled><priority>1</priority>'
+                    '</high_availability>%s%s<placement_policy>%s<affinity>%s</affinity></placement_policy>'
+                    '<memory_policy><guaranteed>%d</guaranteed></memory_policy>%s</vm>' % (
+                        href, item["id"], name, links, item["state"], item["memory"], item["os"],
+                        "true" if item["ha"] else "false",
+                        self._ref("host", "hosts", item["host"]) if item["state"] != "down" else "",
+                        self._ref("cluster", "clusters", item["cluster"]), pinned, item["affinity"],
+                        item["memory"], self._ref("template", "templates", "00000000-0000-0000-0000-000000000000")))
+        if collection == "clusters":
+            return ('<cluster href=%s id="%s">%s%s<scheduling_policy><policy>%s</policy></scheduling_policy>'
+                    '<version major="3" minor="6"/></cluster>' % (
+                        href, item["id"], name, self._ref("data_center", "datacenters", self.datacenter["id"]),
+                        escape(item["policy"])))
+        if collection == "storagedomains":
+            return ('<storage_domain href=%s id="%s">%s<type>data</type><master>false</master>'
+                    '<available>%d</available><used>%d</used><committed>%d</committed>'
+                    '<storage_format>v3</storage_format></storage_domain>' % (
+                        href, item["id"], name, item["available"], item["used"], item["used"]))
+        if collection == "tags":
+            return '<tag href=%s id="%s">%s<description></description></tag>' % (href, item["id"], name)
+        if collection == "datacenters":
+            return ('<data_center href=%s id="%s">%s<local>false</local><status><state>up</state></status>'
+                    '</data_center>' % (href, item["id"], name))
+        if collection == "networks":
+            vlan = '<vlan id="%s"/>' % item["vlan"] if item.get("vlan") else ""
+            return '<network href=%s id="%s">%s%s%s</network>' % (
+                href, item["id"], name, self._ref("data_center", "datacenters", self.datacenter["id"]), vlan)
+        if collection == "templates":
+            return '<template href=%s id="%s">%s<memory>%d</memory></template>' % (href, item["id"], name, GiB)
+        raise FaultError(404, "Not Found")
+
+    def statistics(self, collection, item):
+        """Returns list of (name, value, unit) for host or vm"""
+        if collection == "hosts":
+            used = 2 * GiB + sum([self.vms[vm]["used"] or self.vms[vm]["memory"] for vm in item["vms"]])
+            idle = 100 - min(95, 2 + 3 * len(item["vms"]))
+            return [("memory.total", item["memory"], "BYTES"), ("memory.used", used, "BYTES"),
+                    ("memory.free", item["memory"] - used, "BYTES"), ("cpu.current.user", 100 - idle, "PERCENT"),
+                    ("cpu.current.system", 0, "PERCENT"), ("cpu.current.idle", idle, "PERCENT"),
+                    ("cpu.load.avg.5m", len(item["vms"]) / 10.0, "NONE")]
+        return [("memory.installed", item["memory"], "BYTES"),
+                ("memory.used", item["used"] if item["state"] != "down" else 0, "BYTES"),
+                ("cpu.current.guest", 10 if item["state"] != "down" else 0, "PERCENT")]
+
+    def subcollection(self, collection, item, sub):
+        """Returns list of (element id, xml) for subcollection of host or vm"""
+        if sub == "tags":
+            return [(tag, self.xml("tags", self.tags[tag])) for tag in self.tags if tag in item["tags"]]
+        if sub == "statistics":
+            result = []
+            for number, (name, value, unit) in enumerate(self.statistics(collection, item)):
+                statid = str(uuid.uuid5(uuid.NAMESPACE_OID, str(name)))
+                kind = "DECIMAL" if isinstance(value, float) else "INTEGER"
+                result.append((statid, '<statistic href=%s id="%s"><name>%s</name><description>%s</description>'
+                                       '<values type="%s"><value><datum>%s</datum></value></values>'
+                                       '<type>GAUGE</type><unit>%s</unit></statistic>' % (
+                                           self._href(collection, item["id"], "statistics", statid), statid, name,
+                                           name, kind, value, unit)))
+            return result
+        if sub == "nics" and collection == "hosts":
+            nicid = _id(7, int(item["id"][-12:], 16))
+            return [(nicid, '<host_nic href=%s id="%s"><name>eth0</name><mac address="%s"/></host_nic>' % (
+                self._href("hosts", item["id"], "nics", nicid), nicid, item["mac"]))]
+        if sub == "nics":
+            number = int(item["id"][-12:], 16)
+            nicid = _id(8, number)
+            return [(nicid, '<nic href=%s id="%s"><name>nic1</name><interface>virtio</interface>'
+                            '<mac address="00:1a:4a:%02x:%02x:%02x"/></nic>' % (
+                                self._href("vms", item["id"], "nics", nicid), nicid, number >> 16 & 255,
+                                number >> 8 & 255, number & 255))]
+        if sub == "disks":
+            result = []
+            for disk in range(item["disks"]):
+                diskid = _id(10 + disk, int(item["id"][-12:], 16))
+                result.append((diskid, '<disk href=%s id="%s"><name>%s_Disk%d</name><size>%d</size>'
+                                       '<provisioned_size>%d</provisioned_size><storage_domains>%s'
+                                       '</storage_domains><interface>virtio</interface><format>cow</format>'
+                                       '</disk>' % (self._href("vms", item["id"], "disks", diskid), diskid,
+                                                    escape(item["name"]), disk + 1, 20 * GiB, 20 * GiB,
+                                                    self._ref("storage_domain", "storagedomains", item["sd"]))))
+            return result
+        raise FaultError(404, "Not Found")
+
+    def entrypoint(self):
+        links = "".join(['<link href=%s rel="%s"/><link href="%s/%s?search={query}" rel="%s/search"/>' % (
+            self._href(name), name, PREFIX, name, name) for name in ELEMENTS if name in (
+            "hosts", "vms", "clusters", "tags", "storagedomains", "datacenters", "templates", "networks")])
+        return ('<api>%s<special_objects><link href=%s rel="templates/blank"/><link href=%s rel="tags/root"/>'
+                '</special_objects><product_info><name>oVirt Engine</name><vendor>ovirt.org</vendor>'
+                '<version major="3" minor="6" build="0" revision="0"/></product_info>'
+                '<summary><vms><total>%d</total><active>%d</active></vms><hosts><total>%d</total>'
+                '<active>%d</active></hosts></summary></api>' % (
+                    links, self._href("templates", "00000000-0000-0000-0000-000000000000"),
+                    self._href("tags", self.tagid("root")), len(self.vms),
+                    len([vm for vm in self.vms.values() if vm["state"] != "down"]), len(self.hosts),
+                    len([host for host in self.hosts.values() if host["state"] == "up"])))
+
+    # Requests
+
+    def collection(self, name):
+        if name == "datacenters":
+            return {self.datacenter["id"]: self.datacenter}
+        if name not in ("hosts", "vms", "clusters", "tags", "storagedomains", "templates", "networks"):
+            raise FaultError(404, "Not Found")
+        return getattr(self, name)
+
+    def member(self, name, objid):
+        item = self.collection(name).get(objid)
+        if item is None:
+            raise FaultError(404, "Not Found", "Entity not found: %s" % objid)
+        return item
+
+    def handle(self, method, segments, matrix, query, body):
+        """Returns (status, xml, items returned) for request, raising FaultError on errors"""
+        with self.lock:
+            self.settle()
+            if not segments:
+                return 200, self.entrypoint(), 0
+
+            name = segments[0]
+            if method == "GET" and len(segments) == 1:
+                items = self.collection(name).values()
+                maximum = int(matrix["max"]) if "max" in matrix else None
+                if query and name in ("tags", "templates", "networks", "datacenters"):
+                    raise FaultError(400, "Operation Failed", "Search not supported for %s" % name)
+                items = self.search(name, items, query, maximum)
+                root, _ = ELEMENTS[name]
+                return 200, "<%s>%s</%s>" % (root, "".join([self.xml(name, item) for item in items]), root), len(items)
+
+            if method == "POST" and len(segments) == 1:
+                return self.add(name, body)
+
+            item = self.member(name, segments[1])
+            if len(segments) == 2:
+                if method == "GET":
+                    return 200, self.xml(name, item), 1
+                if method == "PUT":
+                    self.update(name, item, body)
+                    return 200, self.xml(name, item), 1
+                if method == "DELETE":
+                    self.delete(name, item)
+                    return 200, "", 0
+
+            if name not in ("hosts", "vms"):
+                raise FaultError(404, "Not Found")
+
+            sub = segments[2]
+            if method == "POST" and len(segments) == 3 and sub not in ("tags", "nics", "disks", "snapshots"):
+                return self.action(name, item, sub, body)
+
+            if sub == "tags" and method == "POST" and len(segments) == 3:
+                tag = self.tagfrom(body)
+                item["tags"].add(tag["id"])
+                return 200, self.xml("tags", tag), 1
+            if sub == "tags" and method == "DELETE" and len(segments) == 4:
+                item["tags"].discard(segments[3])
+                return 200, "", 0
+            if method == "POST" and len(segments) == 3:
+                # nics, disks and snapshots are accepted but not kept
+                return 201, body or "", 1
+
+            if method == "GET":
+                members = self.subcollection(name, item, sub)
+                if len(segments) == 4:
+                    for memberid, document in members:
+                        if memberid == segments[3]:
+                            return 200, document, 1
+                    raise FaultError(404, "Not Found")
+                root, _ = ELEMENTS["hostnics" if sub == "nics" and name == "hosts" else sub]
+                return 200, "<%s>%s</%s>" % (root, "".join([doc for _, doc in members]), root), len(members)
+            raise FaultError(405, "Method Not Allowed")
+
+    def action(self, name, item, action, body):
+        target = None
+        if body:
+            tree = ElementTree.fromstring(body)
+            host = tree.find("host")
+            if host is not None:
+                target = host.get("id")
+                if not target and host.findtext("name"):
+                    target = self.byname("hosts", host.findtext("name"))["id"]
+        if name == "vms" and action == "migrate":
+            self.migrate(item, target)
+        elif name == "vms" and action == "start":
+            self.start(item)
+        elif name == "vms" and action in ("stop", "shutdown"):
+            self.stop(item)
+        elif name == "hosts" and action == "deactivate":
+            self.deactivate(item)
+        elif name == "hosts" and action == "activate":
+            self.activate(item)
+        elif name == "hosts" and action in ("fence", "install", "commitnetconfig", "upgrade"):
+            pass
+        else:
+            raise FaultError(404, "Not Found")
+        return 200, "<action><status><state>complete</state></status></action>", 0
+
+    def byname(self, name, value):
+        for item in self.collection(name).values():
+            if item["name"] == value:
+                return item
+        raise FaultError(404, "Not Found", "Entity not found: %s" % value)
+
+    def tagfrom(self, body):
+        tree = ElementTree.fromstring(body)
+        if tree.get("id"):
+            return self.member("tags", tree.get("id"))
+        return self.byname("tags", tree.findtext("name"))
+
+    def add(self, name, body):
+        tree = ElementTree.fromstring(body)
+        newname = tree.findtext("name")
+        if not newname:
+            raise FaultError(400, "Incomplete parameters", "%s name required" % name)
+        if [item for item in self.collection(name).values() if item["name"] == newname]:
+            raise FaultError(409, "Operation Failed", "Name %s is already in use" % newname)
+        if name == "tags":
+            item = self.tags[self.addtag(newname)]
+        elif name == "vms":
+            cluster = tree.find("cluster")
+            clusterid = cluster.get("id") if cluster is not None else None
+            if not clusterid and cluster is not None:
+                clusterid = self.byname("clusters", cluster.findtext("name"))["id"]
+            item = {"id": _id(4, len(self.vms)), "name": newname, "cluster": clusterid or list(self.clusters)[0],
+                    "host": None, "state": "down", "memory": int(tree.findtext("memory") or GiB), "used": 0,
+                    "os": "other_linux", "affinity": "migratable", "pinned": None, "ha": False, "tags": set(),
+                    "sd": list(self.storagedomains)[0] if self.storagedomains else None, "disks": 1}
+            self.vms[item["id"]] = item
+        elif name == "networks":
+            vlan = tree.find("vlan")
+            item = {"id": _id(9, len(self.networks)), "name": newname,
+                    "vlan": vlan.get("id") if vlan is not None else None}
+            self.networks[item["id"]] = item
+        else:
+            raise FaultError(405, "Method Not Allowed")
+        return 201, self.xml(name, item), 1
+
+    def update(self, name, item, body):
+        tree = ElementTree.fromstring(body)
+        if name == "vms":
+            policy = tree.find("placement_policy")
+            if policy is not None:
+                if policy.findtext("affinity"):
+                    item["affinity"] = policy.findtext("affinity")
+                host = policy.find("host")
+                item["pinned"] = host.get("id") if host is not None else None
+                if host is not None and not item["pinned"] and host.findtext("name"):
+                    item["pinned"] = self.byname("hosts", host.findtext("name"))["id"]
+            if tree.findtext("high_availability/enabled"):
+                item["ha"] = tree.findtext("high_availability/enabled") == "true"
+        elif name == "clusters":
+            if tree.findtext("scheduling_policy/policy"):
+                item["policy"] = tree.findtext("scheduling_policy/policy")
+
+    def delete(self, name, item):
+        if name == "tags":
+            for member in list(self.hosts.values()) + list(self.vms.values()):
+                member["tags"].discard(item["id"])
+            del self.tags[item["id"]]
+        elif name == "vms":
+            if item["state"] != "down":
+                raise FaultError(409, "Operation Failed", "Cannot remove VM. VM is running.")
+            del self.vms[item["id"]]
+        else:
+            raise FaultError(405, "Method Not Allowed")
+
+    # Server
+
+    def start_server(self, address="127.0.0.1", port=0, certfile=None, keyfile=None):
+        """Starts serving on https in a background thread and returns api url"""
+        if not certfile:
+            self.certdir = tempfile.mkdtemp(prefix="rhev-fakeengine-")
+            certfile = os.path.join(self.certdir, "cert.pem")
+            keyfile = os.path.join(self.certdir, "key.pem")
+            with open(os.devnull, "w") as null:
+                subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "2",
+                                       "-subj", "/CN=%s" % address, "-keyout", keyfile, "-out", certfile],
+                                      stdout=null, stderr=null)
+
+        server = _Server((address, port), _Handler)
+        server.engine = self
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.load_cert_chain(certfile, keyfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        self.server = server
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return "https://%s:%s%s" % (address, server.server_address[1], PREFIX)
+
+    def stop_server(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.certdir:
+            shutil.rmtree(self.certdir, ignore_errors=True)
+            self.certdir = None
+
+
+class _Server(socketserver.ThreadingMixIn, httpserver.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing their connections while idle aren't errors
+        if not isinstance(sys.exc_info()[1], (IOError, ssl.SSLError)):
+            httpserver.HTTPServer.handle_error(self, request, client_address)
+
+
+class _Handler(httpserver.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, document, headers=None):
+        body = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n%s' % document if document else ""
+                ).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authenticate(self, engine):
+        cookie = re.search(r"JSESSIONID=([^;\s]+)", self.headers.get("Cookie", ""))
+        if cookie and cookie.group(1) in engine.sessions:
+            return {}
+        authorization = self.headers.get("Authorization", "")
+        if not authorization.startswith("Basic "):
+            raise FaultError(401, "Unauthorized")
+        username, _, password = base64.b64decode(authorization[6:].encode("ascii")).decode("utf-8").partition(":")
+        if (engine.username and username != engine.username) or (engine.password and password != engine.password):
+            raise FaultError(401, "Unauthorized")
+        if "persistent-auth" not in self.headers.get("Prefer", ""):
+            return {}
+        session = uuid.uuid4().hex
+        with engine.lock:
+            engine.sessions.add(session)
+        return {"Set-Cookie": "JSESSIONID=%s; Path=%s; Secure" % (session, PREFIX)}
+
+    def _serve(self, method):
+        engine = self.server.engine
+        parsed = urlparse.urlsplit(self.path)
+        path = parsed.path
+        if not path.startswith(PREFIX):
+            return self._reply(404, _fault("Not Found"))
+        segments = []
+        matrix = {}
+        for segment in path[len(PREFIX):].strip("/").split("/"):
+            if not segment:
+                continue
+            parts = segment.split(";")
+            segments.append(parts[0])
+            for parameter in parts[1:]:
+                key, _, value = parameter.partition("=")
+                matrix[key] = value
+        query = None
+        for parameter in parsed.query.split("&"):
+            key, _, value = parameter.partition("=")
+            if key == "search":
+                query = unquote_plus(value)
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length).decode("utf-8") if length else ""
+
+        collection = "/".join([segment for number, segment in enumerate(segments[:3]) if number != 1])
+        with engine.lock:
+            engine.counts["%s %s" % (method, collection or "/")] += 1
+
+        headers = {}
+        items = 0
+        try:
+            headers = self._authenticate(engine)
+            if segments and engine.errors and engine.random.random() < engine.errors:
+                raise FaultError(503, "Service Unavailable", "Injected error")
+            status, document, items = engine.handle(method, segments, matrix, query, body)
+        except FaultError as e:
+            status, document = e.status, _fault(e.reason, e.detail)
+        except ElementTree.ParseError as e:
+            status, document = 400, _fault("Bad Request", str(e))
+
+        delay = engine.latency + engine.item_latency * items
+        if delay:
+            time.sleep(delay)
+        self._reply(status, document, headers)
+
+    def do_GET(self):
+        self._serve("GET")
+
+    def do_POST(self):
+        self._serve("POST")
+
+    def do_PUT(self):
+        self._serve("PUT")
+
+    def do_DELETE(self):
+        self._serve("DELETE")
+
+
+def _fault(reason, detail=""):
+    return "<fault><reason>%s</reason><detail>%s</detail></fault>" % (escape(reason), escape(detail))
+
+
+# MAIN PROGRAM
+if __name__ == "__main__":
+    p = optparse.OptionParser("rhev_fakeengine.py [arguments]", description=description)
+    p.add_option("-a", "--address", dest="address", help="Address to listen on", metavar="127.0.0.1",
+                 default="127.0.0.1")
+    p.add_option("-p", "--port", dest="port", help="Port to listen on", metavar="8443", default=8443, type='int')
+    p.add_option("--hosts", dest="hosts", help="Number of hosts", metavar="50", default=50, type='int')
+    p.add_option("--vms", dest="vms", help="Number of vms", metavar="1000", default=1000, type='int')
+    p.add_option("--hosts-per-cluster", dest="hostspercluster", help="Hosts in each cluster", metavar="50",
+                 default=50, type='int')
+    p.add_option("--storagedomains", dest="storagedomains", help="Number of storage domains", metavar="4",
+                 default=4, type='int')
+    p.add_option("--latency", dest="latency", help="Seconds added to each request", metavar="0", default=0.0,
+                 type='float')
+    p.add_option("--item-latency", dest="itemlatency", help="Seconds added per object returned", metavar="0",
+                 default=0.0, type='float')
+    p.add_option("--errors", dest="errors", help="Ratio of requests answered with 503", metavar="0", default=0.0,
+                 type='float')
+    p.add_option("--migration-time", dest="migrationtime", help="Seconds a migration takes", metavar="2",
+                 default=2.0, type='float')
+    p.add_option("--seed", dest="seed", help="Random seed for inventory and errors", metavar="1", default=1,
+                 type='int')
+    p.add_option("-u", "--user", dest="username", help="Only accept this username", metavar="admin@internal",
+                 default=None)
+    p.add_option("-w", "--password", dest="password", help="Only accept this password", metavar="admin",
+                 default=None)
+    p.add_option("--cert", dest="cert", help="Certificate file, self-signed one is created if missing",
+                 metavar="cert.pem", default=None)
+    p.add_option("--key", dest="key", help="Key file for certificate", metavar="key.pem", default=None)
+
+    (options, args) = p.parse_args()
+
+    engine = FakeEngine(hosts=options.hosts, vms=options.vms, hosts_per_cluster=options.hostspercluster,
+                        storagedomains=options.storagedomains, latency=options.latency,
+                        item_latency=options.itemlatency, errors=options.errors,
+                        migration_time=options.migrationtime, seed=options.seed, username=options.username,
+                        password=options.password)
+    url = engine.start_server(options.address, options.port, options.cert, options.key)
+    print("Serving %d hosts, %d vms in %d clusters at %s" % (len(engine.hosts), len(engine.vms), len(engine.clusters),
+                                                             url))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    engine.stop_server()
@@ -15,13 +15,62 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
 # GNU General Public License for more details.
 
+import atexit
+import base64
+import collections
+import contextlib
+import fcntl
 import getpass
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import sqlite3
+import ssl
 import sys
+import threading
 import time
+from multiprocessing.pool import ThreadPool
 
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+try:
+    import httplib
+    import urlparse
+    from urllib import quote
+except ImportError:
+    import http.client as httplib
+    import urllib.parse as urlparse
+    from urllib.parse import quote
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+try:
+    import pycurl
+except ImportError:
+    pycurl = None
+
+import ovirtsdk.api
 from ovirtsdk.api import API
+from ovirtsdk.infrastructure import brokers
+from ovirtsdk.infrastructure import errors
+from ovirtsdk.infrastructure.context import context
+from ovirtsdk.utils.parsehelper import ParseHelper
 from ovirtsdk.xml import params
 
+import rhev_wol
+# Shared command line options, for scripts importing everything from here
+from rhev_options import add_common_options, apioptions  # noqa: F401
+
 
 # FUNCTIONS
 def getuserpass(options):
@@ -52,7 +101,557 @@ def check_version(api, major, minor):
     return valid
 
 
-def apilogin(url, username, password, insecure=True, persistent_auth=True, session_timeout=36000):
+# File keeping engine sessions to be reused by later runs
+SESSION_CACHE = os.path.expanduser("~/.cache/rhevm-utils/sessions.json")
+
+# Serializes API creation, as the sdk connection pool class is temporarily replaced
+_login_lock = threading.Lock()
+
+# TLS sessions and DNS lookups shared by every connection created in this process
+_curlshare = None
+if pycurl:
+    try:
+        _curlshare = pycurl.CurlShare()
+        _curlshare.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        _curlshare.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+    except (AttributeError, pycurl.error):
+        _curlshare = None
+
+
+# Upper bounds (seconds) of the api latency histogram buckets
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_uuid = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", re.I)
+
+
+def _collection(url):
+    """Returns collection name of an api url, removing ids, matrix and query parameters (hosts/nics)
+    @param url: url relative to api entry point
+    """
+    path = url.split("?")[0]
+    parts = [part.split(";")[0] for part in path.split("/")]
+    return "/".join([part for part in parts if part and not _uuid.match(part)]) or "/"
+
+
+class CallStats(object):
+    """Accounting of every request sent to the api in this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clears every counter"""
+        with self.lock:
+            self.requests = collections.defaultdict(int)
+            self.errors = collections.defaultdict(int)
+            self.seconds = collections.defaultdict(float)
+            self.sent = 0
+            self.received = 0
+            self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+            self.total = 0
+            self.elapsed = 0.0
+            self.start = time.time()
+
+    def record(self, method, url, sent, received, elapsed, status=None):
+        """Accounts one request
+        @param method: HTTP method
+        @param url: url relative to api entry point
+        @param sent: bytes of request body
+        @param received: bytes of response body
+        @param elapsed: seconds taken by the request
+        @param status: HTTP error status or None if it succeeded
+        """
+        key = (method, _collection(url))
+        bucket = len(LATENCY_BUCKETS)
+        for i, limit in enumerate(LATENCY_BUCKETS):
+            if elapsed <= limit:
+                bucket = i
+                break
+        with self.lock:
+            self.requests[key] += 1
+            self.seconds[key] += elapsed
+            if status is not None:
+                self.errors[(method, _collection(url), status)] += 1
+            self.sent += sent
+            self.received += received
+            self.buckets[bucket] += 1
+            self.total += 1
+            self.elapsed += elapsed
+
+    def summary(self):
+        """Returns dictionary with every counter, suitable for json"""
+        with self.lock:
+            return {"script": os.path.basename(sys.argv[0]),
+                    "runtime": time.time() - self.start,
+                    "requests": self.total,
+                    "seconds": self.elapsed,
+                    "sent": self.sent,
+                    "received": self.received,
+                    "calls": [{"method": method, "collection": collection, "requests": count,
+                               "seconds": self.seconds[(method, collection)]}
+                              for (method, collection), count in sorted(self.requests.items())],
+                    "errors": [{"method": method, "collection": collection, "status": status, "requests": count}
+                               for (method, collection, status), count in sorted(self.errors.items())],
+                    "latency": dict(zip([str(limit) for limit in LATENCY_BUCKETS] + ["+Inf"], self.buckets))}
+
+    def text(self):
+        """Returns human readable summary"""
+        data = self.summary()
+        lines = ["API calls for %s: %s requests in %.2fs (run %.2fs), %s bytes sent, %s bytes received" % (
+            data["script"], data["requests"], data["seconds"], data["runtime"], data["sent"], data["received"])]
+        for call in data["calls"]:
+            lines.append("  %-6s %-30s %6s requests %8.2fs" % (
+                call["method"], call["collection"], call["requests"], call["seconds"]))
+        for error in data["errors"]:
+            lines.append("  %-6s %-30s %6s errors (%s)" % (
+                error["method"], error["collection"], error["requests"], error["status"]))
+        limits = ["<=%ss" % limit for limit in LATENCY_BUCKETS] + [">%ss" % LATENCY_BUCKETS[-1]]
+        lines.append("  latency: " + " ".join(["%s:%s" % (limit, count) for limit, count in
+                                               zip(limits, self.buckets) if count]))
+        return "\n".join(lines)
+
+    def prometheus(self):
+        """Returns summary in Prometheus text exposition format"""
+        data = self.summary()
+        script = data["script"]
+        lines = ["# TYPE rhevm_utils_api_requests_total counter"]
+        for call in data["calls"]:
+            lines.append('rhevm_utils_api_requests_total{script="%s",method="%s",collection="%s"} %s' % (
+                script, call["method"], call["collection"], call["requests"]))
+        lines.append("# TYPE rhevm_utils_api_errors_total counter")
+        for error in data["errors"]:
+            lines.append('rhevm_utils_api_errors_total{script="%s",method="%s",collection="%s",status="%s"} %s' % (
+                script, error["method"], error["collection"], error["status"], error["requests"]))
+        lines.append("# TYPE rhevm_utils_api_bytes_total counter")
+        lines.append('rhevm_utils_api_bytes_total{script="%s",direction="sent"} %s' % (script, data["sent"]))
+        lines.append('rhevm_utils_api_bytes_total{script="%s",direction="received"} %s' % (script, data["received"]))
+        lines.append("# TYPE rhevm_utils_api_request_duration_seconds histogram")
+        cumulative = 0
+        for limit, count in zip([str(limit) for limit in LATENCY_BUCKETS] + ["+Inf"], self.buckets):
+            cumulative += count
+            lines.append('rhevm_utils_api_request_duration_seconds_bucket{script="%s",le="%s"} %s' % (
+                script, limit, cumulative))
+        lines.append('rhevm_utils_api_request_duration_seconds_sum{script="%s"} %s' % (script, data["seconds"]))
+        lines.append('rhevm_utils_api_request_duration_seconds_count{script="%s"} %s' % (script, data["requests"]))
+        lines.append("# TYPE rhevm_utils_run_seconds gauge")
+        lines.append('rhevm_utils_run_seconds{script="%s"} %s' % (script, data["runtime"]))
+        return "\n".join(lines) + "\n"
+
+    def write(self, target):
+        """Writes summary to target: "stderr", "json:<file>" or "prom:<file>"
+        @param target: where and how to write the summary
+        """
+        if target == "stderr":
+            sys.stderr.write(self.text() + "\n")
+            return
+        kind, _, path = target.partition(":")
+        if kind == "json":
+            content = json.dumps(self.summary(), sort_keys=True)
+        elif kind == "prom":
+            content = self.prometheus()
+        else:
+            sys.stderr.write("Unknown stats output %s\n" % target)
+            return
+        # Write and rename so collectors never read half written files
+        temporary = "%s.%s" % (path, os.getpid())
+        with open(temporary, "w") as handle:
+            handle.write(content)
+        os.rename(temporary, path)
+
+
+# Requests done by every API object created by apilogin() in this process
+callstats = CallStats()
+
+
+# Shared file holding rate limiter state of every script running on this host
+RATELIMIT_STATE = os.path.expanduser("~/.cache/rhevm-utils/ratelimit.json")
+
+
+class RateLimiter(object):
+    """Token bucket limiting requests sent to the engine, shared by every script on this host
+
+    Budget (requests per second) is split between the scripts that used it in the last minute
+    according to their share. All of them slow down together when the engine answers 503 or
+    its latency goes over target, recovering slowly afterwards.
+    """
+
+    def __init__(self, rate, share=1.0, path=RATELIMIT_STATE, latency=2.0):
+        """
+        @param rate: max requests per second for every script on this host
+        @param share: weight of this script when splitting the budget
+        @param path: state file shared between scripts
+        @param latency: seconds of average latency over which rate is reduced
+        """
+        self.rate = float(rate)
+        self.share = float(share)
+        self.path = path
+        self.latency = latency
+        self.key = "%s" % os.getpid()
+        self.script = os.path.basename(sys.argv[0])
+
+    def _client(self, state, now):
+        # Register this script and forget the ones not seen recently
+        clients = state.setdefault("clients", {})
+        for key in list(clients.keys()):
+            if now - clients[key]["seen"] > 60:
+                del clients[key]
+        client = clients.setdefault(self.key, {"script": self.script, "tokens": 1.0, "stamp": now})
+        client["share"] = self.share
+        client["seen"] = now
+        state["max"] = self.rate
+        state.setdefault("rate", self.rate)
+        state["rate"] = min(state["rate"], self.rate)
+        return client
+
+    def acquire(self):
+        """Waits until this script is allowed to send one more request"""
+        def take(state):
+            now = time.time()
+            client = self._client(state, now)
+            total = sum([other["share"] for other in state["clients"].values()])
+            rate = state["rate"] * client["share"] / total
+            client["tokens"] = min(max(1.0, rate), client["tokens"] + (now - client["stamp"]) * rate)
+            client["stamp"] = now
+            if client["tokens"] >= 1:
+                client["tokens"] -= 1
+                return 0, True
+            return (1 - client["tokens"]) / rate, True
+
+        wait = _jsonfile(self.path, take)
+        while wait > 0:
+            time.sleep(wait)
+            wait = _jsonfile(self.path, take)
+
+    def feedback(self, elapsed, status=None):
+        """Adapts shared rate to how the engine answered last request
+        @param elapsed: seconds taken by the request
+        @param status: HTTP error status or None if it succeeded
+        """
+        def adapt(state):
+            self._client(state, time.time())
+            minimum = max(0.1, state["max"] * 0.05)
+            state["latency"] = 0.8 * state.get("latency", elapsed) + 0.2 * elapsed
+            if status == 503:
+                state["rate"] = max(minimum, state["rate"] / 2)
+            elif state["latency"] > self.latency:
+                state["rate"] = max(minimum, state["rate"] * 0.9)
+            elif status is None:
+                state["rate"] = min(state["max"], state["rate"] + state["max"] / 100)
+            return None, True
+
+        _jsonfile(self.path, adapt)
+
+
+# Limiter used by every API object created in this process, set by apilogin()
+ratelimiter = None
+
+
+# Elements whose content is replaced before saving requests and responses to a cassette
+CASSETTE_SCRUB = re.compile(r"<((?:root_)?password|token|ssh_public_key|private_key)>.*?</\1>", re.S)
+
+
+class Cassette(object):
+    """Requests and responses of a run saved to a gzip compressed file of json lines, or served back from it
+
+    Recording saves method, path, request body, status and response of every request, with
+    passwords and keys in bodies scrubbed and without headers, so neither credentials nor
+    sessions are kept. Replaying serves the recorded response of each request in order, the
+    last one again if the script asks more times than recorded (like status polls), waiting
+    as long as the engine took or not at all.
+    """
+
+    MODES = ("record", "replay", "replay-fast")
+
+    def __init__(self, spec):
+        """
+        @param spec: "record:file", "replay:file" (with original timing) or "replay-fast:file" (no delays)
+        """
+        mode, _, path = spec.partition(":")
+        if mode not in self.MODES or not path:
+            raise ValueError("Cassette must be one of %s followed by :file" % ", ".join(self.MODES))
+        self.spec = spec
+        self.path = path
+        self.recording = mode == "record"
+        self.timed = mode == "replay"
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.handle = None
+        if self.recording:
+            self.handle = gzip.open(path, "wb")
+            self._write({"cassette": 1, "recorded": time.time()})
+            atexit.register(self.close)
+        else:
+            with gzip.open(path, "rb") as handle:
+                for line in handle:
+                    entry = json.loads(line.decode("utf-8"))
+                    if "cassette" in entry:
+                        continue
+                    self.entries.setdefault(self._key(entry["method"], entry["path"], entry["body"]), []).append(entry)
+
+    @staticmethod
+    def _scrub(text):
+        if not text:
+            return text
+        if isinstance(text, bytes):
+            text = text.decode("utf-8", "replace")
+        return CASSETTE_SCRUB.sub(r"<\1>*****</\1>", text)
+
+    def _key(self, method, path, body):
+        return method, path, self._scrub(body) or ""
+
+    def _write(self, entry):
+        self.handle.write((json.dumps(entry) + "\n").encode("utf-8"))
+
+    def record(self, method, path, body, status, reason, response, elapsed):
+        """Saves a request and its response
+        @param method: HTTP method
+        @param path: url path of the request
+        @param body: request body
+        @param status: HTTP status of the response, 0 if the connection failed
+        @param reason: HTTP reason or connection error
+        @param response: response body
+        @param elapsed: seconds the engine took to answer
+        """
+        entry = {"method": method, "path": path, "body": self._scrub(body) or "", "status": status,
+                 "reason": reason, "response": self._scrub(response) or "", "elapsed": round(elapsed, 4)}
+        with self.lock:
+            if self.handle:
+                self._write(entry)
+
+    def replay(self, method, path, body):
+        """Returns saved entry for a request (dictionary with status, reason, response and elapsed)
+        @param method: HTTP method
+        @param path: url path of the request
+        @param body: request body
+        """
+        with self.lock:
+            entries = self.entries.get(self._key(method, path, body))
+            if not entries:
+                raise IOError("Request not recorded in cassette %s: %s %s" % (self.path, method, path))
+            entry = entries.pop(0) if len(entries) > 1 else entries[0]
+        if self.timed:
+            time.sleep(entry["elapsed"])
+        return entry
+
+    def close(self):
+        with self.lock:
+            if self.handle:
+                self.handle.close()
+                self.handle = None
+
+
+# Cassette used by every API object and RestReader created in this process, set by apilogin()
+activecassette = None
+
+
+def _instrument(pool):
+    """Wraps requests done by an sdk connection pool to account them in callstats and apply rate limit
+    @param pool: sdk ConnectionsPool object
+    """
+    original = pool.do_request
+
+    def do_request(method, url, body=None, headers={}, last=False, persistent_auth=True):
+        attempt = 0
+        while True:
+            if ratelimiter:
+                ratelimiter.acquire()
+            start = time.time()
+            response = None
+            status = None
+            error = None
+            try:
+                if activecassette and not activecassette.recording:
+                    response = _replayed(activecassette.replay(method, url, body))
+                else:
+                    response = original(method, url, body=body, headers=headers, last=last,
+                                        persistent_auth=persistent_auth)
+                return response
+            except Exception as e:
+                error = e
+                status = getattr(e, "status", None) or type(e).__name__
+                if ratelimiter and status == 503 and method == "GET" and attempt < 3:
+                    # Engine overloaded, reads are safe to retry once rate has been reduced
+                    attempt += 1
+                    continue
+                raise
+            finally:
+                elapsed = time.time() - start
+                callstats.record(method, url, len(body or ""), len(response or ""), elapsed, status)
+                if ratelimiter:
+                    ratelimiter.feedback(elapsed, status)
+                if activecassette and activecassette.recording:
+                    _recorded(activecassette, method, url, body, response, error, elapsed)
+
+    pool.do_request = do_request
+
+
+def _recorded(cassette, method, url, body, response, error, elapsed):
+    """Saves request done by an sdk connection pool to cassette
+    @param cassette: Cassette being recorded
+    @param method: HTTP method
+    @param url: url path of the request
+    @param body: request body
+    @param response: response body if it succeeded
+    @param error: exception raised by the request if it failed
+    @param elapsed: seconds taken by the request
+    """
+    if error is None:
+        cassette.record(method, url, body, 200, "OK", response, elapsed)
+    elif isinstance(error, errors.RequestError):
+        # The sdk keeps only the detail of faults, which is what it shows when replayed
+        fault = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?><fault><reason>%s</reason>' \
+                '<detail>%s</detail></fault>' % (_xmlescape(error.reason or ""), _xmlescape(error.detail or ""))
+        cassette.record(method, url, body, error.status, error.reason, fault, elapsed)
+    else:
+        cassette.record(method, url, body, 0, "%s" % error, "", elapsed)
+
+
+def _replayed(entry):
+    """Returns response body of a cassette entry as the sdk connection pool would, raising its errors
+    @param entry: entry returned by Cassette.replay()
+    """
+    if entry["status"] == 0:
+        # Reason already has the message of the original error
+        raise IOError(entry["reason"])
+    if entry["status"] >= 400:
+        raise errors.RequestError(entry["status"], entry["reason"], entry["response"])
+    return entry["response"].encode("utf-8")
+
+
+def _xmlescape(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _poolcurl(pool):
+    """Returns the curl handle used by an sdk connection pool, or None if the sdk doesn't use curl
+    @param pool: sdk ConnectionsPool object
+    """
+    return getattr(pool, "_ConnectionsPool__curl", None)
+
+
+def _apicurl(api):
+    """Returns the curl handle used by an API object, or None if the sdk doesn't use curl
+    @param api: points to API object to reuse access
+    """
+    proxy = context.manager[api.id].get("proxy")
+    return _poolcurl(getattr(proxy, "_Proxy__pool", None))
+
+
+def _newapi(session=None, **kwargs):
+    """Creates API object sharing TLS sessions within process and resuming an engine session if provided
+    @param session: JSESSIONID cookie line (as returned by curl) to reuse instead of sending credentials
+    @param kwargs: arguments for API
+    """
+    original = ovirtsdk.api.ConnectionsPool
+
+    def pool(*args, **poolargs):
+        created = original(*args, **poolargs)
+        _instrument(created)
+        curl = _poolcurl(created)
+        if curl is not None:
+            try:
+                if _curlshare is not None:
+                    curl.setopt(pycurl.SHARE, _curlshare)
+                if session:
+                    curl.setopt(pycurl.COOKIELIST, session)
+            except pycurl.error:
+                pass
+        return created
+
+    with _login_lock:
+        ovirtsdk.api.ConnectionsPool = pool
+        try:
+            return API(**kwargs)
+        finally:
+            ovirtsdk.api.ConnectionsPool = original
+
+
+def _jsonfile(path, function):
+    """Calls function with the content of a json file while holding a lock on it, storing changes done
+
+    File is created only readable by its owner if missing.
+
+    @param path: json file
+    @param function: called with the loaded dictionary, returns a tuple (result, changed)
+    @return: result returned by function
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        handle = os.fdopen(os.dup(fd), "r+")
+        try:
+            try:
+                content = json.load(handle)
+            except ValueError:
+                content = {}
+            result, changed = function(content)
+            if changed:
+                handle.seek(0)
+                handle.truncate()
+                json.dump(content, handle)
+            return result
+        finally:
+            handle.close()
+    finally:
+        os.close(fd)
+
+
+def _sessions(path, key, value=None, remove=False):
+    """Reads, stores or removes the session saved for key in the sessions file
+
+    File is only readable by its owner as sessions allow access without password.
+
+    @param path: sessions file
+    @param key: identifies engine and user of the session
+    @param value: session data to store
+    @param remove: drop session for key
+    """
+    def update(sessions):
+        if value is None and not remove:
+            return sessions.get(key), False
+        if remove:
+            sessions.pop(key, None)
+        else:
+            sessions[key] = value
+        return None, True
+
+    return _jsonfile(path, update)
+
+
+# Directory holding per cluster lock files shared by all scripts on this host
+CLUSTER_LOCKS = os.path.expanduser("~/.cache/rhevm-utils/locks")
+
+
+@contextlib.contextmanager
+def clusterlock(cluster, engine="", path=CLUSTER_LOCKS):
+    """Holds an exclusive lock on a cluster while running the with block, waiting for other scripts to release it
+    @param cluster: cluster id
+    @param engine: engine url, to keep clusters of different engines apart
+    @param path: directory for lock files
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path, 0o700)
+    name = hashlib.sha1(("%s %s" % (engine, cluster)).encode("utf-8")).hexdigest()
+    fd = os.open(os.path.join(path, "%s.lock" % name), os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+# Api objects already logged in by this process and stats targets written at exit
+APIS = {}
+STATS_TARGETS = []
+
+
+def apilogin(url, username, password, insecure=True, persistent_auth=True, session_timeout=36000,
+             session_cache=SESSION_CACHE, stats=None, ratelimit=None, cassette=None):
     """
     @param url: URL for RHEV-M  / Ovirt
     @param username: username to use
@@ -60,20 +659,91 @@ def apilogin(url, username, password, insecure=True, persistent_auth=True, sessi
     @param insecure: if True, do not validate SSL cert
     @param persistent_auth: Use persistent authentication
     @param session_timeout: Session timeout for non-persistent authentication
+    @param session_cache: file to keep persistent sessions on to reuse them on next runs, None to disable
+    @param stats: write api calls summary at exit to "stderr", "json:<file>" or "prom:<file>"
+    @param ratelimit: max requests per second shared by scripts on this host and share of this one, as "rate[:share]"
+    @param cassette: record requests and responses to a file or replay them, as "record:<file>", "replay:<file>"
+                     or "replay-fast:<file>"
     @return:
     """
+    global ratelimiter, activecassette
+
     api = None
+    if stats and stats not in STATS_TARGETS:
+        STATS_TARGETS.append(stats)
+        atexit.register(callstats.write, stats)
+    if ratelimit:
+        rate, _, share = ("%s" % ratelimit).partition(":")
+        ratelimiter = RateLimiter(float(rate), float(share or 1))
+    if cassette and (activecassette is None or activecassette.spec != cassette):
+        try:
+            if activecassette:
+                activecassette.close()
+            activecassette = Cassette(cassette)
+        except (ValueError, IOError) as e:
+            print("Problem opening cassette: %s" % e)
+            sys.exit(1)
+    arguments = dict(url=url, username=username, password=password, insecure=insecure,
+                     persistent_auth=persistent_auth, session_timeout=session_timeout)
 
-    try:
-        api = API(url=url, username=username, password=password, insecure=insecure, persistent_auth=persistent_auth,
-                  session_timeout=session_timeout)
-    except:
-        print("Error while logging in with supplied credentials, please check and try again")
-        sys.exit(1)
+    key = "%s %s" % (url, username)
+    if key in APIS:
+        # Several scripts run in this process (see rhevm-utils.py), keep using the same login
+        return APIS[key]
+    # Replayed runs never reach the engine, so they don't use saved sessions
+    reuse = persistent_auth and session_cache and pycurl and not (activecassette and not activecassette.recording)
+
+    if reuse:
+        try:
+            saved = _sessions(session_cache, key)
+        except (IOError, OSError):
+            saved = None
+            reuse = False
+
+        # session_timeout is in minutes
+        if saved and time.time() - saved["stamp"] < session_timeout * 60:
+            try:
+                api = _newapi(session=saved["session"], **arguments)
+            except:
+                # Session expired or rejected by engine, login again
+                api = None
+
+    if not api:
+        try:
+            api = _newapi(**arguments)
+        except:
+            print("Error while logging in with supplied credentials, please check and try again")
+            sys.exit(1)
 
+    if reuse:
+        # Keep session (or its last use) for next run
+        curl = _apicurl(api)
+        session = None
+        if curl is not None:
+            for cookie in curl.getinfo(pycurl.INFO_COOKIELIST):
+                if cookie.split("\t")[5] == "JSESSIONID":
+                    session = cookie
+        try:
+            if session:
+                _sessions(session_cache, key, {"session": session, "stamp": time.time()})
+            else:
+                _sessions(session_cache, key, remove=True)
+        except (IOError, OSError):
+            pass
+
+    APIS[key] = api
     return api
 
 
+def errortext(error):
+    """Returns one line describing an exception for messages, with status and detail of engine errors
+    @param error: exception raised
+    """
+    if isinstance(error, errors.RequestError):
+        return "%s %s%s" % (error.status, error.reason, ": %s" % error.detail if error.detail else "")
+    return ("%s" % error).strip().replace("\n", " ") or error.__class__.__name__
+
+
 def check_tags(api, options):
     """Checks if required tags have been already defined and creates them if missing
 
@@ -85,50 +755,661 @@ def check_tags(api, options):
 
     tags = "elas_maint elas_manage elas_start elas_upgrade "
 
-    for tag in tags:
-        if not api.tags.get(name=tag):
+    defined = [tag.name for tag in api.tags.list()]
+    for tag in tags.split():
+        if tag not in defined:
             if options.verbosity >= 2:
-                print "Creating tag %s..." % tag
+                print("Creating tag %s..." % tag)
             api.tags.add(params.Tag(name=tag))
 
     return
 
 
-def migra(api, options, vm, action=None):
-    """Initiates migration action of the vm to specified host or automatically if None
+# MAC addresses and address of hosts saved when put on maintenance, so they can be powered on without the engine
+HOST_STORE = os.path.expanduser("~/.cache/rhevm-utils/hosts.json")
+
+# Seconds after which saved MACs are refreshed from the engine if it answers
+HOST_STORE_MAXAGE = 7 * 24 * 3600
+
+
+def _hoststore(path, engine, target, value=None):
+    """Reads or stores the entry saved for host of engine in the hosts file
+    @param path: hosts file
+    @param engine: api url of the engine
+    @param target: Host ID
+    @param value: values to store, merged with the ones already saved
+    """
+    def update(hosts):
+        if value is None:
+            return hosts.get(engine, {}).get(target), False
+        hosts.setdefault(engine, {}).setdefault(target, {}).update(value)
+        return None, True
+
+    return _jsonfile(path, update)
+
+
+def savehost(api, target, engine="", path=HOST_STORE):
+    """Saves MAC addresses of host nics and its address in the hosts file and returns the entry
+    @param api: points to API object to reuse access
+    @param target: Host ID
+    @param engine: api url of the engine, so hosts of several engines don't mix
+    @param path: hosts file
+    """
+    host = api.hosts.get(id=target)
+    macs = []
+    for nic in host.nics.list():
+        if nic.mac and nic.mac.get_address():
+            macs.append(nic.mac.get_address())
+    entry = {"name": host.name, "address": host.address, "macs": macs, "updated": time.time()}
+    _hoststore(path, engine, target, entry)
+    return entry
+
+
+def hostmacs(api, target, engine="", path=HOST_STORE, maxage=HOST_STORE_MAXAGE):
+    """Returns MAC addresses of host nics from the hosts file, only asking the engine for hosts missing there or
+    saved more than maxage seconds ago. Saved ones are used if the engine fails to answer
+    @param api: points to API object to reuse access
+    @param target: Host ID
+    @param engine: api url of the engine
+    @param path: hosts file
+    @param maxage: seconds after which saved MACs are refreshed
+    """
+    entry = _hoststore(path, engine, target)
+    if entry and "macs" in entry and time.time() - entry.get("updated", 0) < maxage:
+        return entry["macs"]
+    try:
+        return savehost(api, target, engine, path)["macs"]
+    except (errors.RequestError, errors.ConnectionError, AttributeError):
+        if entry and "macs" in entry:
+            return entry["macs"]
+        raise
+
+
+# Seconds of power on/off history used to rank hosts and number of boot times kept for each host
+HOST_HISTORY = 24 * 3600
+HOST_BOOTS = 5
+
+# Seconds to come back up after power on for a host to be ranked as the slowest
+BOOT_REFERENCE = 600
+
+# Preference between keeping up hosts with more memory (0) and hosts with less cores, using less power (1)
+POWER_WEIGHT = 0.5
+
+# Seconds between checks of hosts powered on coming back up
+BOOT_POLL = 10
+
+
+def hostevent(target, event, engine="", path=HOST_STORE):
+    """Records host being powered on (up) or off (down) in the hosts file, to rank hosts by their history
+    @param target: Host ID
+    @param event: up or down
+    @param engine: api url of the engine
+    @param path: hosts file
+    """
+    now = time.time()
+
+    def update(hosts):
+        entry = hosts.setdefault(engine, {}).setdefault(target, {})
+        entry["events"] = [item for item in entry.get("events", []) if now - item[0] < HOST_HISTORY] + [[now, event]]
+        if event == "up":
+            entry["activated"] = now
+        else:
+            entry.pop("activated", None)
+        return None, True
+
+    return _jsonfile(path, update)
+
+
+def hostsup(targets, engine="", path=HOST_STORE):
+    """Records time taken to come back up by hosts powered on that are now up
+    @param targets: IDs of hosts up
+    @param engine: api url of the engine
+    @param path: hosts file
+    """
+    now = time.time()
+    targets = set(targets)
+
+    def update(hosts):
+        changed = False
+        for target, entry in hosts.get(engine, {}).items():
+            if target in targets and entry.get("activated"):
+                entry["boots"] = (entry.get("boots", []) + [now - entry.pop("activated")])[-HOST_BOOTS:]
+                changed = True
+        return None, changed
+
+    return _jsonfile(path, update)
+
+
+def waithosts(api, targets, timeout=BOOT_REFERENCE, engine="", path=HOST_STORE, interval=BOOT_POLL):
+    """Waits for hosts powered on to be up on the engine recording their time to come back, and returns the ones up
+
+    Hosts still not up after timeout are recorded as taking timeout, hosts the engine
+    couldn't be asked about are not recorded.
+
     @param api: points to API object to reuse access
+    @param targets: IDs of hosts powered on
+    @param timeout: seconds to wait, 0 to not wait nor record anything
+    @param engine: api url of the engine
+    @param path: hosts file
+    @param interval: seconds between checks
+    """
+    up = []
+    pending = list(targets)
+    answered = set()
+    deadline = time.time() + timeout
+    while pending and timeout > 0:
+        answered = set()
+        for target in list(pending):
+            try:
+                state = api.hosts.get(id=target).status.state
+            except (errors.RequestError, errors.ConnectionError, AttributeError):
+                continue
+            answered.add(target)
+            if state == "up":
+                pending.remove(target)
+                up.append(target)
+                hostsup([target], engine, path)
+        if not pending or time.time() >= deadline:
+            break
+        time.sleep(min(interval, max(0, deadline - time.time())))
+
+    hostsup([target for target in pending if target in answered], engine, path)
+    return up
+
+
+def hostcpus(host):
+    """Returns number of cores of host, None if not reported by the engine
+    @param host: host object
+    """
+    try:
+        return host.cpu.topology.cores * (host.cpu.topology.sockets or 1)
+    except (AttributeError, TypeError):
+        return None
+
+
+def hostcost(entry, capacity, power, activating, powerweight=POWER_WEIGHT, now=None):
+    """Returns cost of powering a host on or off, lower is better
+
+    Adds up, each between 0 and 1: times the host was powered on or off recently, its average time
+    to come back up (0.5 if unknown) and its capacity (memory) and power used (cores) relative to
+    the other candidates, weighted by powerweight.
+
+    @param entry: entry saved for the host in the hosts file or None
+    @param capacity: memory of the host divided by the biggest candidate one, None if unknown
+    @param power: cores of the host divided by the biggest candidate ones, None if unknown
+    @param activating: True to rank for power on, False for power off
+    @param powerweight: preference of power saved over capacity, between 0 and 1
+    @param now: time to compare history with
+    """
+    entry = entry or {}
+    now = now or time.time()
+
+    recent = len([item for item in entry.get("events", []) if now - item[0] < HOST_HISTORY])
+    cost = min(1.0, recent / 4.0)
+
+    # Hosts quick to come back are preferred both to power on and off
+    boots = entry.get("boots")
+    if boots:
+        cost += min(1.0, sum(boots) / len(boots) / BOOT_REFERENCE)
+    else:
+        cost += 0.5
+
+    # Big hosts are preferred up for capacity, hungry ones down to save power
+    capacity = 0.5 if capacity is None else capacity
+    power = 0.5 if power is None else power
+    if activating:
+        cost += (1 - powerweight) * (1 - capacity) + powerweight * power
+    else:
+        cost += (1 - powerweight) * capacity + powerweight * (1 - power)
+    return cost
+
+
+def rankhosts(targets, memory, engine="", activating=True, powerweight=POWER_WEIGHT, path=HOST_STORE, cpus=None):
+    """Returns host IDs sorted from cheapest to most expensive to power on or off, ties in random order
+    @param targets: candidate host IDs
+    @param memory: dictionary of host ID to its memory
+    @param engine: api url of the engine
+    @param activating: True to rank for power on, False for power off
+    @param powerweight: preference of power saved over capacity, between 0 and 1
+    @param path: hosts file
+    @param cpus: dictionary of host ID to its cores
+    """
+    if not targets:
+        return []
+    cpus = cpus or {}
+    entries = _jsonfile(path, lambda hosts: (hosts.get(engine, {}), False))
+
+    def relative(values):
+        top = max([values.get(target) or 0 for target in targets])
+        return dict([(target, float(values[target]) / top if values.get(target) and top else None)
+                     for target in targets])
+
+    capacity = relative(memory)
+    power = relative(cpus)
+    now = time.time()
+    costs = dict([(target, hostcost(entries.get(target), capacity[target], power[target], activating, powerweight,
+                                    now)) for target in targets])
+    return sorted(targets, key=lambda target: (costs[target], random.random()))
+
+
+def wakeup(options, macs):
+    """Sends Wake-on-LAN packets to all MAC addresses at once through interfaces in options.wol, all if not set
     @param options: points to options object to reuse values provided on parent
-    @param action: host to migrate the VM to or use default
+    @param macs: MAC addresses to wake up
+    """
+    if not macs:
+        return 0
+    devices = options.wol.split(",") if options.wol else None
+    if options.verbosity >= 1:
+        print("Sending the power on action via %s" % ", ".join(macs))
+    try:
+        return rhev_wol.wake(macs, devices)
+    except (IOError, ValueError) as e:
+        print("Error sending power on action: %s" % e)
+        return 0
+
+
+class TagIndex(object):
+    """Tag membership of hosts and vms for a whole run, built with one search per tag
+
+    Scripts check membership locally instead of calling .tags.get() or .tags.list()
+    on every object. Tags are only searched the first time they're asked for.
+    """
+
+    def __init__(self, api, inventory=None):
+        """
+        @param api: points to API object to reuse access
+        @param inventory: InventoryCache to read searches from, if any
+        """
+        self.api = api
+        self.inventory = inventory
+        self.lock = threading.RLock()
+        self.tagnames = None
+        self.members = {}
+        self.bymember = collections.defaultdict(set)
+
+    def names(self):
+        """Returns names of every tag defined"""
+        if self.tagnames is None:
+            if self.inventory:
+                tags = self.inventory.list("tags")
+            else:
+                tags = self.api.tags.list()
+            self.tagnames = [tag.name for tag in tags]
+        return self.tagnames
+
+    def tagged(self, collection, tag):
+        """Returns set of ids of objects in collection with tag
+        @param collection: name of api collection (hosts or vms)
+        @param tag: tag name
+        """
+        key = (collection, tag)
+        with self.lock:
+            if key in self.members:
+                return self.members[key]
+
+        query = "tag = %s" % tag
+        if self.inventory:
+            elements = self.inventory.list(collection, query)
+        else:
+            elements = paginate(getattr(self.api, collection), query)
+        ids = set([element.id for element in elements])
+
+        with self.lock:
+            self.members[key] = ids
+            for member in ids:
+                self.bymember[(collection, member)].add(tag)
+        return ids
+
+    def reset(self):
+        """Drops tags and membership so the index can be reused by another script, reading them again"""
+        with self.lock:
+            self.tagnames = None
+            self.members = {}
+            self.bymember = collections.defaultdict(set)
+
+    def has(self, collection, member, tag):
+        """Returns True if object has tag
+        @param collection: name of api collection (hosts or vms)
+        @param member: object or its id
+        @param tag: tag name
+        """
+        return getattr(member, "id", member) in self.tagged(collection, tag)
+
+    def tagsof(self, collection, member, prefix=""):
+        """Returns names of tags of object starting with prefix
+        @param collection: name of api collection (hosts or vms)
+        @param member: object or its id
+        @param prefix: only consider tags whose name starts with it (like cluster_)
+        """
+        for name in self.names():
+            if name.startswith(prefix):
+                self.tagged(collection, name)
+        with self.lock:
+            tags = self.bymember[(collection, getattr(member, "id", member))]
+            return sorted([name for name in tags if name.startswith(prefix)])
+
+    def add(self, collection, member, tag):
+        """Records tag added to object by the script
+        @param collection: name of api collection (hosts or vms)
+        @param member: object or its id
+        @param tag: tag name
+        """
+        self._change(collection, getattr(member, "id", member), tag, True)
+
+    def remove(self, collection, member, tag):
+        """Records tag removed from object by the script
+        @param collection: name of api collection (hosts or vms)
+        @param member: object or its id
+        @param tag: tag name
+        """
+        self._change(collection, getattr(member, "id", member), tag, False)
+
+    def _change(self, collection, member, tag, added):
+        with self.lock:
+            ids = self.members.get((collection, tag))
+            if added:
+                if ids is not None:
+                    ids.add(member)
+                self.bymember[(collection, member)].add(tag)
+            else:
+                if ids is not None:
+                    ids.discard(member)
+                self.bymember[(collection, member)].discard(tag)
+        if self.inventory:
+            self.inventory.invalidate(collection)
+
+
+# Seconds to wait for a migration to finish and min/max seconds between status checks
+MIGRATION_TIMEOUT = 120
+MIGRATION_POLL_MIN = 1
+MIGRATION_POLL_MAX = 10
+
+# Outcome of a migration, status is one of "success", "timeout" or "failure"
+MigrationResult = collections.namedtuple("MigrationResult", ["vm", "status", "elapsed", "host"])
+
+
+def _vmhost(vm):
+    """Returns id of host running the vm or None
     @param vm: vm to work on
     """
-    if not action:
-        try:
+    if vm.host:
+        return vm.host.id
+    return None
+
+
+def migra_start(api, options, vm, action=None):
+    """Initiates migration action of the vm to specified host or automatically if None without waiting for it
+    @param api: points to API object to reuse access
+    @param options: points to options object to reuse values provided on parent
+    @param vm: vm to work on
+    @param action: host to migrate the VM to or use default
+    @return: pending migration to pass to migra_wait() or MigrationResult if it couldn't be started
+    """
+    start = time.time()
+    target = None
+    if action and action.host:
+        target = action.host.id
+
+    try:
+        if not action:
             vm.migrate()
-        except:
-            if options.verbosity > 4:
-                print("Problem migrating auto %s" % vm.name)
-    else:
-        try:
+        else:
             vm.migrate(action)
-        except:
-            if options.verbosity > 4:
-                print("Problem migrating fixed %s" % vm.name)
+    except:
+        if options.verbosity > 4:
+            print("Problem migrating %s %s" % ("fixed" if action else "auto", vm.name))
+        return MigrationResult(vm.name, "failure", time.time() - start, _vmhost(vm))
 
-    loop = True
-    counter = 0
-    while loop:
-        if vm.status.state == "up":
-            loop = False
-        if options.verbosity > 8:
-            print("VM migration loop %s" % counter)
-        time.sleep(10)
-        counter += 1
+    return {"vm": vm, "source": _vmhost(vm), "target": target, "start": start, "migrating": False}
+
+
+def _migra_check(options, pending, vm):
+    """Checks refreshed vm status against pending migration and returns MigrationResult if finished
+    @param options: points to options object to reuse values provided on parent
+    @param pending: pending migration as returned by migra_start()
+    @param vm: vm object freshly read from api
+    """
+    elapsed = time.time() - pending["start"]
+    if vm is None:
+        return MigrationResult(pending["vm"].name, "failure", elapsed, None)
+
+    state = vm.status.state
+    host = _vmhost(vm)
+    if options.verbosity > 8:
+        print("VM %s migration status %s on host %s after %.1fs" % (vm.name, state, host, elapsed))
+
+    if state == "migrating":
+        pending["migrating"] = True
+        return None
+
+    if state == "up":
+        if pending["target"] and host == pending["target"]:
+            return MigrationResult(vm.name, "success", elapsed, host)
+        if host != pending["source"]:
+            if pending["target"]:
+                # Landed on another host than requested
+                return MigrationResult(vm.name, "failure", elapsed, host)
+            return MigrationResult(vm.name, "success", elapsed, host)
+        if pending["migrating"]:
+            # Back up on the source host after migrating, so engine gave up
+            return MigrationResult(vm.name, "failure", elapsed, host)
+        return None
+
+    # Neither up nor migrating (down, paused, unknown...)
+    return MigrationResult(vm.name, "failure", elapsed, host)
+
+
+def _migra_poll(api, options, waiting, timeout):
+    """Reads status of every pending migration with one query and returns the finished ones
+    @param api: points to API object to reuse access
+    @param options: points to options object to reuse values provided on parent
+    @param waiting: dictionary of key -> pending migration as returned by migra_start()
+    @param timeout: seconds to wait for each migration since it was started
+    @return: dictionary of key -> MigrationResult for finished migrations
+    """
+    if len(waiting) == 1:
+        fresh = dict((vm.id, vm) for vm in [api.vms.get(id=item["vm"].id) for item in waiting.values()] if vm)
+    else:
+        fresh = {}
+        names = [item["vm"].name for item in waiting.values()]
+        # Keep queries short, engine search has a limited length
+        for chunk in range(0, len(names), 50):
+            query = " or ".join(["name = %s" % name for name in names[chunk:chunk + 50]])
+            for vm in paginate(api.vms, query, lookahead=0):
+                fresh[vm.id] = vm
 
-        if counter > 12:
-            loop = False
+    finished = {}
+    for key, item in waiting.items():
+        result = _migra_check(options, item, fresh.get(item["vm"].id))
+        if not result and time.time() - item["start"] > timeout:
             if options.verbosity > 8:
-                print("Exiting on max loop retries")
-    return
+                print("Exiting on max wait time for %s" % item["vm"].name)
+            result = MigrationResult(item["vm"].name, "timeout", time.time() - item["start"],
+                                     _vmhost(fresh[item["vm"].id]))
+        if result:
+            finished[key] = result
+    return finished
+
+
+def migra_wait(api, options, pending, timeout=MIGRATION_TIMEOUT):
+    """Waits for pending migrations to finish, polling all of them with one list query each round
+
+    Polling starts fast and slows down up to MIGRATION_POLL_MAX between checks.
+
+    @param api: points to API object to reuse access
+    @param options: points to options object to reuse values provided on parent
+    @param pending: list of pending migrations as returned by migra_start()
+    @param timeout: seconds to wait for each migration since it was started
+    @return: list of MigrationResult in the same order as pending
+    """
+    results = [None] * len(pending)
+    waiting = dict((i, item) for i, item in enumerate(pending) if not isinstance(item, MigrationResult))
+    for i, item in enumerate(pending):
+        if i not in waiting:
+            results[i] = item
+
+    interval = MIGRATION_POLL_MIN
+    loop = 0
+    while waiting:
+        time.sleep(interval)
+        interval = min(interval * 1.5, MIGRATION_POLL_MAX)
+        loop += 1
+        if options.verbosity > 8:
+            print("VM migration loop %s, %s migrations pending" % (loop, len(waiting)))
+
+        for i, result in _migra_poll(api, options, waiting, timeout).items():
+            results[i] = result
+            del waiting[i]
+
+    return results
+
+
+def migra(api, options, vm, action=None, timeout=MIGRATION_TIMEOUT):
+    """Initiates migration action of the vm to specified host or automatically if None and waits for it
+    @param api: points to API object to reuse access
+    @param options: points to options object to reuse values provided on parent
+    @param action: host to migrate the VM to or use default
+    @param vm: vm to work on
+    @param timeout: seconds to wait for migration to finish
+    @return: MigrationResult
+    """
+    result = migra_wait(api, options, [migra_start(api, options, vm, action)], timeout)[0]
+    if options.verbosity > 4:
+        print("VM %s migration %s after %.1fs" % (result.vm, result.status, result.elapsed))
+    return result
+
+
+# Default limits of simultaneous migrations for migra_batch()
+MIGRATION_MAX_OUT = 2
+MIGRATION_MAX_IN = 2
+MIGRATION_MAX_CLUSTER = 10
+
+
+def migra_batch(api, options, moves, max_out=MIGRATION_MAX_OUT, max_in=MIGRATION_MAX_IN,
+                max_cluster=MIGRATION_MAX_CLUSTER, timeout=MIGRATION_TIMEOUT):
+    """Runs several migrations at once, respecting limits of migrations per host and per cluster
+
+    Migrations are started in the order provided as soon as limits allow it, and all the ones
+    in progress are polled together.
+
+    @param api: points to API object to reuse access
+    @param options: points to options object to reuse values provided on parent
+    @param moves: list of (vm, host id) tuples, use None as host id to let engine choose destination
+    @param max_out: max simultaneous migrations leaving the same host
+    @param max_in: max simultaneous migrations arriving to the same host
+    @param max_cluster: max simultaneous migrations in the same cluster
+    @param timeout: seconds to wait for each migration since it was started
+    @return: list of MigrationResult in the same order as moves
+    """
+    max_out, max_in, max_cluster = max(1, max_out), max(1, max_in), max(1, max_cluster)
+    results = [None] * len(moves)
+    queued = list(range(len(moves)))
+    waiting = {}
+    outgoing = collections.defaultdict(int)
+    incoming = collections.defaultdict(int)
+    clusters = collections.defaultdict(int)
+
+    def slots(i):
+        vm, target = moves[i]
+        return _vmhost(vm), target, vm.cluster.id
+
+    interval = MIGRATION_POLL_MIN
+    while queued or waiting:
+        # Start every queued migration limits allow
+        started = False
+        for i in list(queued):
+            source, target, cluster = slots(i)
+            if outgoing[source] >= max_out or clusters[cluster] >= max_cluster:
+                continue
+            if target and incoming[target] >= max_in:
+                continue
+
+            queued.remove(i)
+            vm = moves[i][0]
+            action = None
+            if target:
+                action = params.Action(host=params.Host(id=target))
+            if options.verbosity > 4:
+                print("Starting migration of %s to %s" % (vm.name, target or "any host"))
+            pending = migra_start(api, options, vm, action)
+            if isinstance(pending, MigrationResult):
+                results[i] = pending
+                continue
+            waiting[i] = pending
+            outgoing[source] += 1
+            incoming[target] += 1
+            clusters[cluster] += 1
+            started = True
+
+        if not waiting:
+            continue
+
+        if started:
+            interval = MIGRATION_POLL_MIN
+        time.sleep(interval)
+        interval = min(interval * 1.5, MIGRATION_POLL_MAX)
+
+        for i, result in _migra_poll(api, options, waiting, timeout).items():
+            if options.verbosity > 4:
+                print("VM %s migration %s after %.1fs" % (result.vm, result.status, result.elapsed))
+            results[i] = result
+            del waiting[i]
+            source, target, cluster = slots(i)
+            outgoing[source] -= 1
+            incoming[target] -= 1
+            clusters[cluster] -= 1
+
+    return results
+
+
+def consolidation_plan(free, vms, candidates, limit=1, keep=1):
+    """Plans which hosts can be emptied by packing their VM's on the other hosts
+
+    Candidates using less memory are tried first. VM's are placed biggest first on the host
+    with least free memory they fit in, and hosts receiving VM's are never emptied.
+
+    @param free: dictionary of host id to free memory (max_scheduling_memory) for every host able to receive VM's
+    @param vms: dictionary of host id to list of (vm id, memory needed) running on it
+    @param candidates: host ids that can be emptied, only running VM's that can be migrated
+    @param limit: max hosts to empty
+    @param keep: min hosts that must remain up
+    @return: (list of host ids emptied, list of (vm id, destination host id) moves)
+    """
+    free = dict(free)
+    emptied = []
+    receiving = set()
+    moves = []
+
+    def load(host):
+        return sum([used for vmid, used in vms.get(host, [])])
+
+    for host in sorted(candidates, key=load):
+        if len(emptied) >= limit or len(free) - len(emptied) <= keep:
+            break
+        if host in receiving:
+            continue
+
+        placed = []
+        trial = dict(free)
+        for vmid, used in sorted(vms.get(host, []), key=lambda vm: vm[1], reverse=True):
+            fits = [(trial[target], target) for target in trial
+                    if target != host and target not in emptied and trial[target] >= used]
+            if not fits:
+                placed = None
+                break
+            target = min(fits)[1]
+            trial[target] -= used
+            placed.append((vmid, target))
+
+        if placed is None:
+            continue
+        free = trial
+        emptied.append(host)
+        receiving.update([target for vmid, target in placed])
+        moves.extend(placed)
+
+    return emptied, moves
 
 
 def vmused(api, vm):
@@ -145,24 +1426,884 @@ def vmused(api, vm):
     return used
 
 
-def paginate(element, oquery=""):
+# Methods that change an object on the engine, cached copies must be dropped after calling them
+MUTATING_METHODS = ("update", "migrate", "deactivate", "activate", "start", "stop", "shutdown", "delete")
+
+
+class CachedCollection(object):
+    """Read-through cache for one api collection (hosts, vms, clusters...) keyed by id and by name"""
+
+    def __init__(self, element, idmap, name):
+        """
+        @param element: points to api collection object to read from
+        @param idmap: IdentityMap this collection belongs to
+        @param name: name of api collection (hosts, vms, clusters)
+        """
+        self.element = element
+        self.idmap = idmap
+        self.name = name
+        self.byid = {}
+        self.byname = {}
+
+    def get(self, name=None, id=None):
+        """Returns object with name or id, querying api only if not already cached
+        @param name: name of the object to get
+        @param id: id of the object to get
+        """
+        with self.idmap.lock:
+            if id is not None and id in self.byid:
+                return self.byid[id]
+            if id is None and name is not None and name in self.byname:
+                return self.byname[name]
+
+        if id is not None:
+            obj = self.element.get(id=id)
+        else:
+            obj = self.element.get(name=name)
+        return self.prime(obj)
+
+    def prime(self, obj):
+        """Stores an object already retrieved (for example via paginate()) and returns it
+        @param obj: api object to store
+        """
+        if obj is None:
+            return obj
+        self.idmap.track(obj, self)
+        with self.idmap.lock:
+            self.byid[obj.id] = obj
+            self.byname[obj.name] = obj
+        return obj
+
+    def invalidate(self, obj=None):
+        """Drops object from cache so next get() reads it again from api, or every object if None
+        @param obj: api object to drop
+        """
+        with self.idmap.lock:
+            if obj is None:
+                self.byid.clear()
+                self.byname.clear()
+                return
+            if self.byid.get(obj.id) is obj:
+                del self.byid[obj.id]
+            if self.byname.get(obj.name) is obj:
+                del self.byname[obj.name]
+
+
+class IdentityMap(object):
+    """Per-run cache of hosts, vms and clusters so each object is only read once unless changed
+
+    Objects returned are the sdk ones with their mutating methods (see MUTATING_METHODS)
+    wrapped to drop them from cache once called.
+    """
+
+    def __init__(self, api, inventory=None):
+        """
+        @param api: points to API object to reuse access
+        @param inventory: InventoryCache to invalidate when objects are changed
+        """
+        self.lock = threading.RLock()
+        self.inventory = inventory
+        # Functions called with the vm once it is migrated, started or stopped
+        self.watchers = []
+        self.hosts = CachedCollection(api.hosts, self, "hosts")
+        self.vms = CachedCollection(api.vms, self, "vms")
+        self.clusters = CachedCollection(api.clusters, self, "clusters")
+
+    def reset(self):
+        """Drops hosts, vms and watchers so the map can be reused by another script, keeping clusters"""
+        with self.lock:
+            self.watchers = []
+        self.hosts.invalidate()
+        self.vms.invalidate()
+
+    def track(self, obj, collection):
+        """Wraps mutating methods of object to invalidate it from collection when called
+        @param obj: api object to wrap
+        @param collection: CachedCollection holding the object
+        """
+        for method in MUTATING_METHODS:
+            original = getattr(obj, method, None)
+            if original is None or getattr(original, "idmap_wrapped", False):
+                continue
+            setattr(obj, method, self._wrap(obj, collection, method, original))
+
+    def _wrap(self, obj, collection, method, original):
+        def wrapper(*args, **kwargs):
+            try:
+                return original(*args, **kwargs)
+            finally:
+                collection.invalidate(obj)
+                moved = collection is self.vms and method in ("migrate", "start", "stop", "shutdown")
+                if moved:
+                    # Hosts memory and vm count change when vm moves
+                    self.hosts.invalidate()
+                    for watcher in self.watchers:
+                        watcher(obj)
+                if self.inventory:
+                    self.inventory.invalidate(collection.name)
+                    if moved:
+                        self.inventory.invalidate("hosts")
+
+        wrapper.idmap_wrapped = True
+        return wrapper
+
+
+# Seconds a listing stored in the inventory cache is considered valid, per collection
+INVENTORY_TTL = {"hosts": 300, "vms": 300, "clusters": 3600, "tags": 3600, "storagedomains": 300}
+
+# Collections whose .list() doesn't accept search queries
+NO_SEARCH = ("tags",)
+
+
+class InventoryCache(object):
+    """Snapshot of api listings stored on disk (sqlite) to be reused by runs close in time
+
+    If no path is provided, listings are kept in memory when asked to (for scripts run
+    one after the other in the same process) or not stored at all, every listing is
+    then read from api.
+    """
+
+    def __init__(self, api, path=None, engine="", ttl=None, memory=False):
+        """
+        @param api: points to API object to reuse access
+        @param path: sqlite file to store listings on, None disables caching
+        @param engine: engine url, to keep listings of different engines apart
+        @param ttl: dictionary of collection -> seconds overriding INVENTORY_TTL
+        @param memory: keep listings in memory if no path is provided
+        """
+        self.api = api
+        self.path = path
+        self.engine = engine
+        self.lock = threading.RLock()
+        # (collection, query) -> (stamp, list of (id, kind, xml)), same rows as on disk
+        self.stored = {} if memory and not path else None
+        self.ttl = dict(INVENTORY_TTL)
+        if ttl:
+            self.ttl.update(ttl)
+
+        if self.path:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            db = self._connect()
+            try:
+                db.execute("CREATE TABLE IF NOT EXISTS listing (engine TEXT, collection TEXT, query TEXT, "
+                           "stamp REAL, PRIMARY KEY (engine, collection, query))")
+                db.execute("CREATE TABLE IF NOT EXISTS item (engine TEXT, collection TEXT, query TEXT, "
+                           "position INTEGER, id TEXT, kind TEXT, xml TEXT)")
+                db.execute("CREATE INDEX IF NOT EXISTS item_listing ON item (engine, collection, query)")
+                db.execute("CREATE INDEX IF NOT EXISTS item_id ON item (engine, collection, id)")
+            finally:
+                db.close()
+            os.chmod(self.path, 0o600)
+
+    def _connect(self):
+        # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE so
+        # concurrent runs serialize their writes instead of failing
+        db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _fetch(self, collection, query):
+        element = getattr(self.api, collection)
+        if collection in NO_SEARCH:
+            return element.list()
+        return list(paginate(element, query))
+
+    def _load(self, kind, xml):
+        entity = params.parseString(xml, silence=True)
+        return getattr(brokers, kind)(entity, self.api.id)
+
+    def list(self, collection, query="", maxage=None):
+        """Returns listing for collection and query, from disk if younger than its ttl
+        @param collection: name of api collection (hosts, vms, clusters, tags...)
+        @param query: optional query to pass to limit search results
+        @param maxage: seconds overriding the ttl for this call, 0 to always read from api
+        """
+        if not self.path and self.stored is None:
+            return self._fetch(collection, query)
+
+        if maxage is None:
+            maxage = self.ttl.get(collection, 0)
+
+        if self.stored is not None:
+            with self.lock:
+                stamp, rows = self.stored.get((collection, query), (0, []))
+            if time.time() - stamp <= maxage:
+                return [self._load(kind, xml) for item, kind, xml in rows]
+            elements = self._fetch(collection, query)
+            self._store(collection, query, elements)
+            return elements
+
+        db = self._connect()
+        try:
+            row = db.execute("SELECT stamp FROM listing WHERE engine = ? AND collection = ? AND query = ?",
+                             (self.engine, collection, query)).fetchone()
+            if row and time.time() - row[0] <= maxage:
+                rows = db.execute("SELECT kind, xml FROM item WHERE engine = ? AND collection = ? AND query = ? "
+                                  "ORDER BY position", (self.engine, collection, query)).fetchall()
+                return [self._load(kind, xml) for kind, xml in rows]
+        finally:
+            db.close()
+
+        elements = self._fetch(collection, query)
+        self._store(collection, query, elements)
+        return elements
+
+    def _store(self, collection, query, elements):
+        if self.stored is not None:
+            rows = [(element.id, type(element).__name__, ParseHelper.toXml(element)) for element in elements]
+            with self.lock:
+                self.stored[(collection, query)] = (time.time(), rows)
+            return
+
+        rows = []
+        for position, element in enumerate(elements):
+            rows.append((self.engine, collection, query, position, element.id, type(element).__name__,
+                         ParseHelper.toXml(element)))
+
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM item WHERE engine = ? AND collection = ? AND query = ?",
+                       (self.engine, collection, query))
+            db.executemany("INSERT INTO item VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            db.execute("INSERT OR REPLACE INTO listing VALUES (?, ?, ?, ?)",
+                       (self.engine, collection, query, time.time()))
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def fresh(self, collection, id=None, name=None):
+        """Returns object read directly from api, to be used before changing it, and updates stored copies
+        @param collection: name of api collection (hosts, vms, clusters...)
+        @param id: id of the object to get
+        @param name: name of the object to get
+        """
+        element = getattr(self.api, collection)
+        if id is not None:
+            obj = element.get(id=id)
+        else:
+            obj = element.get(name=name)
+
+        if self.stored is not None and obj is not None:
+            xml = ParseHelper.toXml(obj)
+            with self.lock:
+                for (stored, query), (stamp, rows) in self.stored.items():
+                    if stored == collection:
+                        for position, (item, kind, old) in enumerate(rows):
+                            if item == obj.id:
+                                rows[position] = (item, kind, xml)
+        elif self.path and obj is not None:
+            db = self._connect()
+            try:
+                db.execute("BEGIN IMMEDIATE")
+                db.execute("UPDATE item SET xml = ? WHERE engine = ? AND collection = ? AND id = ?",
+                           (ParseHelper.toXml(obj), self.engine, collection, obj.id))
+                db.execute("COMMIT")
+            finally:
+                db.close()
+        return obj
+
+    def invalidate(self, collection=None):
+        """Drops stored listings for collection, or every collection if None, so they're read again
+        @param collection: name of api collection (hosts, vms, clusters...)
+        """
+        if self.stored is not None:
+            with self.lock:
+                for key in list(self.stored):
+                    if not collection or key[0] == collection:
+                        del self.stored[key]
+            return
+        if not self.path:
+            return
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            if collection:
+                db.execute("DELETE FROM listing WHERE engine = ? AND collection = ?", (self.engine, collection))
+                db.execute("DELETE FROM item WHERE engine = ? AND collection = ?", (self.engine, collection))
+            else:
+                db.execute("DELETE FROM listing WHERE engine = ?", (self.engine,))
+                db.execute("DELETE FROM item WHERE engine = ?", (self.engine,))
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+
+# Set by rhevm-utils.py when running several scripts in this process, to share what they read with sharedstate()
+SHARED_RUNS = False
+SHARED_STATE = {}
+
+
+def sharedstate(api, cache=None, engine=""):
+    """Returns (inventory, idmap, tagindex) for a script run
+
+    Scripts run alone get new ones. Scripts run one after the other from rhevm-utils.py (tasks
+    joined with '+' or daemon jobs) get the same ones for the engine, with listings kept in memory
+    on their INVENTORY_TTL if there is no cache file, so they start with what previous ones read.
+    Hosts, vms and tags cached by previous scripts are dropped, they're read again from listings.
+
+    @param api: points to API object to reuse access
+    @param cache: sqlite file for InventoryCache, None to not store listings on disk
+    @param engine: engine url
+    """
+    if not SHARED_RUNS:
+        inventory = InventoryCache(api, cache, engine)
+        return inventory, IdentityMap(api, inventory), TagIndex(api, inventory)
+
+    state = SHARED_STATE.get((engine, cache))
+    if state and state[0].api is api:
+        state[1].reset()
+        state[2].reset()
+        return state
+
+    inventory = InventoryCache(api, cache, engine, memory=True)
+    state = (inventory, IdentityMap(api, inventory), TagIndex(api, inventory))
+    SHARED_STATE[(engine, cache)] = state
+    return state
+
+
+# Fields kept by compact records of each collection, dotted names are read from nested elements
+RECORD_FIELDS = {
+    "vms": ("id", "name", "cluster.id", "host.id", "status.state", "os.type_", "memory", "memory_policy.guaranteed",
+            "placement_policy.affinity"),
+    "hosts": ("id", "name", "cluster.id", "status.state", "memory", "max_scheduling_memory", "summary.total"),
+    "clusters": ("id", "name"),
+    "storagedomains": ("id", "name", "used", "available"),
+    "statistics": ("id", "name", "values.value.datum"),
+}
+
+# Record fields (last part of name) holding integers or decimals
+RECORD_INTEGERS = ("memory", "max_scheduling_memory", "total", "active", "migrating", "used", "available",
+                   "committed", "size", "cores", "sockets", "guaranteed")
+RECORD_DECIMALS = ("datum",)
+
+
+class Record(object):
+    """Base of compact read-only copies of api objects keeping only some fields"""
+    __slots__ = ()
+    nested = {}
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__,
+                           ", ".join(["%s=%r" % (slot, getattr(self, slot)) for slot in self.__slots__]))
+
+
+_RECORD_CLASSES = {}
+
+
+def _recordclass(name, fields):
+    """Returns Record class with slots for fields, creating it on first use
+    @param name: name of xml element the records are read from
+    @param fields: field names, dotted ones are grouped in nested Record classes
+    """
+    key = (name, tuple(fields))
+    if key not in _RECORD_CLASSES:
+        slots = []
+        nested = collections.OrderedDict()
+        for field in fields:
+            head, dot, rest = field.partition(".")
+            if head not in slots:
+                slots.append(head)
+            if rest:
+                nested.setdefault(head, []).append(rest)
+        attributes = {"__slots__": tuple(slots), "nested": {}}
+        for head, rest in nested.items():
+            attributes["nested"][head] = _recordclass(head, rest)
+        _RECORD_CLASSES[key] = type(str("%sRecord" % name.capitalize()), (Record,), attributes)
+    return _RECORD_CLASSES[key]
+
+
+def _record(cls, elem):
+    """Returns record of class cls with values read from xml element
+    @param cls: Record class to create
+    @param elem: xml element for the object
+    """
+    record = cls()
+    for slot in cls.__slots__:
+        # Fields clashing with python keywords have an underscore appended (type_)
+        name = slot.rstrip("_")
+        if slot in cls.nested:
+            child = elem.find(name)
+            value = None if child is None else _record(cls.nested[slot], child)
+        else:
+            value = elem.get(name)
+            if value is None:
+                value = elem.findtext(name)
+            if value is not None:
+                if slot in RECORD_INTEGERS:
+                    value = int(value)
+                elif slot in RECORD_DECIMALS:
+                    value = float(value)
+        setattr(record, slot, value)
+    return record
+
+
+def _records(stream, cls):
+    """Returns records for objects of collection xml, parsing and discarding one object at a time
+    @param stream: file like object with the xml
+    @param cls: Record class to create
+    """
+    records = []
+    root = None
+    depth = 0
+    for event, elem in ElementTree.iterparse(stream, ("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            if elem.get("id") is not None:
+                records.append(_record(cls, elem))
+            root.clear()
+    return records
+
+
+class _CountedStream(object):
+    """File like wrapper counting bytes read from a stream, and keeping them if asked to"""
+
+    def __init__(self, stream, capture=False):
+        self.stream = stream
+        self.size = 0
+        self.chunks = [] if capture else None
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.size += len(data)
+        if self.chunks is not None:
+            self.chunks.append(data)
+        return data
+
+
+class _ReplayedResponse(object):
+    """Response read from a cassette entry, like the ones returned by httplib"""
+
+    def __init__(self, entry):
+        if entry["status"] == 0:
+            # Reason already has the message of the original error
+            raise IOError(entry["reason"])
+        self.status = entry["status"]
+        self.reason = entry["reason"]
+        self.stream = io.BytesIO(entry["response"].encode("utf-8"))
+
+    def read(self, *args):
+        return self.stream.read(*args)
+
+
+class RestReader(object):
+    """Read only REST client running many independent GET requests at once
+
+    Each worker thread keeps its own keep-alive connection to the engine, reusing the
+    session of the API object when available. Meant for paths doing one request per
+    object (statistics, disks, nics...) which the sdk can only run one after another.
+    """
+
+    def __init__(self, api, url, username=None, password=None, insecure=True, concurrency=8):
+        """
+        @param api: points to API object to reuse its session
+        @param url: URL for RHEV-M  / Ovirt api
+        @param username: username to use if session can't be reused
+        @param password: password for username
+        @param insecure: if True, do not validate SSL cert
+        @param concurrency: max requests running at once
+        """
+        parsed = urlparse.urlparse(url)
+        self.https = parsed.scheme == "https"
+        self.netloc = parsed.netloc
+        self.prefix = parsed.path.rstrip("/")
+        self.insecure = insecure
+        self.concurrency = max(1, concurrency)
+        self.local = threading.local()
+
+        self.headers = {"Version": "3", "Accept": "application/xml", "Prefer": "persistent-auth"}
+        curl = _apicurl(api)
+        session = None
+        if curl is not None:
+            for cookie in curl.getinfo(pycurl.INFO_COOKIELIST):
+                fields = cookie.split("\t")
+                if fields[5] == "JSESSIONID":
+                    session = fields[6]
+        if session:
+            self.headers["Cookie"] = "JSESSIONID=%s" % session
+        elif username is not None:
+            self.headers["Authorization"] = "Basic %s" % base64.b64encode(
+                ("%s:%s" % (username, password)).encode("utf-8")).decode("ascii")
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            if self.https:
+                context = None
+                if self.insecure and hasattr(ssl, "_create_unverified_context"):
+                    context = ssl._create_unverified_context()
+                connection = httplib.HTTPSConnection(self.netloc, context=context)
+            else:
+                connection = httplib.HTTPConnection(self.netloc)
+            self.local.connection = connection
+        return connection
+
+    def _request(self, path, parse):
+        """Runs a GET request and returns the response as processed by parse
+        @param path: url relative to api entry point (like /hosts/<id>/statistics)
+        @param parse: function receiving the response stream
+        """
+        attempt = 0
+        while True:
+            if ratelimiter:
+                ratelimiter.acquire()
+            start = time.time()
+            response = None
+            stream = None
+            status = None
+            error = None
+            connection = None
+            try:
+                try:
+                    if activecassette and not activecassette.recording:
+                        response = _ReplayedResponse(activecassette.replay("GET", self.prefix + path, None))
+                    else:
+                        connection = self._connection()
+                        connection.request("GET", self.prefix + path, headers=self.headers)
+                        response = connection.getresponse()
+                except (httplib.HTTPException, IOError) as e:
+                    # Connection closed by server, retry once with a new one
+                    error = e
+                    if connection:
+                        connection.close()
+                        self.local.connection = None
+                    if attempt > 0:
+                        raise
+                    attempt += 1
+                    continue
+                stream = _CountedStream(response, capture=bool(activecassette and activecassette.recording))
+                if response.status >= 400:
+                    status = response.status
+                    stream.read()
+                    if ratelimiter and status == 503 and attempt < 3:
+                        attempt += 1
+                        continue
+                    raise IOError("Error %s reading %s: %s" % (response.status, path, response.reason))
+                try:
+                    return parse(stream)
+                except:
+                    # Response may be left half read
+                    if connection:
+                        connection.close()
+                        self.local.connection = None
+                    raise
+            finally:
+                elapsed = time.time() - start
+                callstats.record("GET", path, 0, stream.size if stream else 0, elapsed, status)
+                if ratelimiter:
+                    ratelimiter.feedback(elapsed, status)
+                if activecassette and activecassette.recording:
+                    if stream:
+                        activecassette.record("GET", self.prefix + path, None, response.status, response.reason,
+                                              b"".join(stream.chunks), elapsed)
+                    elif error is not None:
+                        activecassette.record("GET", self.prefix + path, None, 0, "%s" % error, "", elapsed)
+
+    def get(self, path):
+        """Returns parsed response of a GET request
+        @param path: url relative to api entry point (like /hosts/<id>/statistics)
+        """
+        return self._request(path, lambda stream: params.parseString(stream.read(), silence=True))
+
+    def records(self, collection, query=None, max=None, fields=None):
+        """Returns compact records of a collection listing, parsed while it is received
+        @param collection: collection path relative to api entry point (vms, hosts/<id>/statistics...)
+        @param query: optional search query
+        @param max: optional max number of results
+        @param fields: fields to keep, defaults to RECORD_FIELDS of the collection
+        """
+        kind = collection.split("/")[-1]
+        cls = _recordclass(kind[:-1], fields or RECORD_FIELDS[kind])
+        path = "/%s" % collection
+        if max is not None:
+            path += ";max=%s" % max
+        if query:
+            path += "?search=%s" % quote(query)
+        return self._request(path, lambda stream: _records(stream, cls))
+
+    def collection(self, collection, fields=None):
+        """Returns object listing records of collection with .list(query, max), usable with paginate()
+        @param collection: name of api collection (hosts, vms, clusters...)
+        @param fields: fields to keep, defaults to RECORD_FIELDS of the collection
+        """
+        return RecordCollection(self, collection, fields)
+
+    def map(self, paths, function=None):
+        """Returns parsed responses of GET requests for every path, running several at once
+
+        A failing request (like an object deleted meanwhile) returns None for its path
+        instead of aborting the others.
+
+        @param paths: list of urls relative to api entry point
+        @param function: function to call for each path instead of get()
+        """
+        if not paths:
+            return []
+        function = function or self.get
+
+        def request(path):
+            try:
+                return function(path)
+            except Exception:
+                return None
+
+        pool = ThreadPool(min(self.concurrency, len(paths)))
+        try:
+            return pool.map(request, paths)
+        finally:
+            pool.close()
+
+    def subcollection(self, collection, ids, sub):
+        """Returns dictionary of id -> list of elements of a subcollection for every object, objects that
+        couldn't be read are left out
+        @param collection: name of api collection (hosts, vms...)
+        @param ids: ids of objects to read subcollection of
+        @param sub: name of subcollection (disks, nics, statistics...)
+        """
+        ids = list(ids)
+        paths = ["/%s/%s/%s" % (collection, member, sub) for member in ids]
+        getter = "get_%s" % sub[:-1]
+        return dict([(member, getattr(result, getter)()) for member, result in zip(ids, self.map(paths))
+                     if result is not None])
+
+    def statistics(self, collection, ids):
+        """Returns dictionary of id -> {statistic name: value} for every object, empty for the ones that couldn't
+        be read
+        @param collection: name of api collection (hosts or vms)
+        @param ids: ids of objects to read statistics of
+        """
+        ids = list(ids)
+        paths = ["%s/%s/statistics" % (collection, member) for member in ids]
+        values = {}
+        for member, statistics in zip(ids, self.map(paths, self.records)):
+            # Objects that couldn't be read get no values
+            values[member] = dict([(statistic.name, statistic.values.value.datum) for statistic in statistics or []
+                                   if statistic.values and statistic.values.value])
+        return values
+
+
+class RecordCollection(object):
+    """Collection listing compact records instead of sdk objects, see RestReader.collection()"""
+
+    def __init__(self, reader, collection, fields=None):
+        """
+        @param reader: RestReader to request listings with
+        @param collection: name of api collection (hosts, vms, clusters...)
+        @param fields: fields to keep, defaults to RECORD_FIELDS of the collection
+        """
+        self.reader = reader
+        self.collection = collection
+        self.fields = fields
+
+    def list(self, query=None, max=None):
+        """Returns records matching query, like .list() of sdk collections
+        @param query: optional search query
+        @param max: optional max number of results
+        """
+        return self.reader.records(self.collection, query, max, self.fields)
+
+
+class VmStats(object):
+    """Statistics of many VM's read at once and kept in memory until the VM is moved
+
+    Statistics of a VM are dropped once it is migrated, started or stopped through
+    objects from the IdentityMap, or when invalidate() is called.
+    """
+
+    def __init__(self, api, reader, idmap=None):
+        """
+        @param api: points to API object to reuse access
+        @param reader: RestReader to request statistics with
+        @param idmap: IdentityMap whose vm changes expire statistics
+        """
+        self.api = api
+        self.reader = reader
+        self.lock = threading.Lock()
+        self.values = {}
+        if idmap:
+            idmap.watchers.append(self.invalidate)
+
+    def load(self, vms):
+        """Reads statistics of all VM's not already loaded in one parallel batch
+        @param vms: list of vm objects or ids
+        """
+        ids = [getattr(vm, "id", vm) for vm in vms]
+        with self.lock:
+            missing = [vmid for vmid in set(ids) if vmid not in self.values]
+        if missing:
+            values = self.reader.statistics("vms", missing)
+            with self.lock:
+                self.values.update(values)
+
+    def load_query(self, query):
+        """Reads statistics of all VM's matching a search (like all vms on a host or cluster)
+        @param query: search query for vms
+        """
+        self.load([vm.id for vm in paginate(self.api.vms, query)])
+
+    def get(self, vm, name):
+        """Returns value of a statistic for vm, loading it if needed
+        @param vm: vm object or id
+        @param name: name of statistic (memory.used, cpu.current.guest...)
+        """
+        vmid = getattr(vm, "id", vm)
+        with self.lock:
+            values = self.values.get(vmid)
+        if values is None:
+            self.load([vmid])
+            with self.lock:
+                values = self.values.get(vmid, {})
+        return values.get(name)
+
+    def used(self, vm):
+        """Returns amount of memory used by the VM from Agent if installed or configured if not, like vmused()
+        @param vm: vm object or id
+        """
+        used = self.get(vm, "memory.used")
+        if not used:
+            used = self.get(vm, "memory.installed")
+        return used
+
+    def invalidate(self, vm=None):
+        """Drops statistics of vm so they're read again next time, or of every vm if None
+        @param vm: vm object or id
+        """
+        with self.lock:
+            if vm is None:
+                self.values.clear()
+            else:
+                self.values.pop(getattr(vm, "id", vm), None)
+
+
+def _getpage(element, oquery, page, pagesize):
+    """Returns one page of results of .list() for an object
+
+    @param element: points to api object for reuse
+    @param oquery: optional query to pass to limit search results
+    @param page: page number to request (starting at 1)
+    @param pagesize: number of elements to request per page
+    """
+    query = "%s page %s" % (oquery, page)
+    return element.list(query=query, max=pagesize)
+
+
+def _prefetch(element, oquery, pagesize, workers, pages, stop):
+    """Fetches pages in order and puts them on the queue until a short page is found
+
+    Runs on a background thread feeding paginate(), puts a ("page", list) tuple for each
+    page, ("error", exception) if a request fails and ("end", None) when done.
+
+    @param element: points to api object for reuse
+    @param oquery: optional query to pass to limit search results
+    @param pagesize: number of elements to request per page
+    @param workers: number of pages to request at once
+    @param pages: bounded queue shared with the consumer
+    @param stop: event set by the consumer when it no longer wants more pages
+    """
+    pool = None
+    if workers > 1:
+        pool = ThreadPool(workers)
+
+    def put(item):
+        # Block while the queue is full, but give up if consumer went away
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        page = 1
+        more = True
+        while more and not stop.is_set():
+            # First page is requested alone, so small listings don't pay for extra requests
+            numbers = range(page, page + (workers if page > 1 else 1))
+            try:
+                if pool and len(numbers) > 1:
+                    tandas = pool.map(lambda number: _getpage(element, oquery, number, pagesize), numbers)
+                else:
+                    tandas = [_getpage(element, oquery, page, pagesize)]
+            except Exception as e:
+                put(("error", e))
+                return
+            for tanda in tandas:
+                if not put(("page", tanda)):
+                    return
+                if len(tanda) < pagesize:
+                    # Short page means there's nothing else to fetch
+                    more = False
+                    break
+            page += len(numbers)
+        put(("end", None))
+    finally:
+        if pool:
+            pool.close()
+
+
+def paginate(element, oquery="", pagesize=100, lookahead=2, workers=1):
     """
     Paginates results of .list() for an object to avoid api limitations,
     it is created as generator to improve performance.
 
+    Next pages are requested on a background thread while the caller is still
+    consuming the current one, keeping at most lookahead pages in memory. Paging
+    stops as soon as a page returns less than pagesize elements.
+
     @param element: points to api object for reuse
     @param oquery:  optional query to pass to limit search results
+    @param pagesize: number of elements to request per page
+    @param lookahead: pages to prefetch while caller processes current one, 0 to disable prefetching
+    @param workers: pages to request at once, use more than 1 when the full listing is going to be read. Only
+                    used with RecordCollection: sdk collections share one curl handle behind a lock, so their
+                    pages are always requested one at a time
     """
 
-    page = 0
-    length = 100
-    while length > 0:
-        page += 1
-        query = "%s page %s" % (oquery, page)
-        tanda = element.list(query=query)
-        length = len(tanda)
-        for elem in tanda:
-            yield elem
+    workers = max(1, workers)
+    if not isinstance(element, RecordCollection):
+        workers = 1
+
+    if lookahead <= 0 and workers == 1:
+        # No prefetching, just request pages one by one
+        page = 0
+        length = pagesize
+        while length >= pagesize:
+            page += 1
+            tanda = _getpage(element, oquery, page, pagesize)
+            length = len(tanda)
+            for elem in tanda:
+                yield elem
+        return
+
+    pages = queue.Queue(maxsize=max(lookahead, workers))
+    stop = threading.Event()
+    worker = threading.Thread(target=_prefetch, args=(element, oquery, pagesize, workers, pages, stop))
+    worker.daemon = True
+    worker.start()
+
+    try:
+        while True:
+            kind, value = pages.get()
+            if kind == "end":
+                break
+            if kind == "error":
+                raise value
+            for elem in value:
+                yield elem
+    finally:
+        # Let the prefetching thread finish if the caller stopped iterating
+        stop.set()
 
 
 if __name__ == "__main__":
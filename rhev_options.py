@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+#
+# Author: Pablo Iranzo Gomez (Pablo.Iranzo@gmail.com)
+#
+# Description: Command line options shared by every script talking to the engine
+#
+# Only uses python standard library so nagios checks answered by rhev-nagios-daemon.py can parse their
+# options without loading rhevm-sdk. Scripts importing rhev_functions get these from there
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+
+# FUNCTIONS
+def add_common_options(p):
+    """Adds options for api calls summary, rate limit and cassettes handled by apilogin()
+    @param p: OptionParser of the script
+    """
+    p.add_option("--stats", dest="stats", help="Write api calls summary at exit (stderr, json:file or prom:file)",
+                 metavar="stderr", default=None)
+    p.add_option("--ratelimit", dest="ratelimit", help="Max requests per second to engine for all scripts and share "
+                 "of this one", metavar="rate[:share]", default=None)
+    p.add_option("--cassette", dest="cassette", help="Record requests to engine to a file or replay them from it "
+                 "(record:file, replay:file or replay-fast:file)", metavar="mode:file", default=None)
+
+
+def apioptions(options):
+    """Returns keyword arguments for apilogin() from options added by add_common_options()
+    @param options: options parsed
+    """
+    return {"stats": options.stats, "ratelimit": options.ratelimit, "cassette": options.cassette}
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+#
+# Author: Pablo Iranzo Gomez (Pablo.Iranzo@gmail.com)
+#
+# Description: Runs power actions (pm-suspend, poweroff...) on many hosts at once for rhev-elastic.py
+#
+# Only uses python standard library. Each host gets its own timeout and retries, so an unreachable host doesn't
+# stall the others
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+import optparse
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+SSH_KEY = "/etc/pki/ovirt-engine/keys/engine_id_rsa"
+
+# Master connections are kept open for a while so retries and later runs don't negotiate ssh again
+SSH_CONTROL = os.path.expanduser("~/.cache/rhevm-utils/ssh")
+SSH_PERSIST = 60
+
+# Defaults for every host: seconds per attempt, attempts and seconds before first retry, doubled on each one
+POWER_TIMEOUT = 60
+POWER_ATTEMPTS = 3
+POWER_BACKOFF = 2
+
+
+class SshTransport(object):
+    """Runs power actions as commands on hosts through ssh, sharing one master connection per host"""
+
+    # ssh exits with 255 on its own errors too, these mean the session was already open when it went away
+    DISCONNECTED = ("closed by remote host", "Broken pipe", "server not responding")
+
+    def __init__(self, key=SSH_KEY, user="root", ssh="/usr/bin/ssh", control=SSH_CONTROL, persist=SSH_PERSIST,
+                 connecttimeout=10):
+        """
+        @param key: private key to login with
+        @param user: user to login as
+        @param ssh: ssh client binary
+        @param control: directory for master connection sockets, None to not share connections
+        @param persist: seconds master connections are kept open after last use
+        @param connecttimeout: seconds to wait for connection to host
+        """
+        self.key = key
+        self.user = user
+        self.ssh = ssh
+        self.control = control
+        self.persist = persist
+        self.connecttimeout = connecttimeout
+
+    def argv(self, address, action):
+        """Returns command line running action on host
+        @param address: host address
+        @param action: command to run on host
+        """
+        argv = [self.ssh, "-o", "StrictHostKeyChecking=no", "-o", "ServerAliveInterval=10", "-o", "BatchMode=yes",
+                "-o", "ConnectTimeout=%s" % self.connecttimeout, "-i", self.key]
+        if self.control:
+            if not os.path.isdir(self.control):
+                try:
+                    os.makedirs(self.control, 0o700)
+                except OSError:
+                    pass
+            argv += ["-o", "ControlMaster=auto", "-o", "ControlPath=%s/%%r@%%h:%%p" % self.control,
+                     "-o", "ControlPersist=%s" % self.persist]
+        return argv + ["%s@%s" % (self.user, address), action]
+
+    def sent(self, status, output):
+        """Returns whether a failed action reached the host anyway: poweroff or pm-suspend drop the connection
+        while the command is still running
+        @param status: exit status of command, None if killed after timeout
+        @param output: output of command
+        """
+        return status == 255 and any([message in output for message in self.DISCONNECTED])
+
+
+class CommandTransport(object):
+    """Runs power actions with a local command getting host address and action as last arguments, for testing
+    against a stand-in or using other tools (ipmitool wrappers...)"""
+
+    def __init__(self, command):
+        """
+        @param command: command line, split like a shell does
+        """
+        self.command = shlex.split(command)
+
+    def argv(self, address, action):
+        """Returns command line running action on host
+        @param address: host address
+        @param action: power action
+        """
+        return self.command + [address, action]
+
+    def sent(self, status, output):
+        """Returns whether a failed action reached the host anyway, never known for local commands
+        @param status: exit status of command, None if killed after timeout
+        @param output: output of command
+        """
+        return False
+
+
+def runcommand(argv, timeout):
+    """Runs command and returns (exit status, output), exit status is None if killed after timeout
+    @param argv: command line
+    @param timeout: seconds before killing command
+    """
+    # Output goes to a file instead of a pipe: ssh master connections going to background keep pipes open
+    with open(os.devnull) as devnull, tempfile.TemporaryFile() as output:
+        try:
+            child = subprocess.Popen(argv, stdin=devnull, stdout=output, stderr=subprocess.STDOUT, close_fds=True)
+        except OSError as e:
+            return 127, str(e)
+        expired = []
+
+        def kill():
+            expired.append(True)
+            try:
+                child.kill()
+            except OSError:
+                pass
+
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        try:
+            status = child.wait()
+        finally:
+            timer.cancel()
+        output.seek(0)
+        text = output.read().decode("utf-8", "replace").strip()
+    return None if expired else status, text
+
+
+class PowerExecutor(object):
+    """Runs power actions on many hosts concurrently, with timeout and retries with backoff for each host"""
+
+    def __init__(self, transport, concurrency=8, timeout=POWER_TIMEOUT, attempts=POWER_ATTEMPTS,
+                 backoff=POWER_BACKOFF):
+        """
+        @param transport: object returning command line for host address and action with argv() and telling
+                          with sent() whether a failed one reached the host
+        @param concurrency: hosts processed at the same time
+        @param timeout: seconds for each attempt before killing it
+        @param attempts: times to run action on a host before giving up
+        @param backoff: seconds before first retry, doubled on each one
+        """
+        self.transport = transport
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.attempts = attempts
+        self.backoff = backoff
+
+    def run(self, target):
+        """Runs action on one host until it succeeds, gets to the host or attempts are exhausted and returns its result
+        @param target: (name, address, action)
+        """
+        name, address, action = target
+        start = time.time()
+        delay = self.backoff
+        attempt = 0
+        while True:
+            attempt += 1
+            status, output = runcommand(self.transport.argv(address, action), self.timeout)
+            # Running the action again on a host already powering off would only fail until attempts run out
+            sent = status != 0 and self.transport.sent(status, output)
+            if status == 0 or sent or attempt >= self.attempts:
+                break
+            time.sleep(delay)
+            delay *= 2
+
+        if status == 0:
+            result = "ok"
+        elif sent:
+            result = "sent"
+        elif status is None:
+            result = "timeout"
+        else:
+            result = "failed"
+        return {"name": name, "address": address, "action": action, "result": result, "status": status,
+                "attempts": attempt, "elapsed": round(time.time() - start, 3), "output": output}
+
+    def execute(self, targets):
+        """Runs actions on all hosts and returns list of results in the same order
+        @param targets: list of (name, address, action)
+        """
+        if not targets:
+            return []
+        pool = ThreadPool(min(len(targets), max(1, self.concurrency)))
+        try:
+            return pool.map(self.run, targets)
+        finally:
+            pool.close()
+
+
+def report(results):
+    """Returns one line describing each result
+    @param results: list of results returned by PowerExecutor.execute()
+    """
+    lines = []
+    for result in results:
+        line = "Power action %s on %s (%s): %s after %s attempt(s) in %.1fs" % (
+            result["action"], result["name"], result["address"], result["result"], result["attempts"],
+            result["elapsed"])
+        if result["result"] != "ok" and result["output"]:
+            line += ": %s" % result["output"].splitlines()[-1]
+        lines.append(line)
+    return lines
+
+
+# MAIN PROGRAM
+if __name__ == "__main__":
+    p = optparse.OptionParser("rhev_power.py [arguments] address [address...]",
+                              description="Runs a power action on several hosts at once")
+    p.add_option("-a", "--action", dest="action", help="Power action to execute", metavar="action",
+                 default="pm-suspend")
+    p.add_option("-c", "--command", dest="command", help="Local command getting address and action as arguments "
+                 "instead of ssh", metavar="command", default=None)
+    p.add_option("-i", "--key", dest="key", help="Private key for ssh", metavar=SSH_KEY, default=SSH_KEY)
+    p.add_option("--concurrency", dest="concurrency", help="Hosts processed at the same time", metavar="8",
+                 default=8, type='int')
+    p.add_option("--timeout", dest="timeout", help="Seconds for each attempt", metavar=str(POWER_TIMEOUT),
+                 default=POWER_TIMEOUT, type='int')
+    p.add_option("--attempts", dest="attempts", help="Attempts for each host", metavar=str(POWER_ATTEMPTS),
+                 default=POWER_ATTEMPTS, type='int')
+
+    (options, args) = p.parse_args()
+    if not args:
+        p.error("No host address")
+
+    if options.command:
+        transport = CommandTransport(options.command)
+    else:
+        transport = SshTransport(key=options.key)
+    executor = PowerExecutor(transport, options.concurrency, options.timeout, options.attempts)
+    results = executor.execute([(address, address, options.action) for address in args])
+    for line in report(results):
+        print(line)
+    sys.exit(0 if all([result["result"] in ("ok", "sent") for result in results]) else 1)
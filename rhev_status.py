@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# Author: Pablo Iranzo Gomez (Pablo.Iranzo@gmail.com)
+#
+# Description: Client and server for the status snapshot kept by monitoring/rhev-nagios-daemon.py
+#
+# Only uses python standard library so checks using it start fast, without loading rhevm-sdk
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+import grp
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+# Dedicated directory, so checks run by the nagios group can reach the socket
+STATUS_DIR = "/var/run/rhevm-utils"
+STATUS_SOCKET = os.path.join(STATUS_DIR, "nagios.sock")
+
+# Seconds after which a snapshot is considered too old to be used by checks
+STATUS_MAXAGE = 300
+
+# Seconds to wait for the daemon to answer
+STATUS_TIMEOUT = 5
+
+
+# FUNCTIONS
+def query(path, kind, name, maxage=STATUS_MAXAGE):
+    """Returns values of an object from status daemon snapshot, None if it's not there
+    @param path: unix socket the daemon listens on
+    @param kind: type of object (hosts or storagedomains)
+    @param name: name of the object
+    @param maxage: max age in seconds of snapshot to accept
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(STATUS_TIMEOUT)
+    try:
+        client.connect(path)
+        client.sendall(("%s %s\n" % (kind, name)).encode("utf-8"))
+        reply = b""
+        while not reply.endswith(b"\n"):
+            data = client.recv(4096)
+            if not data:
+                break
+            reply += data
+    except socket.error as e:
+        raise IOError("Status daemon not available at %s: %s" % (path, e))
+    finally:
+        client.close()
+
+    try:
+        reply = json.loads(reply.decode("utf-8"))
+    except ValueError:
+        raise IOError("Invalid answer from status daemon at %s" % path)
+    if reply["age"] is None:
+        raise IOError("Status daemon at %s has no snapshot yet" % path)
+    if reply["age"] > maxage:
+        raise IOError("Status daemon snapshot is %d seconds old" % reply["age"])
+    return reply["value"]
+
+
+def lookup(path, kind, name, maxage=STATUS_MAXAGE):
+    """Returns values like query() for nagios checks, exiting with unknown status if daemon fails
+    @param path: unix socket the daemon listens on
+    @param kind: type of object (hosts or storagedomains)
+    @param name: name of the object
+    @param maxage: max age in seconds of snapshot to accept
+    """
+    try:
+        return query(path, kind, name, maxage)
+    except IOError as e:
+        print(e)
+        sys.exit(3)
+
+
+class Snapshot(object):
+    """Latest status values, replaced as a whole on each refresh"""
+
+    def __init__(self):
+        self.values = None
+        self.stamp = None
+
+    def update(self, values):
+        """Stores new values
+        @param values: dictionary of kind -> {name: values}
+        """
+        self.values, self.stamp = values, time.time()
+
+    def get(self, kind, name):
+        """Returns (age in seconds, values of object) from latest snapshot
+        @param kind: type of object (hosts or storagedomains)
+        @param name: name of the object
+        """
+        values, stamp = self.values, self.stamp
+        if values is None:
+            return None, None
+        return time.time() - stamp, values.get(kind, {}).get(name)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline().decode("utf-8").strip()
+        kind, _, name = line.partition(" ")
+        age, value = self.server.snapshot.get(kind, name)
+        self.wfile.write((json.dumps({"age": age, "value": value}) + "\n").encode("utf-8"))
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path, snapshot, group=None):
+    """Answers queries on unix socket with values from snapshot in a background thread and returns the server
+    @param path: unix socket to listen on, replaced if it exists
+    @param snapshot: Snapshot to answer from
+    @param group: group allowed to query, group of the daemon if None
+    """
+    gid = grp.getgrnam(group).gr_gid if group else -1
+    directory = os.path.dirname(path)
+    created = False
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+        created = True
+    if created or directory == STATUS_DIR:
+        # Set explicitly as umask applies to makedirs, and the directory may come from an older run
+        os.chmod(directory, 0o750)
+        if group:
+            os.chown(directory, -1, gid)
+    if os.path.exists(path):
+        os.unlink(path)
+
+    server = _Server(path, _Handler)
+    server.snapshot = snapshot
+    # Checks are usually run by another user in the same group (nagios)
+    os.chmod(path, 0o660)
+    if group:
+        os.chown(path, -1, gid)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
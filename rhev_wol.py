@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+#
+# Author: Pablo Iranzo Gomez (Pablo.Iranzo@gmail.com)
+#
+# Description: Wake-on-LAN sender used to power on hosts left in maintenance by rhev-elastic.py
+#
+# Only uses python standard library, packets are built once and sent for all hosts in a single pass instead of
+# running ether-wake for every MAC and interface
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+import binascii
+import errno
+import optparse
+import os
+import socket
+import struct
+import sys
+
+NET_PATH = "/sys/class/net"
+
+# Ethertype used by ether-wake for raw frames and port for UDP ones
+ETH_P_WOL = 0x0842
+WOL_PORT = 9
+WOL_ADDRESS = "255.255.255.255"
+
+# Not exported by python 2 socket module
+SO_BINDTODEVICE = getattr(socket, "SO_BINDTODEVICE", 25)
+
+BROADCAST = b"\xff" * 6
+
+
+# FUNCTIONS
+def macbytes(mac):
+    """Returns MAC address as 6 bytes
+    @param mac: MAC address as 00:1a:4a:00:00:01, 00-1a-4a-00-00-01 or 001a4a000001
+    """
+    digits = mac.strip().replace(":", "").replace("-", "")
+    if len(digits) != 12:
+        raise ValueError("Invalid MAC address %s" % mac)
+    try:
+        return binascii.unhexlify(digits)
+    except (TypeError, binascii.Error):
+        raise ValueError("Invalid MAC address %s" % mac)
+
+
+def magicpacket(mac):
+    """Returns Wake-on-LAN payload for MAC address: 6 bytes 0xff followed by MAC repeated 16 times
+    @param mac: MAC address to wake up
+    """
+    return BROADCAST + macbytes(mac) * 16
+
+
+def interfaces(path=NET_PATH):
+    """Returns names of local network interfaces that are up, loopback excluded
+    @param path: sysfs directory with network interfaces
+    """
+    names = []
+    for name in sorted(os.listdir(path)):
+        if name == "lo":
+            continue
+        try:
+            with open(os.path.join(path, name, "operstate")) as f:
+                state = f.read().strip()
+        except IOError:
+            continue
+        # Some virtual interfaces never report state but carry traffic
+        if state in ("up", "unknown"):
+            names.append(name)
+    return names
+
+
+def _hwaddress(interface, path=NET_PATH):
+    """Returns MAC address of local interface as bytes, zeros if unknown
+    @param interface: name of local interface
+    @param path: sysfs directory with network interfaces
+    """
+    try:
+        with open(os.path.join(path, interface, "address")) as f:
+            return macbytes(f.read())
+    except (IOError, ValueError):
+        return b"\x00" * 6
+
+
+def _sendraw(interface, packets):
+    """Sends payloads as ethernet broadcast frames with ethertype 0x0842 like ether-wake, needs CAP_NET_RAW
+    @param interface: name of local interface
+    @param packets: list of payloads
+    """
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+    try:
+        sock.bind((interface, ETH_P_WOL))
+        header = BROADCAST + _hwaddress(interface) + struct.pack("!H", ETH_P_WOL)
+        for packet in packets:
+            sock.send(header + packet)
+    finally:
+        sock.close()
+
+
+def _sendudp(interface, packets, address, port):
+    """Sends payloads as UDP datagrams, through interface if allowed
+    @param interface: name of local interface or None to let routing choose
+    @param packets: list of payloads
+    @param address: destination address, usually broadcast
+    @param port: destination port
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        if interface:
+            sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, interface.encode("ascii") + b"\0")
+        for packet in packets:
+            sock.sendto(packet, (address, port))
+    finally:
+        sock.close()
+
+
+def wake(macs, devices=None, mode="auto", address=WOL_ADDRESS, port=WOL_PORT):
+    """Sends Wake-on-LAN packets for all MAC addresses through every interface in one pass and returns number of
+    packets sent. Raises IOError if no interface could send them
+    @param macs: MAC addresses to wake up, duplicates are sent once
+    @param devices: names of local interfaces to use, all interfaces up if None
+    @param mode: raw for ethernet frames, udp for datagrams to address:port, auto for raw falling back to udp
+    @param address: destination of udp datagrams
+    @param port: destination port of udp datagrams
+    """
+    if mode not in ("auto", "raw", "udp"):
+        raise ValueError("Invalid Wake-on-LAN mode %s" % mode)
+
+    packets = []
+    for mac in macs:
+        packet = magicpacket(mac)
+        if packet not in packets:
+            packets.append(packet)
+    if not packets:
+        return 0
+
+    if devices is None:
+        devices = interfaces()
+    if not devices:
+        # No interface to choose from, let routing pick one for the datagrams
+        devices = [None]
+        if mode == "raw":
+            raise IOError("No network interface up to send Wake-on-LAN packets")
+        mode = "udp"
+
+    sent = 0
+    failures = []
+    unbound = False
+    for device in devices:
+        try:
+            try:
+                if mode == "raw" or (mode == "auto" and hasattr(socket, "AF_PACKET")):
+                    _sendraw(device, packets)
+                else:
+                    _sendudp(device, packets, address, port)
+            except socket.error as e:
+                if mode == "raw" or e.errno not in (errno.EPERM, errno.EACCES):
+                    raise
+                # Not running as root, datagrams can't be tied to an interface so they are sent just once
+                if unbound:
+                    continue
+                _sendudp(None, packets, address, port)
+                unbound = True
+            sent += len(packets)
+        except (IOError, OSError) as e:
+            failures.append("%s: %s" % (device, e))
+
+    if failures and not sent:
+        raise IOError("Error sending Wake-on-LAN packets (%s)" % ", ".join(failures))
+    return sent
+
+
+# MAIN PROGRAM
+if __name__ == "__main__":
+    p = optparse.OptionParser("rhev_wol.py [arguments] mac [mac...]",
+                              description="Sends Wake-on-LAN packets to MAC addresses through local interfaces")
+    p.add_option("-i", "--interfaces", dest="interfaces", help="Interfaces to send packets from, all up by default",
+                 metavar="eth0,eth1", default=None)
+    p.add_option("-m", "--mode", dest="mode", help="Send raw ethernet frames, udp datagrams or auto", metavar="auto",
+                 default="auto")
+    p.add_option("-a", "--address", dest="address", help="Destination address of udp datagrams",
+                 metavar=WOL_ADDRESS, default=WOL_ADDRESS)
+    p.add_option("-p", "--port", dest="port", help="Destination port of udp datagrams", metavar=str(WOL_PORT),
+                 default=WOL_PORT, type='int')
+
+    (options, args) = p.parse_args()
+    if not args:
+        p.error("No MAC address to wake up")
+
+    devices = options.interfaces.split(",") if options.interfaces else None
+    try:
+        count = wake(args, devices, options.mode, options.address, options.port)
+    except (IOError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+    print("Sent %s packets" % count)
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+#
+# Author: Pablo Iranzo Gomez (Pablo.Iranzo@gmail.com)
+#
+# Description: Single entry point running other scripts as subcommands, several of them in one process
+#
+# Requires rhevm-sdk to work
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+# Only standard library modules are imported here, sdk and scripts are loaded when a task runs
+
+import atexit
+import glob
+import multiprocessing
+import os
+import runpy
+import shlex
+import signal
+import sys
+import threading
+import time
+import traceback
+
+try:
+    import ConfigParser as configparser
+except ImportError:
+    import configparser
+
+description = """
+rhevm-utils runs the other scripts as subcommands (elastic for rhev-elastic.py, nagios-table for
+monitoring/rhev-nagios-table.py...). Several tasks separated by '+' run one after the other in the
+same process reusing the api session and what previous ones read (listings, hosts, vms, clusters and tags
+with the same expiration as --cache), arguments before the first task are passed to all of them:
+
+rhevm-utils.py -w redhat --cache=/var/cache/rhevm-utils/inventory.sqlite cleanpinning + policy --policy=power_saving + elastic -t1
+
+With --daemon, it keeps running the jobs defined in a schedule file on their intervals and hours
+(see doc/sample-rhevm-utils-schedule.conf), replacing cron entries:
+
+rhevm-utils.py --daemon /etc/rhevm-utils/schedule.conf
+
+With --engines, the tasks run against every engine listed in the file (see doc/sample-rhevm-utils-engines.conf)
+at the same time, one process per engine, with output lines prefixed by engine name. Nagios table written by
+nagios-table gets the rows of all engines, with their name as last column:
+
+rhevm-utils.py --engines /etc/rhevm-utils/engines.conf elastic -t1 + nagios-table -t /var/tmp/rhev.csv
+"""
+
+TASK_SEPARATOR = "+"
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# FUNCTIONS
+def subcommands():
+    """Returns dictionary of subcommand name -> script path"""
+    commands = {}
+    for pattern in ("rhev-*.py", os.path.join("monitoring", "rhev-*.py")):
+        for path in glob.glob(os.path.join(BASEDIR, pattern)):
+            commands[os.path.basename(path)[len("rhev-"):-len(".py")]] = path
+    return commands
+
+
+def parsetasks(args, commands):
+    """Returns list of (subcommand, arguments) to run
+    @param args: command line arguments: common arguments, subcommand, its arguments, '+', subcommand...
+    @param commands: dictionary of known subcommands
+    """
+    common = []
+    tasks = []
+    for arg in args:
+        if not tasks:
+            if arg in commands:
+                tasks.append((arg, []))
+            else:
+                common.append(arg)
+        elif arg == TASK_SEPARATOR:
+            tasks.append((None, []))
+        elif tasks[-1][0] is None:
+            if arg not in commands:
+                raise ValueError("Unknown subcommand %s" % arg)
+            tasks[-1] = (arg, [])
+        else:
+            tasks[-1][1].append(arg)
+
+    if not tasks or tasks[-1][0] is None:
+        raise ValueError("Missing subcommand")
+    return [(command, common + arguments) for command, arguments in tasks]
+
+
+def runtask(path, arguments):
+    """Runs script as if invoked from command line and returns its exit status
+    @param path: script to run
+    @param arguments: command line arguments for script
+    """
+    # Scripts run one after the other in this process reuse what previous ones read from the engine
+    import rhev_functions
+    rhev_functions.SHARED_RUNS = True
+
+    argv = sys.argv
+    sys.argv = [path] + arguments
+    try:
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code)
+        return 1
+    finally:
+        sys.argv = argv
+    return 0
+
+
+def runtasks(tasks, commands):
+    """Runs tasks one after the other and returns exit status of first one failing, 0 if none did
+    @param tasks: list of (subcommand, arguments)
+    @param commands: dictionary of known subcommands
+    """
+    status = 0
+    for command, arguments in tasks:
+        result = runtask(commands[command], arguments)
+        if result and not status:
+            status = result
+    return status
+
+
+def loadengines(path):
+    """Returns list of engines defined in engines file, one per section, as dictionaries with name and arguments
+    @param path: engines file
+    """
+    config = configparser.RawConfigParser({"port": "443", "user": "", "password": "", "args": ""})
+    if not config.read(path):
+        raise ValueError("Can't read engines file %s" % path)
+
+    engines = []
+    for section in config.sections():
+        arguments = ["-s", config.get(section, "server"), "-p", config.get(section, "port")]
+        if config.get(section, "user"):
+            arguments.extend(["-u", config.get(section, "user")])
+        if config.get(section, "password"):
+            arguments.extend(["-w", config.get(section, "password")])
+        engines.append({"name": section, "args": arguments + shlex.split(config.get(section, "args"))})
+    if not engines:
+        raise ValueError("No engines defined in %s" % path)
+    return engines
+
+
+def _tableargument(arguments):
+    """Returns (position, path) of the table argument (-t/--table) of nagios-table, or (None, None)
+    @param arguments: command line arguments of the task
+    """
+    for position, arg in enumerate(arguments):
+        if arg in ("-t", "--table") and position + 1 < len(arguments):
+            return position + 1, arguments[position + 1]
+        if arg.startswith("--table="):
+            return position, arg[len("--table="):]
+    return None, None
+
+
+def _retable(tasks, engine):
+    """Returns tasks with nagios-table writing to a table of its own for engine, and list of (table, engine table)
+    @param tasks: list of (subcommand, arguments)
+    @param engine: engine name
+    """
+    result = []
+    tables = []
+    for command, arguments in tasks:
+        position, table = _tableargument(arguments) if command == "nagios-table" else (None, None)
+        if table:
+            arguments = list(arguments)
+            arguments[position] = arguments[position].replace(table, "%s.%s" % (table, engine))
+            tables.append((table, "%s.%s" % (table, engine)))
+        result.append((command, arguments))
+    return result, tables
+
+
+def mergetables(table, parts):
+    """Writes nagios table with rows of the tables of each engine, adding engine name as last column
+    @param table: table to write, replaced at once so checks never read it half written
+    @param parts: list of (engine, table written for engine)
+    """
+    hosts = []
+    sds = []
+    for engine, path in parts:
+        try:
+            with open(path) as f:
+                for line in f:
+                    kind = line.split(";")[0]
+                    row = "%s;%s;\n" % (line.rstrip("\n").rstrip(";"), engine)
+                    if kind == "host":
+                        hosts.append(row)
+                    elif kind == "SD":
+                        sds.append(row)
+            os.unlink(path)
+        except (IOError, OSError):
+            # Engine failed before writing its table, checks will report its hosts as unknown
+            pass
+
+    temporary = "%s.tmp" % table
+    with open(temporary, "w") as f:
+        f.write("TYPE;HOST;STATE;CPU;MEM;VMS;MEMUSED;ENGINE;\n")
+        f.writelines(hosts)
+        f.write("TYPE;SD;PCTG;ENGINE;\n")
+        f.writelines(sds)
+    os.rename(temporary, table)
+
+
+def _engineworker(tasks, commands, output, unused):
+    """Runs tasks in a worker process with its output sent to a pipe
+    @param tasks: list of (subcommand, arguments) with engine arguments
+    @param commands: dictionary of known subcommands
+    @param output: write end of the pipe, used as stdout and stderr also for commands run by scripts
+    @param unused: read end of the pipe, inherited from parent
+    """
+    os.close(unused)
+    # Handlers of the daemon, if running from it, would keep the worker from stopping
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    os.dup2(output, 1)
+    os.dup2(output, 2)
+    os.close(output)
+    try:
+        status = runtasks(tasks, commands)
+    finally:
+        # Worker processes end without running exit handlers, like the ones writing stats or cassettes
+        atexit._run_exitfuncs()
+    sys.exit(status)
+
+
+def _relay(name, pipe, lock):
+    """Prints lines read from pipe prefixed with engine name until it's closed
+    @param name: engine name
+    @param pipe: read end of the pipe
+    @param lock: lock held while printing, so lines of different engines don't mix
+    """
+    with os.fdopen(pipe) as f:
+        for line in iter(f.readline, ""):
+            with lock:
+                sys.stdout.write("[%s] %s" % (name, line))
+                sys.stdout.flush()
+
+
+def fanout(engines, tasks, commands):
+    """Runs tasks against every engine at once, each one in its own process, and returns exit status of first
+    engine failing, 0 if none did
+    @param engines: list of engines as returned by loadengines()
+    @param tasks: list of (subcommand, arguments)
+    @param commands: dictionary of known subcommands
+    """
+    lock = threading.Lock()
+    workers = []
+    tables = {}
+    sys.stdout.flush()
+    for engine in engines:
+        enginetasks, enginetables = _retable(tasks, engine["name"])
+        for table, part in enginetables:
+            tables.setdefault(table, []).append((engine["name"], part))
+        # Engine arguments last, so they win over common ones
+        enginetasks = [(command, arguments + engine["args"]) for command, arguments in enginetasks]
+
+        pipe, output = os.pipe()
+        process = multiprocessing.Process(target=_engineworker, args=(enginetasks, commands, output, pipe))
+        process.start()
+        os.close(output)
+        relay = threading.Thread(target=_relay, args=(engine["name"], pipe, lock))
+        relay.start()
+        workers.append((engine["name"], process, relay))
+
+    status = 0
+    for name, process, relay in workers:
+        process.join()
+        relay.join()
+        if process.exitcode:
+            print("[%s] exited with status %s" % (name, process.exitcode))
+            if not status:
+                status = process.exitcode
+
+    for table, parts in tables.items():
+        mergetables(table, parts)
+    return status
+
+
+def parsehours(hours):
+    """Returns set of hours of day from a cron like list of hours and ranges (like 20-23,0-8)
+    @param hours: list of hours, all of them if empty
+    """
+    if not hours.strip():
+        return set(range(24))
+    result = set()
+    for item in hours.split(","):
+        start, _, end = item.strip().partition("-")
+        result.update(range(int(start), int(end or start) + 1))
+    return result
+
+
+def loadjobs(path, commands):
+    """Returns list of jobs defined in schedule file, one per section
+    @param path: schedule file
+    @param commands: dictionary of known subcommands
+    """
+    config = configparser.RawConfigParser({"common": "", "args": "", "interval": "30", "hours": "", "engines": ""})
+    if not config.read(path):
+        raise ValueError("Can't read schedule file %s" % path)
+
+    jobs = []
+    for section in config.sections():
+        command = config.get(section, "command")
+        if command not in commands:
+            raise ValueError("Unknown subcommand %s for job %s" % (command, section))
+        jobs.append({"name": section, "command": command,
+                     "args": shlex.split(config.get(section, "common")) + shlex.split(config.get(section, "args")),
+                     "interval": config.getfloat(section, "interval") * 60,
+                     "hours": parsehours(config.get(section, "hours")), "next": 0,
+                     "engines": loadengines(config.get(section, "engines")) if config.get(section, "engines") else None})
+    return jobs
+
+
+def daemon(path, commands):
+    """Runs jobs from schedule file forever, one at a time, until SIGTERM or SIGINT
+    @param path: schedule file
+    @param commands: dictionary of known subcommands
+    """
+    jobs = loadjobs(path, commands)
+    stop = []
+
+    def terminate(signum, frame):
+        stop.append(signum)
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+
+    while not stop:
+        for job in jobs:
+            now = time.time()
+            if stop or now < job["next"]:
+                continue
+            job["next"] = now + job["interval"]
+            if time.localtime(now).tm_hour not in job["hours"]:
+                continue
+            try:
+                if job["engines"]:
+                    result = fanout(job["engines"], [(job["command"], job["args"])], commands)
+                else:
+                    result = runtask(commands[job["command"]], job["args"])
+            except Exception:
+                # Keep running other jobs and this one on next interval
+                traceback.print_exc()
+                result = 1
+            if result:
+                print("%s job %s exited with status %s" % (time.strftime("%Y-%m-%d %H:%M:%S"), job["name"],
+                                                           result))
+            sys.stdout.flush()
+
+        # Wake up when next job is due, checking for signals at least every second
+        wait = min([job["next"] for job in jobs]) - time.time()
+        while not stop and wait > 0:
+            time.sleep(min(wait, 1))
+            wait -= 1
+
+
+def usage(commands):
+    """Prints usage and available subcommands
+    @param commands: dictionary of known subcommands
+    """
+    print("Usage: rhevm-utils.py [common arguments] subcommand [arguments] [+ subcommand [arguments]...]")
+    print("       rhevm-utils.py --daemon schedule-file")
+    print("       rhevm-utils.py --engines engines-file [common arguments] subcommand [arguments] [+ ...]")
+    print(description)
+    print("Subcommands:")
+    for command in sorted(commands):
+        print("    %s" % command)
+
+
+# MAIN PROGRAM
+if __name__ == "__main__":
+    # Scripts import rhev_functions from here
+    if BASEDIR not in sys.path:
+        sys.path.insert(0, BASEDIR)
+
+    commands = subcommands()
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        usage(commands)
+        sys.exit(0)
+
+    if sys.argv[1] == "--daemon":
+        if len(sys.argv) != 3:
+            usage(commands)
+            sys.exit(2)
+        try:
+            daemon(sys.argv[2], commands)
+        except (ValueError, configparser.Error) as e:
+            print(e)
+            sys.exit(2)
+        sys.exit(0)
+
+    engines = None
+    args = sys.argv[1:]
+    try:
+        if args[0] == "--engines":
+            if len(args) < 3:
+                usage(commands)
+                sys.exit(2)
+            engines = loadengines(args[1])
+            args = args[2:]
+        tasks = parsetasks(args, commands)
+    except (ValueError, configparser.Error) as e:
+        print(e)
+        usage(commands)
+        sys.exit(2)
+
+    if engines:
+        sys.exit(fanout(engines, tasks, commands))
+    sys.exit(runtasks(tasks, commands))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+#
+# Author: Pablo Iranzo Gomez (Pablo.Iranzo@gmail.com)
+#
+# Description: Tests for functions in rhev_functions not needing an engine
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import rhev_functions
+
+
+class ConsolidationPlanTest(unittest.TestCase):
+    FREE = {"h1": 8, "h2": 4, "h3": 6}
+    VMS = {"h1": [("v1", 1)], "h2": [("v2", 3), ("v3", 1)], "h3": [("v4", 5)]}
+
+    def test_least_loaded_first(self):
+        emptied, moves = rhev_functions.consolidation_plan(self.FREE, self.VMS, ["h3", "h2", "h1"])
+        self.assertEqual(emptied, ["h1"])
+        # Goes to the host with least free memory it fits in
+        self.assertEqual(moves, [("v1", "h2")])
+
+    def test_receiving_not_emptied(self):
+        # h2 receives v1 and h3's VM doesn't fit anywhere else
+        emptied, moves = rhev_functions.consolidation_plan(self.FREE, self.VMS, ["h1", "h2", "h3"], limit=3)
+        self.assertEqual(emptied, ["h1"])
+        self.assertEqual(moves, [("v1", "h2")])
+
+    def test_biggest_first(self):
+        free = {"h1": 0, "h2": 3, "h3": 5}
+        vms = {"h1": [("small", 2), ("big", 3)]}
+        emptied, moves = rhev_functions.consolidation_plan(free, vms, ["h1"])
+        self.assertEqual(emptied, ["h1"])
+        self.assertEqual(moves, [("big", "h2"), ("small", "h3")])
+
+    def test_not_fitting(self):
+        free = {"h1": 1, "h2": 2}
+        vms = {"h1": [("v1", 3)], "h2": [("v2", 2)]}
+        self.assertEqual(rhev_functions.consolidation_plan(free, vms, ["h1", "h2"], limit=2), ([], []))
+
+    def test_keep(self):
+        self.assertEqual(rhev_functions.consolidation_plan(self.FREE, self.VMS, ["h1"], keep=3), ([], []))
+        free = {"h1": 8, "h2": 8}
+        vms = {"h1": [("v1", 1)], "h2": [("v2", 1)]}
+        emptied, moves = rhev_functions.consolidation_plan(free, vms, ["h1", "h2"], limit=2, keep=1)
+        self.assertEqual(len(emptied), 1)
+        self.assertEqual(len(moves), 1)
+
+    def test_only_candidates(self):
+        # Hosts with VM's that can't be migrated are left out of candidates but still receive
+        emptied, moves = rhev_functions.consolidation_plan(self.FREE, self.VMS, ["h2"])
+        self.assertEqual(emptied, ["h2"])
+        self.assertEqual(sorted(moves), [("v2", "h3"), ("v3", "h3")])
+
+
+class HostRankTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "hosts.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cost_unknown(self):
+        # No history, unknown boot time, capacity and power count as half
+        self.assertAlmostEqual(rhev_functions.hostcost(None, None, None, True), 1.0)
+        self.assertAlmostEqual(rhev_functions.hostcost({}, None, None, False), 1.0)
+
+    def test_cost_history(self):
+        now = time.time()
+        old = {"events": [[now - rhev_functions.HOST_HISTORY - 1, "up"]]}
+        recent = {"events": [[now - 60, "up"], [now - 30, "down"]]}
+        busy = {"events": [[now - i, "up"] for i in range(10)]}
+        self.assertAlmostEqual(rhev_functions.hostcost(old, 1, 1, True, now=now), 1.0)
+        self.assertAlmostEqual(rhev_functions.hostcost(recent, 1, 1, True, now=now), 1.5)
+        self.assertAlmostEqual(rhev_functions.hostcost(busy, 1, 1, True, now=now), 2.0)
+
+    def test_cost_boots(self):
+        quick = {"boots": [rhev_functions.BOOT_REFERENCE / 10.0]}
+        slow = {"boots": [rhev_functions.BOOT_REFERENCE * 2]}
+        self.assertAlmostEqual(rhev_functions.hostcost(quick, 1, 0, True), 0.1)
+        self.assertAlmostEqual(rhev_functions.hostcost(slow, 1, 0, True), 1.0)
+
+    def test_cost_capacity_power(self):
+        big = rhev_functions.hostcost(None, 1, 1, True, powerweight=0)
+        small = rhev_functions.hostcost(None, 0.5, 0.25, True, powerweight=0)
+        self.assertTrue(big < small)
+        # Hungry hosts are the ones to power off when power matters
+        hungry = rhev_functions.hostcost(None, 1, 1, False, powerweight=1)
+        frugal = rhev_functions.hostcost(None, 1, 0.25, False, powerweight=1)
+        self.assertTrue(hungry < frugal)
+        # And the ones to power on
+        hungry = rhev_functions.hostcost(None, 1, 1, True, powerweight=1)
+        frugal = rhev_functions.hostcost(None, 1, 0.25, True, powerweight=1)
+        self.assertTrue(frugal < hungry)
+
+    def test_rank_memory(self):
+        memory = {"big": 64, "small": 16}
+        self.assertEqual(rhev_functions.rankhosts(["small", "big"], memory, path=self.path), ["big", "small"])
+        self.assertEqual(rhev_functions.rankhosts(["big", "small"], memory, activating=False, path=self.path),
+                         ["small", "big"])
+        self.assertEqual(rhev_functions.rankhosts([], memory, path=self.path), [])
+
+    def test_rank_cpus(self):
+        memory = {"hungry": 64, "frugal": 64}
+        cpus = {"hungry": 32, "frugal": 8}
+        self.assertEqual(rhev_functions.rankhosts(["hungry", "frugal"], memory, powerweight=1, path=self.path,
+                                                  cpus=cpus), ["frugal", "hungry"])
+        self.assertEqual(rhev_functions.rankhosts(["frugal", "hungry"], memory, activating=False, powerweight=1,
+                                                  path=self.path, cpus=cpus), ["hungry", "frugal"])
+
+    def test_rank_history(self):
+        for event in ("up", "down", "up", "down"):
+            rhev_functions.hostevent("flapping", event, "engine", self.path)
+        memory = {"flapping": 64, "steady": 64}
+        self.assertEqual(rhev_functions.rankhosts(["flapping", "steady"], memory, "engine", path=self.path),
+                         ["steady", "flapping"])
+        # Other engines' history doesn't count
+        self.assertEqual(rhev_functions.rankhosts(["flapping", "steady"], {"flapping": 64, "steady": 32},
+                                                  "other", path=self.path), ["flapping", "steady"])
+
+    def test_boot_recorded(self):
+        rhev_functions.hostevent("host1", "up", "engine", self.path)
+        rhev_functions.hostsup(["host1", "host2"], "engine", self.path)
+        with open(self.path) as f:
+            entries = json.load(f)["engine"]
+        self.assertEqual(len(entries["host1"]["boots"]), 1)
+        self.assertFalse("activated" in entries["host1"])
+        self.assertFalse("host2" in entries)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# Author: Pablo Iranzo Gomez (Pablo.Iranzo@gmail.com)
+#
+# Description: Tests for power actions executor, using local stand-in commands instead of ssh
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rhev_power
+
+
+def standin(script):
+    """Returns transport running shell script with host address as $1 and action as $2
+    @param script: shell commands
+    """
+    return rhev_power.CommandTransport("sh -c '%s' standin" % script)
+
+
+class DroppedTransport(rhev_power.CommandTransport):
+    """Stand-in telling like ssh that exit status 255 means the host got the action"""
+
+    def sent(self, status, output):
+        return status == 255
+
+
+class PowerExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def executor(self, transport, **kwargs):
+        return rhev_power.PowerExecutor(transport, timeout=kwargs.pop("timeout", 5), backoff=0.01, **kwargs)
+
+    def test_ok(self):
+        targets = [("host1", "10.0.0.1", "pm-suspend"), ("host2", "10.0.0.2", "poweroff")]
+        results = self.executor(standin('echo "$2 $1"')).execute(targets)
+        self.assertEqual([r["result"] for r in results], ["ok", "ok"])
+        self.assertEqual([r["output"] for r in results], ["pm-suspend 10.0.0.1", "poweroff 10.0.0.2"])
+        self.assertEqual([r["attempts"] for r in results], [1, 1])
+
+    def test_retry(self):
+        # Fails the first time for each host, works afterwards
+        flaky = standin('test -e %s/$1 || { touch %s/$1; exit 1; }' % (self.tmpdir, self.tmpdir))
+        result = self.executor(flaky).execute([("host1", "flaky1", "pm-suspend")])[0]
+        self.assertEqual(result["result"], "ok")
+        self.assertEqual(result["attempts"], 2)
+
+    def test_failed(self):
+        result = self.executor(standin('echo "No route to host"; exit 255'), attempts=3).run(
+            ("host1", "bad1", "pm-suspend"))
+        self.assertEqual(result["result"], "failed")
+        self.assertEqual(result["status"], 255)
+        self.assertEqual(result["attempts"], 3)
+        self.assertEqual(result["output"], "No route to host")
+
+    def test_timeout(self):
+        result = self.executor(standin('sleep 30'), timeout=0.5, attempts=2).run(("host1", "hang1", "pm-suspend"))
+        self.assertEqual(result["result"], "timeout")
+        self.assertEqual(result["status"], None)
+        self.assertEqual(result["attempts"], 2)
+        self.assertTrue(result["elapsed"] < 10)
+
+    def test_sent(self):
+        # Host going down while running the action is not retried
+        result = self.executor(DroppedTransport("sh -c 'exit 255' standin")).run(("host1", "10.0.0.1", "poweroff"))
+        self.assertEqual(result["result"], "sent")
+        self.assertEqual(result["attempts"], 1)
+
+    def test_missing_command(self):
+        transport = rhev_power.CommandTransport(os.path.join(self.tmpdir, "missing"))
+        result = self.executor(transport, attempts=1).run(("host1", "10.0.0.1", "poweroff"))
+        self.assertEqual(result["result"], "failed")
+        self.assertEqual(result["status"], 127)
+
+
+class TransportTest(unittest.TestCase):
+    def test_ssh_sent(self):
+        transport = rhev_power.SshTransport(control=None)
+        self.assertTrue(transport.sent(255, "Connection to 10.0.0.1 closed by remote host."))
+        self.assertTrue(transport.sent(255, "packet_write_wait: Broken pipe"))
+        self.assertFalse(transport.sent(255, "ssh: connect to host 10.0.0.1 port 22: No route to host"))
+        self.assertFalse(transport.sent(1, "Connection to 10.0.0.1 closed by remote host."))
+        self.assertFalse(transport.sent(None, ""))
+
+    def test_command_never_sent(self):
+        self.assertFalse(rhev_power.CommandTransport("true").sent(255, "closed by remote host"))
+
+    def test_argv(self):
+        self.assertEqual(rhev_power.CommandTransport("wrapper -x 'a b'").argv("10.0.0.1", "poweroff"),
+                         ["wrapper", "-x", "a b", "10.0.0.1", "poweroff"])
+        argv = rhev_power.SshTransport(key="/tmp/key", control=None).argv("10.0.0.1", "pm-suspend")
+        self.assertEqual(argv[-2:], ["root@10.0.0.1", "pm-suspend"])
+        self.assertFalse([arg for arg in argv if arg.startswith("ControlPath")])
+
+
+if __name__ == "__main__":
+    unittest.main()
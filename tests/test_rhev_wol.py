@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+#
+# Author: Pablo Iranzo Gomez (Pablo.Iranzo@gmail.com)
+#
+# Description: Tests for Wake-on-LAN sender, datagrams go to a socket listening on loopback
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 2 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.    See the
+# GNU General Public License for more details.
+
+import binascii
+import socket
+import unittest
+
+import rhev_wol
+
+MAC = "00:1a:4a:00:00:01"
+OTHER = "00-1a-4a-00-00-02"
+
+
+class WakeTest(unittest.TestCase):
+    def setUp(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(5)
+        self.port = self.sock.getsockname()[1]
+
+    def tearDown(self):
+        self.sock.close()
+
+    def wake(self, macs):
+        # No interfaces makes wake() send unbound datagrams routed to loopback
+        return rhev_wol.wake(macs, devices=[], mode="udp", address="127.0.0.1", port=self.port)
+
+    def test_magic_packet(self):
+        self.assertEqual(self.wake([MAC]), 1)
+        packet = self.sock.recv(1024)
+        self.assertEqual(len(packet), 102)
+        self.assertEqual(packet, b"\xff" * 6 + binascii.unhexlify("001a4a000001") * 16)
+
+    def test_duplicates_sent_once(self):
+        self.assertEqual(self.wake([MAC, OTHER, MAC.upper()]), 2)
+        received = [self.sock.recv(1024), self.sock.recv(1024)]
+        self.assertEqual(received, [rhev_wol.magicpacket(MAC), rhev_wol.magicpacket(OTHER)])
+
+    def test_nothing_to_wake(self):
+        self.assertEqual(self.wake([]), 0)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, self.wake, ["00:1a:4a"])
+        self.assertRaises(ValueError, rhev_wol.wake, [MAC], mode="multicast")
+        self.assertRaises(IOError, rhev_wol.wake, [MAC], devices=[], mode="raw")
+
+
+if __name__ == "__main__":
+    unittest.main()